@@ -0,0 +1,425 @@
+# ==========================================
+# ⚙️ 동시 분석 엔진 (동시성 제한 + 토큰 버킷 + 재시도)
+# ==========================================
+# Streamlit 에 의존하지 않으므로 genai.GenerativeModel 대신
+# generate_content() 만 흉내 내는 가짜 모델로도 그대로 테스트할 수 있다.
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import tax_engine
+import telemetry
+from image_prep import prepare_image
+from material_matcher import get_matcher
+from result_cache import categories_version, make_cache_key
+from tax_engine import safe_float
+
+MODEL_NAME = 'gemini-2.0-flash'
+
+# 일시적인 오류로 보고 재시도할 예외 (google.api_core 를 직접 import 하지 않도록 이름으로 판별)
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "Aborted",
+}
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """초당 rate 개씩 채워지고 최대 capacity 개까지 쌓이는 토큰 버킷 (스레드 안전)."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._clock, self._sleep = clock, sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1.0):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+def is_transient_error(exc):
+    if isinstance(exc, (ConnectionError, TimeoutError)): return True
+    if type(exc).__name__ in TRANSIENT_ERROR_NAMES: return True
+    code = getattr(exc, "code", None)
+    code = getattr(code, "value", code)
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+
+def call_with_retry(fn, limiter=None, max_retries=3, base_delay=1.0, max_delay=20.0, sleep=time.sleep):
+    """limiter 토큰을 받은 뒤 fn() 실행. 일시적 오류면 지수 백오프(+지터)로 재시도한다."""
+    attempt = 0
+    while True:
+        if limiter is not None: limiter.acquire()
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_transient_error(e): raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            sleep(delay * (0.5 + random.random() / 2))
+            attempt += 1
+
+
+def run_ordered(fn, jobs, max_workers=4, on_error=None):
+    """jobs 를 최대 max_workers 개씩 동시에 fn(job) 으로 처리하고 업로드 순서대로 결과를 돌려준다.
+    한 작업이 예외를 던져도 나머지는 계속 진행되며, 그 자리는 on_error(job, exc) 결과로 채워진다."""
+    jobs = list(jobs)
+    if not jobs: return []
+
+    def _safe(job):
+        try:
+            return fn(job)
+        except Exception as e:
+            if on_error is None: raise
+            return on_error(job, e)
+
+    workers = max(1, min(int(max_workers), len(jobs)))
+    if workers == 1: return [_safe(job) for job in jobs]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cbam-analysis") as pool:
+        return list(pool.map(_safe, jobs))
+
+
+# ==========================================
+# 🤖 Gemini 연동 AI 분석 (단건 + 다건 묶음 요청)
+# ==========================================
+class AnalysisContext:
+    """한 번의 분석 실행에 필요한 것들을 묶어 둔다. model 을 넘기지 않으면 처음 쓸 때 Gemini 모델을 만든다.
+    stream=True 이면 단건 요청을 스트리밍으로 받아 항목이 닫히는 대로 on_item(파일명, 순번, 결과 행) 을 부른다
+    (분석 스레드에서 호출되므로 on_item 은 스레드 안전해야 한다)."""
+
+    def __init__(self, cbam_db, model=None, limiter=None, cache=None, prep=None, max_retries=3, batch_size=1,
+                 stream=False, on_item=None):
+        self.cbam_db = cbam_db
+        self._model = model
+        self.limiter, self.cache = limiter, cache
+        self.prep = dict(prep or {})
+        self.max_retries = max_retries
+        self.batch_size = max(1, int(batch_size))
+        self.stream, self.on_item = stream, on_item
+        self.prep_stats = []
+        self._prepared = {}  # 묶음 요청에서 전처리한 결과 (단건 재시도 때 다시 전처리하지 않도록)
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+                self._model = genai.GenerativeModel(MODEL_NAME)
+            return self._model
+
+    def generate(self, parts, stage='analyze_image.model_call'):
+        payload = sum(len(p["data"]) if isinstance(p, dict) else len(str(p)) for p in parts)
+        with telemetry.span(stage, payload_bytes=payload) as s:
+            response = call_with_retry(lambda: self.model.generate_content(parts), limiter=self.limiter, max_retries=self.max_retries)
+            s.tokens(response)
+        return response
+
+    def emit(self, filename, rows, start=0):
+        if self.on_item is None: return
+        for i, row in enumerate(rows, start=start): self.on_item(filename, i, row)
+
+    def prepare(self, image_bytes, filename):
+        """파일당 한 번만 전처리하고 prep_stats 에도 한 번만 남긴다. 묶음 요청에서 만든 결과는
+        응답이 깨져 단건으로 다시 보낼 때 그대로 꺼내 쓴다 (꺼낸 뒤에는 버림)."""
+        key = (filename, image_bytes)
+        with self._lock:
+            prepared = self._prepared.pop(key, None)
+        if prepared is not None: return prepared
+        with telemetry.span('analyze_image.prepare') as s:
+            prepared = prepare_image(image_bytes, filename, **self.prep)
+            s.payload_bytes, s.items = prepared["prepared_bytes"], prepared["pages"]
+        with self._lock:
+            self.prep_stats.append({"File Name": filename, "pages": prepared["pages"],
+                                    "original_bytes": prepared["original_bytes"], "prepared_bytes": prepared["prepared_bytes"]})
+            if self.batch_size > 1: self._prepared[key] = prepared
+        return prepared
+
+    def cache_key(self, image_bytes, prompt):
+        # 동일 이미지 + 프롬프트 + 카테고리 버전 (+ 전처리 설정) 이면 모델 호출 생략
+        return make_cache_key(image_bytes, prompt, f"{categories_version(self.cbam_db)}|{sorted(self.prep.items())}")
+
+
+ITEM_SCHEMA = '{"item": "Item Name", "material": "Category", "weight": 1000, "hs_code": "Extract numbers only"}'
+
+
+def build_prompt(cbam_db):
+    cats_str = ", ".join(list(cbam_db.keys()))
+    # 🚨 [핵심 수정 2] 프롬프트에서 오해를 살 수 있는 HS코드 예시를 제거함
+    return ("You are a CBAM expert. Extract distinct items relevant to CBAM (Iron, Steel, Aluminum, Cement). IGNORE packing materials. \n"
+            f"        Select Material strictly from: [{cats_str}]. \n"
+            f'        Return ONLY valid JSON: {{"items": [{ITEM_SCHEMA}]}}')
+
+
+def build_batch_prompt(cbam_db, file_ids):
+    cats_str = ", ".join(list(cbam_db.keys()))
+    ids = ", ".join(file_ids)
+    return (f"You are a CBAM expert. You will receive {len(file_ids)} separate invoice files ({ids}). "
+            "Each file starts with a text line \"=== FILE <id> ===\" followed by its page images. \n"
+            "For EACH file separately, extract distinct items relevant to CBAM (Iron, Steel, Aluminum, Cement). IGNORE packing materials. \n"
+            f"Select Material strictly from: [{cats_str}]. \n"
+            f'Return ONLY valid JSON keyed by file id: {{"files": {{"<id>": {{"items": [{ITEM_SCHEMA}]}}}}}}. '
+            "Include every file id, with an empty items list if a file has no CBAM items.")
+
+
+def extract_json(text):
+    json_str = text
+    if '```json' in json_str: json_str = json_str.split('```json')[1].split('```')[0]
+    elif '```' in json_str: json_str = json_str.split('```')[1].split('```')[0]
+    return json.loads(json_str.strip())
+
+
+class ItemStreamParser:
+    """스트리밍 응답 조각을 feed() 로 넣으면 "items" 배열 안에서 닫힌 객체를 하나씩 돌려준다.
+    코드 펜스나 앞뒤 설명 문장은 건너뛰고, 배열이 끝난 뒤의 꼬리(펜스, 잘린 텍스트)는 무시한다.
+    깨진 객체 하나는 버리고 다음 객체부터 계속 읽는다."""
+
+    _KEY = '"items"'
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._state = 'seek'  # seek -> array -> done
+        self._depth = 0
+        self._in_str = self._esc = False
+        self._start = None
+
+    def feed(self, chunk):
+        self._text += chunk
+        text, items = self._text, []
+        i = self._pos
+        while i < len(text) and self._state != 'done':
+            if self._state == 'seek':
+                k = text.find(self._KEY, i)
+                if k < 0:
+                    i = max(i, len(text) - len(self._KEY))  # 키가 조각 경계에 걸쳐 있을 수 있음
+                    break
+                j = k + len(self._KEY)
+                while j < len(text) and text[j] in ' \t\r\n:': j += 1
+                if j >= len(text): break  # '[' 가 아직 안 옴 -> 키부터 다시 확인
+                if text[j] == '[': self._state = 'array'
+                i = j + 1
+                continue
+            c = text[i]
+            if self._depth == 0:
+                if c == '{': self._start, self._depth = i, 1
+                elif c == ']': self._state = 'done'
+            elif self._in_str:
+                if self._esc: self._esc = False
+                elif c == '\\': self._esc = True
+                elif c == '"': self._in_str = False
+            elif c == '"': self._in_str = True
+            elif c in '{[': self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    try: obj = json.loads(text[self._start:i + 1])
+                    except ValueError: obj = None
+                    if isinstance(obj, dict): items.append(obj)
+            i += 1
+        self._pos = i
+        return items
+
+
+def _chunk_text(chunk):
+    # 후보가 비어 있는 조각(안전 필터 등)은 .text 접근 시 ValueError
+    try: return chunk.text or ''
+    except (ValueError, AttributeError): return ''
+
+
+def postprocess_items(items_list, filename, username, cbam_db):
+    """모델이 준 원본 항목 -> 재질 보정 / 세금 계산 / 검증을 거친 결과 행 (캐시 적중 시에도 매번 실행)."""
+    matcher = get_matcher(cbam_db.keys())
+    processed_items = []
+    for item in items_list:
+        w = safe_float(item.get('weight', 0))
+        raw_name = item.get('item', '')
+        raw_mat = item.get('material', 'Other')
+
+        # 숫자만 깔끔하게 추출해서 저장
+        ai_hs = ''.join(filter(str.isdigit, str(item.get('hs_code', ''))))
+
+        corrected_mat = matcher.match(raw_name, raw_mat)
+        calc = tax_engine.calculate_tax_logic(corrected_mat, w, cbam_db)
+        final_hs = ai_hs if (ai_hs and ai_hs != '000000') else calc['hs_code']
+
+        validation_result = tax_engine.validate_data(final_hs, corrected_mat, cbam_db)
+
+        processed_items.append({
+            "File Name": filename, "Date": datetime.now().strftime('%Y-%m-%d %H:%M'),
+            "Company": username.upper(), "Item Name": raw_name, "Material": corrected_mat,
+            "Weight (kg)": w, "HS Code": final_hs, "Default Tax (KRW)": calc['bad_tax'],
+            "exchange_rate": calc['exchange_rate'], "Validation": validation_result
+        })
+    return processed_items
+
+
+def failed_result(filename, username):
+    return [{
+        "File Name": filename, "Date": datetime.now().strftime('%Y-%m-%d %H:%M'),
+        "Company": username.upper(), "Item Name": "Analysis Failed", "Material": "Other",
+        "Weight (kg)": 0, "HS Code": "000000", "Default Tax (KRW)": 0,
+        "exchange_rate": 1450, "Validation": "❌ 분석 실패 (에러)"
+    }]
+
+
+def _analyze_streaming(parts, filename, username, ctx):
+    """스트리밍으로 받으며 항목마다 바로 재질 보정/세금/검증 후 ctx.emit.
+    반환: (원본 항목 목록, 결과 행). 다 받은 뒤 전체 텍스트를 기존 펜스 제거 방식으로 다시 파싱해
+    그 결과를 정답으로 삼는다. 꼬리가 깨져 파싱에 실패하면 이미 받은 항목이 있어도 예외를 던져
+    파일 전체를 실패로 처리한다 (부분 결과는 저장 / 캐시 / 과금하지 않음)."""
+    def _consume():
+        parser, chunks, raw, rows = ItemStreamParser(), [], [], []
+        started = time.perf_counter()
+        response = ctx.model.generate_content(parts, stream=True)
+        for chunk in response:
+            text = _chunk_text(chunk)
+            chunks.append(text)
+            for item in parser.feed(text):
+                row = postprocess_items([item], filename, username, ctx.cbam_db)[0]
+                if not rows: telemetry.record('analyze_image.first_item', (time.perf_counter() - started) * 1000, username=username)
+                ctx.emit(filename, [row], start=len(rows))
+                raw.append(item); rows.append(row)
+        return response, ''.join(chunks), raw, rows
+
+    payload = sum(len(p["data"]) if isinstance(p, dict) else len(str(p)) for p in parts)
+    with telemetry.span('analyze_image.model_stream', payload_bytes=payload) as s:
+        # 중간에 끊겨 다시 시도하면 순번 0 부터 다시 emit 되어 화면의 같은 자리를 덮어쓴다
+        response, text, raw, rows = call_with_retry(_consume, limiter=ctx.limiter, max_retries=ctx.max_retries)
+        s.tokens(response)
+        s.items = len(rows)
+
+    try: full = extract_json(text).get('items', [])
+    except ValueError as e:
+        raise ValueError(f"stream tail malformed after {len(raw)} items: {e}") from e
+    if full != raw:
+        rows = postprocess_items(full, filename, username, ctx.cbam_db)
+        ctx.emit(filename, rows)
+    return full, rows
+
+
+def analyze_image(image_bytes, filename, username, ctx):
+    with telemetry.span('analyze_image', payload_bytes=len(image_bytes), username=username) as s:
+        try:
+            prompt = build_prompt(ctx.cbam_db)
+            cache_key = ctx.cache_key(image_bytes, prompt) if ctx.cache is not None else None
+            items_list = ctx.cache.get(cache_key) if ctx.cache is not None else None
+            s.detail['cached'] = items_list is not None
+
+            if items_list is None and ctx.stream:
+                prepared = ctx.prepare(image_bytes, filename)
+                items_list, rows = _analyze_streaming([prompt, *prepared["parts"]], filename, username, ctx)
+                if ctx.cache is not None: ctx.cache.put(cache_key, items_list)
+                s.items = len(rows)
+                return rows
+
+            if items_list is None:
+                prepared = ctx.prepare(image_bytes, filename)
+                response = ctx.generate([prompt, *prepared["parts"]])
+                with telemetry.span('analyze_image.json_extract', payload_bytes=len(response.text)):
+                    items_list = extract_json(response.text).get('items', [])
+                if ctx.cache is not None: ctx.cache.put(cache_key, items_list)
+
+            with telemetry.span('analyze_image.postprocess', items=len(items_list)):
+                rows = postprocess_items(items_list, filename, username, ctx.cbam_db)
+            ctx.emit(filename, rows)
+            s.items = len(rows)
+            return rows
+
+        except Exception as e:
+            print(f"Gemini AI Error: {e}")
+            s.error = type(e).__name__
+            rows = failed_result(filename, username)
+            ctx.emit(filename, rows)
+            return rows
+
+
+def _demux_batch(data, file_ids):
+    """{"files": {id: {"items": [...]}}} (또는 {id: [...]}) -> {id: items}. 형식이 맞지 않는 파일은 빠진다."""
+    files = data.get('files', data) if isinstance(data, dict) else {}
+    out = {}
+    for fid in file_ids:
+        entry = files.get(fid) if isinstance(files, dict) else None
+        if isinstance(entry, dict): entry = entry.get('items')
+        if isinstance(entry, list) and all(isinstance(i, dict) for i in entry): out[fid] = entry
+    return out
+
+
+def _analyze_chunk(chunk, username, ctx):
+    """chunk: [(image_bytes, filename, cache_key)]. 한 번의 요청으로 보내고 파일별 원본 항목을 돌려준다.
+    응답이 깨졌거나 빠진 파일은 None (호출한 쪽에서 단건으로 재시도)."""
+    file_ids = [f"F{i+1}" for i in range(len(chunk))]
+    parts = [build_batch_prompt(ctx.cbam_db, file_ids)]
+    for fid, (image_bytes, filename, _) in zip(file_ids, chunk):
+        parts.append(f"=== FILE {fid} ===")
+        parts.extend(ctx.prepare(image_bytes, filename)["parts"])
+    try:
+        response = ctx.generate(parts, stage='analyze_batch.model_call')
+        with telemetry.span('analyze_batch.json_extract', payload_bytes=len(response.text), items=len(chunk)):
+            by_id = _demux_batch(extract_json(response.text), file_ids)
+    except Exception as e:
+        print(f"Gemini batch error ({len(chunk)} files): {e}")
+        by_id = {}
+    results = []
+    for fid, (image_bytes, filename, cache_key) in zip(file_ids, chunk):
+        items_list = by_id.get(fid)
+        if items_list is not None and ctx.cache is not None: ctx.cache.put(cache_key, items_list)
+        if items_list is not None:  # 성공한 파일은 다시 보낼 일이 없으므로 전처리 결과를 놓아 준다
+            with ctx._lock: ctx._prepared.pop((filename, image_bytes), None)
+        results.append(items_list)
+    return results
+
+
+def analyze_files(jobs, username, ctx, max_workers=4):
+    """jobs: [(image_bytes, filename)] -> 업로드 순서대로 파일별 결과 행 목록.
+
+    ctx.batch_size > 1 이면 캐시에 없는 파일을 batch_size 개씩 묶어 한 요청으로 보내고,
+    묶음 응답에서 빠졌거나 파싱에 실패한 파일만 단건 요청으로 다시 분석한다.
+    """
+    jobs = list(jobs)
+    if ctx.batch_size <= 1:
+        return run_ordered(lambda job: analyze_image(job[0], job[1], username, ctx), jobs,
+                           max_workers=max_workers, on_error=lambda job, e: failed_result(job[1], username))
+
+    prompt = build_prompt(ctx.cbam_db)
+    raw = [None] * len(jobs)
+    pending = []
+    for idx, (image_bytes, filename) in enumerate(jobs):
+        key = ctx.cache_key(image_bytes, prompt) if ctx.cache is not None else None
+        raw[idx] = ctx.cache.get(key) if ctx.cache is not None else None
+        if raw[idx] is None: pending.append((idx, (image_bytes, filename, key)))
+
+    chunks = [pending[i:i + ctx.batch_size] for i in range(0, len(pending), ctx.batch_size)]
+    chunk_results = run_ordered(lambda chunk: _analyze_chunk([job for _, job in chunk], username, ctx), chunks,
+                                max_workers=max_workers, on_error=lambda chunk, e: [None] * len(chunk))
+    for chunk, items_lists in zip(chunks, chunk_results):
+        for (idx, _), items_list in zip(chunk, items_lists): raw[idx] = items_list
+
+    def _finish(idx):
+        image_bytes, filename = jobs[idx]
+        if raw[idx] is None: return analyze_image(image_bytes, filename, username, ctx)
+        try: rows = postprocess_items(raw[idx], filename, username, ctx.cbam_db)
+        except Exception as e:
+            print(f"Gemini AI Error: {e}")
+            rows = failed_result(filename, username)
+        ctx.emit(filename, rows)
+        return rows
+
+    return run_ordered(_finish, range(len(jobs)), max_workers=max_workers,
+                       on_error=lambda idx, e: failed_result(jobs[idx][1], username))
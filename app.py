@@ -1,14 +1,23 @@
+import time
+_SCRIPT_START = time.perf_counter()  # 첫 화면까지 걸린 시간 (맨 아래에서 기록)
 import streamlit as st
-import json
-import base64
-import pandas as pd
-import io
-import google.generativeai as genai
-from datetime import datetime
-import difflib 
+import os
 import uuid
-import time
-import sqlite3
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from result_cache import ResultCache
+import tax_engine
+from cbam_factors import FactorStore
+from user_directory import UserDirectory
+from storage import save_to_db
+import storage
+import job_queue
+import credit_ledger
+import telemetry
+import report_export
+from review_store import ReviewStore
+# pandas / numpy / google.generativeai / analysis_engine 은 처음 쓰는 함수 안에서 import 한다.
+# 로그인 화면은 이 모듈들 없이 그려지므로 서버 시작 직후 첫 화면이 빨리 뜬다.
 
 # ==========================================
 # 🎨 [UI 설정]
@@ -52,7 +61,6 @@ st.markdown("""
 # ==========================================
 try:
     api_key = st.secrets["GEMINI_API_KEY"]
-    genai.configure(api_key=api_key)
 except Exception as e:
     st.error(f"🚨 API 키 오류: Secrets에 'GEMINI_API_KEY'를 설정하세요. ({e})")
     st.stop()
@@ -60,325 +68,228 @@ except Exception as e:
 USER_DB_URL = "https://docs.google.com/spreadsheets/d/e/2PACX-1vRqCIpXf7jM4wyn8EhpoZipkUBQ2K43rEiaNi-KyoaI1j93YPNMLpavW07-LddivnoUL-FKFDMCFPkI/pub?gid=0&single=true&output=csv"
 CBAM_DATA_URL = "https://docs.google.com/spreadsheets/d/e/2PACX-1vRTkYfVcC9EAv_xW0FChVWK3oMsPaxXiRL-hOQQeGT_aLsUG044s1L893er36HVJUpgTCrsM0xElFpW/pub?gid=747982569&single=true&output=csv"
 
-# ------------------------------------------------
-# 💾 데이터베이스(DB) 관리
-# ------------------------------------------------
-def init_db():
-    conn = sqlite3.connect('cbam_database.db', check_same_thread=False)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            date TEXT,
-            filename TEXT,
-            item_name TEXT,
-            material TEXT,
-            weight REAL,
-            hs_code TEXT,
-            tax_krw INTEGER,
-            exchange_rate REAL
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_to_db(data_list):
-    conn = sqlite3.connect('cbam_database.db', check_same_thread=False)
-    c = conn.cursor()
-    for item in data_list:
-        c.execute('''
-            INSERT INTO history (username, date, filename, item_name, material, weight, hs_code, tax_krw, exchange_rate)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            item['Company'], item['Date'], item['File Name'], item['Item Name'], 
-            item['Material'], item['Weight (kg)'], item['HS Code'], 
-            item['Default Tax (KRW)'], item['exchange_rate']
-        ))
-    conn.commit()
-    conn.close()
-
-def load_from_db(username):
-    conn = sqlite3.connect('cbam_database.db', check_same_thread=False)
-    target_user = str(username).upper().strip()
-    df = pd.read_sql_query("SELECT * FROM history WHERE username = ?", conn, params=(target_user,))
-    conn.close()
-    
-    if not df.empty:
-        df = df.rename(columns={
-            'date': 'Date', 'filename': 'File Name', 'item_name': 'Item Name',
-            'material': 'Material', 'weight': 'Weight (kg)', 'hs_code': 'HS Code',
-            'tax_krw': 'Default Tax (KRW)', 'exchange_rate': 'exchange_rate', 'username': 'Company'
-        })
-        df = df.sort_values(by='id', ascending=False)
-    return df
-
-init_db()
-
-@st.cache_data(ttl=60)
-def load_user_data():
-    try:
-        df = pd.read_csv(USER_DB_URL)
-        df.columns = df.columns.str.strip().str.lower()
-        df['username'] = df['username'].astype(str).str.strip()
-        df['password'] = df['password'].astype(str).str.strip()
-        df['active'] = df['active'].astype(str).str.strip().str.lower()
-        if 'credits' not in df.columns: df['credits'] = 0
-        df['credits'] = pd.to_numeric(df['credits'], errors='coerce').fillna(0).astype(int)
-        return df
-    except: return pd.DataFrame()
-
-@st.cache_data(ttl=600) 
-def load_cbam_db():
-    master_db = {
-        "Steel (Pipes/Tubes)": {"default": 2.50, "optimized": 1.9, "hs_code": "730400", "price": 85.0, "exchange_rate": 1450},
-        "Steel (Wire)": {"default": 2.20, "optimized": 1.6, "hs_code": "721700", "price": 85.0, "exchange_rate": 1450},
-    }
-    try:
-        df = pd.read_csv(CBAM_DATA_URL)
-        first_cell = str(df.iloc[0,0]).strip().lower()
-        if 'category' not in df.columns.str.lower() and first_cell == 'category':
-            new_header = df.iloc[0]
-            df = df[1:]
-            df.columns = new_header
-        
-        cols = {c.strip().lower(): c for c in df.columns}
-        rate_col = next((cols[k] for k in cols if 'exch' in k and 'rate' in k), None)
-        hs_col = next((cols[k] for k in cols if 'hs' in k and 'code' in k), None)
-        cat_col = next((cols[k] for k in cols if 'cat' in k), None)
-
-        if cat_col:
-            for _, row in df.iterrows():
-                if pd.isna(row[cat_col]): continue
-                cat = str(row[cat_col]).strip()
-                
-                rate_val = 1450.0
-                if rate_col:
-                    try: rate_val = float(str(row[rate_col]).replace(',', '').strip())
-                    except: pass
-                
-                hs_val = '000000'
-                if hs_col:
-                    raw_hs = str(row[hs_col]).strip()
-                    if raw_hs != 'nan' and raw_hs != '': hs_val = raw_hs.split('.')[0]
-                
-                def_val, opt_val = 0.0, 0.0
-                for c in df.columns:
-                    c_lower = str(c).lower()
-                    if 'default' in c_lower:
-                         try: def_val = float(str(row[c]).strip())
-                         except: pass
-                    if 'optimized' in c_lower:
-                         try: opt_val = float(str(row[c]).strip())
-                         except: pass
-
-                master_db[cat] = {
-                    "default": def_val, "optimized": opt_val, "hs_code": hs_val, 
-                    "price": 85.0, "exchange_rate": rate_val
-                }
-    except Exception as e: pass 
-    return master_db
-
-user_df = load_user_data()
-CBAM_DB = load_cbam_db()
-
-def safe_float(value):
-    try: return float(str(value).replace(',', '').replace('kg', '').replace('KG', '').strip())
-    except: return 0.0
+# 동시 분석 설정 (Secrets 로 조정 가능)
+ANALYSIS_CONCURRENCY = int(st.secrets.get("ANALYSIS_CONCURRENCY", 4))
+GEMINI_RPM = float(st.secrets.get("GEMINI_RPM", 60))
+GEMINI_MAX_RETRIES = int(st.secrets.get("GEMINI_MAX_RETRIES", 3))
+GEMINI_BATCH_SIZE = int(st.secrets.get("GEMINI_BATCH_SIZE", 1))  # 2 이상이면 여러 인보이스를 한 요청으로 묶음
+GEMINI_STREAM = bool(st.secrets.get("GEMINI_STREAM", True))  # 단건 요청을 스트리밍으로 받아 항목이 나오는 대로 표시
+ADMIN_USERS = {u.strip().upper() for u in str(st.secrets.get("ADMIN_USERS", "")).split(',') if u.strip()}  # 성능 탭을 볼 수 있는 아이디
+if st.secrets.get("TELEMETRY_OTEL", False): telemetry.enable_otel()
+JOB_QUEUE_WORKERS = int(st.secrets.get("JOB_QUEUE_WORKERS", 0))  # 1 이상이면 별도 워커 프로세스가 작업 큐로 분석
+
+# 이미지 전처리 설정 (최대 해상도 / 흑백 / JPEG 품질)
+REVIEW_PAGE_SIZE = int(st.secrets.get("REVIEW_PAGE_SIZE", 50))  # 검토 표 한 페이지 행 수
+
+IMAGE_PREP = {
+    "max_side": int(st.secrets.get("IMAGE_MAX_SIDE", 2000)),
+    "grayscale": bool(st.secrets.get("IMAGE_GRAYSCALE", True)),
+    "quality": int(st.secrets.get("IMAGE_JPEG_QUALITY", 80)),
+}
+
+@st.cache_resource
+def configure_gemini():
+    # 첫 분석 때 한 번만 import / 설정 (import 에만 1초 가까이 걸려 시작 시점에서 뺐다)
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return True
+
+@st.cache_resource
+def get_rate_limiter():
+    # 모든 세션이 같은 API 키를 쓰므로 프로세스 전체에서 하나의 버킷을 공유
+    from analysis_engine import TokenBucket
+    return TokenBucket(rate=GEMINI_RPM / 60.0, capacity=max(1, ANALYSIS_CONCURRENCY))
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(
+        max_entries=int(st.secrets.get("RESULT_CACHE_MAX_ENTRIES", 5000)),
+        max_age_days=int(st.secrets.get("RESULT_CACHE_MAX_AGE_DAYS", 90)),
+    )
+
+@st.cache_resource
+def get_worker_pool():
+    # 세션이 아니라 서버 프로세스당 한 번만 워커를 띄운다
+    return job_queue.WorkerPool(JOB_QUEUE_WORKERS, {
+        'api_key': api_key, 'factor_url': CBAM_DATA_URL, 'factor_max_age': int(st.secrets.get("CBAM_FACTOR_MAX_AGE", 600)),
+        'rpm': GEMINI_RPM, 'max_retries': GEMINI_MAX_RETRIES, 'prep': IMAGE_PREP, 'batch_size': GEMINI_BATCH_SIZE,
+    })
+
+def sync_user_credits(users):
+    # 시트에서 credits 가 바뀐 사용자만 원장 잔액에 반영 (UserDirectory 가 바뀐 항목만 넘겨 줌)
+    credit_ledger.sync_accounts([(u['username'], u['credits']) for u in users])
+
+@st.cache_resource
+def get_user_directory():
+    # 사용자 시트는 백그라운드에서 받는다 (로그인 버튼을 누를 때만 첫 다운로드를 기다림)
+    return UserDirectory(USER_DB_URL, max_age=60, on_change=sync_user_credits)
+
+def load_user_data(wait=15):
+    return get_user_directory().get(wait=wait)
+
+@st.cache_resource
+def get_factor_store():
+    # 스냅샷이 없는 첫 실행도 내장 계수로 바로 시작하고, 시트는 백그라운드에서 받는다
+    return FactorStore(CBAM_DATA_URL, max_age=int(st.secrets.get("CBAM_FACTOR_MAX_AGE", 600)), background=True)
+
+def load_cbam_db(wait=0):
+    # 로컬 스냅샷을 즉시 반환하고, 오래됐으면 백그라운드에서 갱신
+    return get_factor_store().get(wait=wait)
+
+# 로그인 화면을 그리는 동안 두 시트를 미리 받아 둔다 (여기서는 기다리지 않음)
+get_user_directory()
+get_factor_store()
+CBAM_DB = None  # 로그인 후에 채운다
 
 def force_match_material(ai_item_name, ai_material, db_keys):
-    name_lower, mat_lower = str(ai_item_name).lower(), str(ai_material).lower()
-    
-    if "pipe" in name_lower or "tube" in name_lower:
-        found = [k for k in db_keys if "Pipes" in k]
-        if found: 
-             if "alum" in name_lower: return "Aluminum (Pipes/Tubes)"
-             return "Steel (Pipes/Tubes)"
-             
-    if "wire" in name_lower or "cable" in name_lower:
-        found = [k for k in db_keys if "Wire" in k]
-        if found: return found[0]
-        
-    if "structure" in name_lower or "beam" in name_lower:
-        found = [k for k in db_keys if "Structures" in k]
-        if found: return found[0]
-        
-    if "bolt" in name_lower or "screw" in name_lower or "nut" in name_lower or "washer" in name_lower:
-        found = [k for k in db_keys if "Bolt" in k or "Screw" in k]
-        if found: return found[0]
-        
-    if "aluminum" in name_lower or "aluminium" in name_lower:
-        found = [k for k in db_keys if "Aluminum" in k]
-        if "ingot" in name_lower: return "Aluminum (Ingots)"
-        if "bar" in name_lower or "rod" in name_lower: return "Aluminum (Bars/Rods)"
-        if "foil" in name_lower: return "Aluminum (Foil)"
-        if "plate" in name_lower or "sheet" in name_lower: return "Aluminum (Sheets/Plates)"
-        if found: return found[0]
-
-    if "cement" in name_lower or "cmnt" in name_lower:
-        found = [k for k in db_keys if "cement" in k.lower()]
-        if found: return found[0]
-
-    matches = difflib.get_close_matches(ai_material, db_keys, n=1, cutoff=0.4)
-    if matches: return matches[0]
-    return "Other"
+    # 카테고리 목록별로 한 번 컴파일된 매처를 재사용 (규칙은 material_matcher.py 참고)
+    from material_matcher import get_matcher
+    return get_matcher(db_keys).match(ai_item_name, ai_material)
 
 # ==========================================
 # 🧮 핵심 로직 & 데이터 검증 시스템 (불순물 제거 필터 장착)
 # ==========================================
 def calculate_tax_logic(material, weight):
-    db = CBAM_DB.get(material, {"default":0, "optimized":0, "price":0, "exchange_rate":1450})
-    if weight <= 0: weight = 0.0
-    rate = db.get('exchange_rate', 1450.0)
-    
-    bad_tax = int((weight/1000) * db['default'] * db['price'] * rate)
-    
-    return {
-        "bad_tax": bad_tax, "material_display": material, "weight": weight, 
-        "hs_code": db.get('hs_code', '000000'), "exchange_rate": rate
-    }
+    return tax_engine.calculate_tax_logic(material, weight, CBAM_DB)
 
 def validate_data(ai_hs, ai_mat):
-    db_hs = CBAM_DB.get(ai_mat, {}).get('hs_code', '000000')
-    if ai_mat == "Other": return "⚠️ 미등록 카테고리 (수동 확인 필요)"
-    
-    # 🚨 [핵심 수정 1] AI가 가져온 글자에서 '숫자'만 완벽하게 추출해서 비교
-    clean_ai = ''.join(filter(str.isdigit, str(ai_hs)))
-    clean_db = ''.join(filter(str.isdigit, str(db_hs)))
-    
-    # 앞 4자리 비교 (숫자가 없으면 무조건 에러 방지)
-    if not clean_ai or clean_ai[:4] != clean_db[:4]: 
-        return f"🚩 HS코드 불일치 (DB권장: {db_hs})"
-    
-    return "✅ 검증 완료 (정상)"
+    return tax_engine.validate_data(ai_hs, ai_mat, CBAM_DB)
 
 # ==========================================
 # 📊 KTC 표준 리포트 출력
 # ==========================================
 def generate_official_excel(data_list):
-    if isinstance(data_list, pd.DataFrame):
-        if data_list.empty: return None
-        data_list = data_list.to_dict('records')
-    if not data_list: return None
-
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        wb = writer.book
-        fmt_header = wb.add_format({'bold': True, 'fg_color': '#004494', 'font_color': 'white', 'border': 1, 'align':'center'})
-        fmt_ktc_head = wb.add_format({'bold': True, 'bg_color': '#D7E4BC', 'border': 1, 'align':'center'})
-        fmt_num = wb.add_format({'border': 1, 'num_format': '#,##0.00'})
-        fmt_eur = wb.add_format({'border': 1, 'num_format': '€#,##0.00'})
-        fmt_krw = wb.add_format({'border': 1, 'num_format': '₩#,##0'})
-        fmt_warn = wb.add_format({'border': 1, 'font_color': 'red'})
-        fmt_ok = wb.add_format({'border': 1, 'align':'center'})
-
-        ws2 = wb.add_worksheet("KTC_CBAM_Submission")
-        ws2.merge_range('A1:I1', f"CBAM Official Data (Ref: EU Regulation 2026/XXXX) - Integrity Checked", fmt_ktc_head)
-        
-        headers2 = ["No", "Origin", "HS Code", "Item Name", "Net Weight(t)", "Emission Factor", "Est. Tax (EUR)", "Est. Tax (KRW)", "Data Validation"]
-        for c, h in enumerate(headers2): ws2.write(1, c, h, fmt_header)
-        
-        for i, d in enumerate(data_list):
-            r = i + 2
-            w_ton = d.get('Weight (kg)', 0) / 1000
-            mat = d.get('Material', 'Iron/Steel')
-            factor = CBAM_DB.get(mat, {}).get('default', 0)
-            rate = d.get('exchange_rate', 1450)
-            val_msg = d.get('Validation', '✅ 검증 완료')
-            
-            ws2.write(r, 0, i+1, fmt_ok)
-            ws2.write(r, 1, "KR", fmt_ok)
-            ws2.write(r, 2, d.get('HS Code', ''), fmt_ok)
-            ws2.write(r, 3, d.get('Item Name', ''), fmt_ok)
-            ws2.write(r, 4, w_ton, fmt_num)
-            ws2.write(r, 5, factor, fmt_num)
-            ws2.write(r, 6, (d.get('Default Tax (KRW)', 0)/rate) if rate>0 else 0, fmt_eur)
-            ws2.write(r, 7, d.get('Default Tax (KRW)', 0), fmt_krw)
-            
-            if "🚩" in val_msg or "⚠️" in val_msg: ws2.write(r, 8, val_msg, fmt_warn)
-            else: ws2.write(r, 8, val_msg, fmt_ok)
-            
-        ws2.set_column('A:A', 5)
-        ws2.set_column('B:I', 18)
-
-    return output.getvalue()
+    return report_export.generate_official_excel(data_list, CBAM_DB)
 
 # ==========================================
 # 🤖 Gemini 연동 AI 분석
 # ==========================================
-def analyze_image(image_bytes, filename, username):
-    try:
-        model = genai.GenerativeModel('gemini-2.0-flash') 
-        cats_str = ", ".join(list(CBAM_DB.keys()))
-        
-        # 🚨 [핵심 수정 2] 프롬프트에서 오해를 살 수 있는 HS코드 예시를 제거함
-        prompt = f"""You are a CBAM expert. Extract distinct items relevant to CBAM (Iron, Steel, Aluminum, Cement). IGNORE packing materials. 
-        Select Material strictly from: [{cats_str}]. 
-        Return ONLY valid JSON: {{"items": [{{"item": "Item Name", "material": "Category", "weight": 1000, "hs_code": "Extract numbers only"}}]}}"""
-        
-        response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_bytes}])
-        
-        json_str = response.text
-        if '```json' in json_str: json_str = json_str.split('```json')[1].split('```')[0]
-        elif '```' in json_str: json_str = json_str.split('```')[1].split('```')[0]
-            
-        items_list = json.loads(json_str.strip()).get('items', [])
-        
-        processed_items = []
-        for item in items_list:
-            w = safe_float(item.get('weight', 0))
-            raw_name = item.get('item', '')
-            raw_mat = item.get('material', 'Other')
-            
-            # 숫자만 깔끔하게 추출해서 저장
-            ai_hs = ''.join(filter(str.isdigit, str(item.get('hs_code', ''))))
-            
-            corrected_mat = force_match_material(raw_name, raw_mat, list(CBAM_DB.keys()))
-            calc = calculate_tax_logic(corrected_mat, w)
-            final_hs = ai_hs if (ai_hs and ai_hs != '000000') else calc['hs_code']
-            
-            validation_result = validate_data(final_hs, corrected_mat)
-            
-            processed_items.append({
-                "File Name": filename, "Date": datetime.now().strftime('%Y-%m-%d %H:%M'),
-                "Company": username.upper(), "Item Name": raw_name, "Material": corrected_mat,
-                "Weight (kg)": w, "HS Code": final_hs, "Default Tax (KRW)": calc['bad_tax'],
-                "exchange_rate": calc['exchange_rate'], "Validation": validation_result
-            })
-        return processed_items
-        
-    except Exception as e:
-        print(f"Gemini AI Error: {e}")
-        return [{
-            "File Name": filename, "Item Name": "Analysis Failed", "Material": "Other", 
-            "Weight (kg)": 0, "HS Code": "000000", "Default Tax (KRW)": 0, 
-            "exchange_rate": 1450, "Validation": "❌ 분석 실패 (에러)"
-        }]
+LIVE_COLUMNS = ['File Name', 'Item Name', 'Material', 'Weight (kg)', 'HS Code', 'Default Tax (KRW)', 'Validation']
+
+def analyze_with_live_view(jobs, username, ctx):
+    # 분석은 별도 스레드에서 돌리고, 이 스레드는 나오는 항목을 모아 표를 갱신한다 (st.* 는 스크립트 스레드에서만)
+    import pandas as pd
+    from analysis_engine import analyze_files
+    items_q = queue.SimpleQueue()
+    ctx.on_item = lambda filename, idx, row: items_q.put((filename, idx, row))
+    live = st.empty()
+    shown = {}
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="cbam-live") as ex:
+        future = ex.submit(analyze_files, jobs, username, ctx, ANALYSIS_CONCURRENCY)
+        while True:
+            finished = future.done()
+            changed = False
+            while not items_q.empty():
+                filename, idx, row = items_q.get()
+                shown[(filename, idx)] = row  # 재시도로 다시 온 항목은 같은 자리를 덮어쓴다
+                changed = True
+            if changed:
+                live.dataframe(pd.DataFrame(list(shown.values()), columns=LIVE_COLUMNS), hide_index=True, use_container_width=True)
+            if finished: break
+            time.sleep(0.25)
+        per_file = future.result()
+    live.empty()
+    return per_file
 
 def process_analysis():
     uploaded_files = st.session_state.get('upl_files', [])
     if uploaded_files:
-        current_credits = st.session_state.get('credits', 0)
-        required_credits = len(uploaded_files)
-        is_unlimited = current_credits >= 999999
-        
-        if is_unlimited or (current_credits >= required_credits):
+        # 파일마다 1 크레딧을 원장에서 먼저 예약한다 (동시에 여러 배치가 와도 잔액 이상으로 나가지 않음)
+        reservations = credit_ledger.reserve(st.session_state['username'], [f.name for f in uploaded_files])
+
+        if reservations is not None:
             st.session_state['run_id'] = str(uuid.uuid4())
-            
-            with st.spinner("Gemini 엔진이 KTC 규격에 맞춰 정밀 분석 중입니다..."):
-                all_results = []
+
+            if JOB_QUEUE_WORKERS > 0:
+                # 큐에 넣고 바로 돌아온다. 진행 상황은 show_job_progress() 가 주기적으로 확인
+                # (예약은 워커가 파일 결과를 저장할 때 확정 / 환불)
+                files = []
                 for file in uploaded_files:
                     file.seek(0)
-                    items = analyze_image(file.read(), file.name, st.session_state['username'])
-                    all_results.extend(items) if isinstance(items, list) else all_results.append(items)
-                
-                st.session_state['batch_results'] = all_results
-                save_to_db(all_results)
-                
-                if not is_unlimited: st.session_state['credits'] -= required_credits
-                st.toast("✅ KTC 표준 분석 및 검증 완료!")
+                    files.append((file.read(), file.name))
+                get_worker_pool().ensure_alive()
+                st.session_state['active_job'] = job_queue.enqueue_job(st.session_state['username'], files, reservations=reservations)
+                st.session_state['batch_results'] = None
+                st.session_state['prep_stats'] = []
+                st.toast("📮 분석 작업이 대기열에 등록되었습니다.")
+                return
+
+            settled = False
+            try:
+                with st.spinner("Gemini 엔진이 KTC 규격에 맞춰 정밀 분석 중입니다..."):
+                    settled = analyze_reserved(uploaded_files, reservations)
+            finally:
+                if not settled: credit_ledger.refund(reservations)  # 중간에 예외가 나면 전부 돌려준다
+            st.toast("✅ KTC 표준 분석 및 검증 완료!")
         else: st.error("🚫 크레딧 부족!")
 
+def analyze_reserved(uploaded_files, reservations):
+    username = st.session_state['username']
+    jobs = []
+    for file in uploaded_files:
+        file.seek(0)
+        jobs.append((file.read(), file.name))
+
+    # 전체 소요 시간 (단계별 시간은 analysis_engine / storage 에서 따로 기록)
+    with telemetry.span('process_analysis', username=username, items=len(jobs), payload_bytes=sum(len(j[0]) for j in jobs)):
+        from analysis_engine import AnalysisContext
+        configure_gemini()
+        ctx = AnalysisContext(  # 모델은 첫 요청 때 만든다 (model=None)
+            CBAM_DB, limiter=get_rate_limiter(), cache=get_result_cache(),
+            prep=IMAGE_PREP, max_retries=GEMINI_MAX_RETRIES, batch_size=GEMINI_BATCH_SIZE, stream=GEMINI_STREAM,
+        )
+        per_file = analyze_with_live_view(jobs, username, ctx)
+
+        all_results = []
+        for items in per_file:
+            all_results.extend(items) if isinstance(items, list) else all_results.append(items)
+
+        st.session_state['batch_results'] = all_results
+        st.session_state['prep_stats'] = ctx.prep_stats
+        save_to_db(all_results)
+
+    # 분석에 실패한 파일(❌ 행)의 크레딧은 환불, 나머지는 확정
+    ok = [not any(str(r.get('Validation', '')).startswith('❌') for r in (items if isinstance(items, list) else [items])) for items in per_file]
+    credit_ledger.settle(reservations, ok)
+    return True
+
+def get_review_store():
+    # 분석 실행(run_id)마다 한 번만 만들고, 이후 수정은 바뀐 행만 다시 계산
+    run_id = st.session_state['run_id']
+    store = st.session_state.get('review_store')
+    if store is None or st.session_state.get('review_run') != run_id:
+        store = ReviewStore(st.session_state['batch_results'], CBAM_DB)
+        st.session_state.update({'review_store': store, 'review_run': run_id})
+    return store
+
+def apply_review_edits(editor_key, keys):
+    store = get_review_store()
+    for pos, changes in st.session_state[editor_key].get('edited_rows', {}).items():
+        store.update(keys[int(pos)], changes)
+    if store.dirty:
+        n_saved = store.flush(st.session_state['username'])
+        if n_saved: st.toast(f"💾 {n_saved}건 수정 내용을 기록에 반영했습니다.")
+
+@st.fragment(run_every=2)
+def show_job_progress():
+    job_id = st.session_state.get('active_job')
+    if not job_id: return
+    prog = job_queue.job_progress(job_id)
+    if prog is None:
+        st.session_state['active_job'] = None
+        return
+    finished = prog['done'] + prog['failed']
+    if prog['status'] != 'done':
+        get_worker_pool().ensure_alive()
+        st.progress(finished / prog['total'] if prog['total'] else 0.0,
+                    text=f"⏳ 분석 중... {finished}/{prog['total']} (진행 {prog['running']} · 대기 {prog['queued']} · 실패 {prog['failed']})")
+        return
+    st.session_state['batch_results'] = job_queue.job_results(job_id)
+    st.session_state['active_job'] = None
+    st.session_state['run_id'] = str(uuid.uuid4())
+    st.toast("✅ KTC 표준 분석 및 검증 완료!")
+    st.rerun()
+
 # ==========================================
 # 🖥️ 화면 구성
 # ==========================================
@@ -394,74 +305,187 @@ if not st.session_state['logged_in']:
             username = st.text_input("아이디")
             password = st.text_input("비밀번호", type="password")
             if st.button("로그인", type="primary", use_container_width=True):
-                match = user_df[(user_df['username'] == username) & (user_df['password'].astype(str) == password) & (user_df['active'] == 'o')]
-                if not match.empty:
-                    st.session_state.update({'logged_in': True, 'username': username, 'credits': int(match.iloc[0]['credits'])})
+                if load_user_data() is None: st.error("⏳ 사용자 목록을 불러오지 못했습니다. 잠시 후 다시 시도하세요."); st.stop()
+                user = get_user_directory().authenticate(username, password)
+                if user is not None:
+                    role = user.get('role', '').lower()
+                    # 잔여 크레딧은 원장(credit_ledger)에서 읽는다. 오래 확정되지 않은 예약은 여기서 정리
+                    credit_ledger.sync_accounts([(user['username'], user['credits'])])
+                    credit_ledger.expire_reservations()
+                    st.session_state.update({'logged_in': True, 'username': username,
+                                             'is_admin': role == 'admin' or username.strip().upper() in ADMIN_USERS})
+                    # 이전 접속에서 끝나지 않은 작업이 있으면 이어서 진행 상황을 보여준다
+                    pending = job_queue.active_jobs(username)
+                    if pending: st.session_state['active_job'] = pending[-1]
                     st.rerun()
                 else: st.error("❌ 로그인 실패")
 else:
+    # 스냅샷이 없는 첫 실행이면 시트 다운로드를 잠시 기다린다 (실패하면 내장 계수)
+    CBAM_DB = load_cbam_db(wait=15)
     with st.sidebar:
         st.title("CBAM Master (Gemini)")
         st.success("🟢 EU Reg 2026 Engine Online")
+        st.caption(f"📚 CBAM 계수 버전 {getattr(CBAM_DB, 'version', 'n/a')} · {int(getattr(CBAM_DB, 'age', 0) // 60)}분 전 갱신")
         st.write(f"👤 **{st.session_state['username'].upper()}** 님")
-        st.metric("잔여 크레딧", "♾️ 무제한 (VIP)" if st.session_state.get('credits',0) >= 999999 else f"{st.session_state.get('credits',0)} 회")
+        acct = credit_ledger.account(st.session_state['username']) or {'balance': 0, 'unlimited': False, 'reserved': 0}
+        st.metric("잔여 크레딧", "♾️ 무제한 (VIP)" if acct['unlimited'] else f"{acct['balance']} 회")
+        if acct['reserved'] and not acct['unlimited']: st.caption(f"⏳ 분석 중 예약된 크레딧 {acct['reserved']}회")
+        cache_stats = get_result_cache().stats()
+        cache_entries = '?' if cache_stats['entries'] is None else cache_stats['entries']
+        st.caption(f"🗃️ 분석 캐시: 적중 {cache_stats['hits']} / 미적중 {cache_stats['misses']} ({cache_entries}건 저장)")
         if st.button("로그아웃"): st.session_state['logged_in'] = False; st.rerun()
 
-    tab1, tab2 = st.tabs(["🚀 KTC 정밀 분석 (Analysis)", "🕒 기록 관리 (History)"])
+    tab_names = ["🚀 KTC 정밀 분석 (Analysis)", "🕒 기록 관리 (History)"]
+    if st.session_state.get('is_admin'): tab_names.append("📈 성능 (Admin)")
+    tabs = st.tabs(tab_names)
+    tab1, tab2 = tabs[0], tabs[1]
 
     with tab1:
         st.markdown("### 📄 인보이스 분석 및 KTC 데이터 검증")
         with st.container(border=True):
-            uploaded_files = st.file_uploader("파일 추가 (Drag & Drop)", type=["jpg", "png", "jpeg"], accept_multiple_files=True, key="upl_files")
-            if uploaded_files: st.button(f"🚀 Gemini 엔진 분석 시작", type="primary", on_click=process_analysis)
+            uploaded_files = st.file_uploader("파일 추가 (Drag & Drop)", type=["jpg", "png", "jpeg", "webp", "tif", "tiff", "pdf"], accept_multiple_files=True, key="upl_files")
+            if uploaded_files:
+                import image_prep
+                if not image_prep.PDF_SPLIT_AVAILABLE and any(f.name.lower().endswith('.pdf') for f in uploaded_files):
+                    st.caption("ℹ️ pypdfium2 가 설치되지 않아 PDF 는 페이지로 나누지 않고 원본 그대로 전송합니다 (용량 최적화 없음).")
+                st.button(f"🚀 Gemini 엔진 분석 시작", type="primary", on_click=process_analysis)
+        show_job_progress()
 
         if st.session_state['batch_results']:
             st.divider()
             st.subheader("📊 검증 결과 및 KTC 리포트 출력")
-            results = st.session_state['batch_results']
+            store = get_review_store()
             
             m1, m2, m3 = st.columns(3)
-            m1.metric("추출 항목 수", f"{len(results)} 개")
-            m2.metric("총 중량", f"{sum([safe_float(r.get('Weight (kg)',0)) for r in results]):,.0f} kg")
+            m1.metric("추출 항목 수", f"{len(store)} 개")
+            m2.metric("총 중량", f"{store.total_weight:,.0f} kg")
             m3.metric("EU 규정 준수 검증", "완료 (EU Reg 2026)")
+            prep_stats = st.session_state.get('prep_stats') or []
+            if prep_stats:
+                orig_total = sum(p['original_bytes'] for p in prep_stats)
+                sent_total = sum(p['prepared_bytes'] for p in prep_stats)
+                st.caption(f"📉 이미지 최적화: {orig_total/1e6:,.1f} MB → {sent_total/1e6:,.1f} MB 전송 ({(1 - sent_total/orig_total)*100 if orig_total else 0:.0f}% 절감, {sum(p['pages'] for p in prep_stats)} 페이지)")
+            if store.n_mismatch: st.error(f"🚩 HS코드 불일치 {store.n_mismatch}건 — 표에서 재질/HS 코드를 확인하세요.")
+            if store.n_warning: st.warning(f"⚠️ 수동 확인 필요 {store.n_warning}건")
+            st.caption(f"💰 예상 세금 합계: ₩{store.total_tax:,.0f}")
 
             mat_options = list(CBAM_DB.keys())
             if "Other" not in mat_options: mat_options.append("Other")
 
-            updated_final_results = []
-            current_run_id = st.session_state['run_id'] 
-
-            for idx, row in enumerate(results):
-                val_status = row.get('Validation', '')
-                if "🚩" in val_status: st.error(f"[{row.get('Item Name')}] {val_status}")
-                elif "⚠️" in val_status: st.warning(f"[{row.get('Item Name')}] {val_status}")
-                
-                with st.expander(f"📄 {row.get('File Name','')} - {row.get('Item Name','')} | {val_status}", expanded=False):
-                    c1, c2, c3 = st.columns([2, 1, 1])
-                    
-                    unique_key = f"{idx}_{current_run_id}"
-                    
-                    curr_mat = row.get('Material', 'Other')
-                    new_mat = c1.selectbox("재질", mat_options, index=mat_options.index(curr_mat) if curr_mat in mat_options else len(mat_options)-1, key=f"m_{unique_key}")
-                    new_hs = c2.text_input("HS Code", value=str(row.get('HS Code', '')), key=f"h_{unique_key}")
-                    new_weight = c3.number_input("중량 (kg)", value=safe_float(row.get('Weight (kg)', 0)), key=f"w_{unique_key}")
-                    
-                    recalc = calculate_tax_logic(new_mat, new_weight)
-                    new_val = validate_data(new_hs, new_mat)
-                    
-                    row.update({'Material': new_mat, 'HS Code': new_hs, 'Weight (kg)': new_weight, 
-                                'Default Tax (KRW)': recalc['bad_tax'], 'exchange_rate': recalc['exchange_rate'],
-                                'Validation': new_val})
-                    updated_final_results.append(row)
+            # 한 페이지만 표(data_editor)로 그리고, 수정된 행만 on_change 에서 다시 계산한다
+            current_run_id = st.session_state['run_id']
+            n_pages = max(1, -(-len(store) // REVIEW_PAGE_SIZE))
+            page = st.number_input(f"페이지 (총 {n_pages})", min_value=1, max_value=n_pages, key=f"review_page_{current_run_id}") - 1 if n_pages > 1 else 0
+            page_keys = store.page(page, REVIEW_PAGE_SIZE)
+            review_cols = ['File Name', 'Item Name', 'Material', 'HS Code', 'Weight (kg)', 'Default Tax (KRW)', 'Validation']
+            import pandas as pd
+            page_df = pd.DataFrame(store.records(page_keys), columns=review_cols)
+            # 수정이 반영될 때마다 version 이 바뀌어 표가 새 계산 결과로 다시 그려진다
+            editor_key = f"review_{current_run_id}_{page}_{store.version}"
+            st.data_editor(
+                page_df, key=editor_key, hide_index=True, use_container_width=True,
+                disabled=['File Name', 'Item Name', 'Default Tax (KRW)', 'Validation'],
+                column_config={
+                    'Material': st.column_config.SelectboxColumn("재질", options=mat_options, required=True),
+                    'HS Code': st.column_config.TextColumn("HS Code"),
+                    'Weight (kg)': st.column_config.NumberColumn("중량 (kg)", min_value=0.0, format="%.2f"),
+                    'Default Tax (KRW)': st.column_config.NumberColumn("예상 세금 (KRW)", format="₩%d"),
+                },
+                on_change=apply_review_edits, args=(editor_key, page_keys),
+            )
 
             st.markdown("<br>", unsafe_allow_html=True)
-            excel_data = generate_official_excel(updated_final_results)
-            if excel_data:
-                st.download_button("📥 KTC 제출용 공식 리포트 다운로드 (Excel)", data=excel_data, file_name=f"CBAM_KTC_Report.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", type="primary", use_container_width=True)
+            # 리포트는 요청할 때만 생성 (같은 내용이면 이전에 만든 파일 재사용)
+            report_path = report_export.build_batch_report(store.records(), CBAM_DB, build=False)
+            if report_path is None and st.button("📊 KTC 제출용 리포트 생성", use_container_width=True):
+                with st.spinner("리포트 생성 중..."):
+                    report_path = report_export.build_batch_report(store.records(), CBAM_DB)
+            if report_path:
+                with open(report_path, 'rb') as f:
+                    st.download_button("📥 KTC 제출용 공식 리포트 다운로드 (Excel)", data=f.read(), file_name=f"CBAM_KTC_Report.xlsx", mime=report_export.XLSX_MIME, type="primary", use_container_width=True)
 
     with tab2:
         st.markdown("### 🕒 계산 기록 관리 (History)")
-        history_df = load_from_db(st.session_state['username'])
+        # 시트를 못 받아 내장 계수로 돌고 있을 때는 재계산하지 않는다 (저장된 세금을 잘못된 값으로 덮어씀)
+        builtin_factors = getattr(CBAM_DB, 'source', None) == 'builtin'
+        if builtin_factors: st.caption("⚠️ CBAM 계수 시트를 아직 받지 못해 내장 계수로 동작 중입니다. 재계산은 시트를 받은 뒤에 할 수 있습니다.")
+        if st.button("🔄 최신 계수/환율로 재계산", disabled=builtin_factors):
+            n_changed, n_skipped = storage.recalculate_history(st.session_state['username'], CBAM_DB)
+            st.toast(f"✅ {n_changed}건 재계산 완료" + (f" (계수 표에 없는 재질 {n_skipped}건은 그대로 둠)" if n_skipped else ""))
+        hist_user = st.session_state['username']
+        with st.expander("🔍 필터 / 정렬", expanded=False):
+            f1, f2, f3 = st.columns(3)
+            date_range = f1.date_input("기간", value=(), key="hist_dates")
+            hist_mats = f2.multiselect("재질", storage.history_materials(hist_user), key="hist_mats")
+            hs_prefix = f3.text_input("HS 코드 (앞자리)", key="hist_hs")
+            f4, f5, f6 = st.columns(3)
+            file_term = f4.text_input("파일명 검색", key="hist_file")
+            sort_labels = {'newest': '최신순', 'oldest': '오래된순', 'date_desc': '날짜 내림차순', 'date_asc': '날짜 오름차순'}
+            hist_sort = f5.selectbox("정렬", list(sort_labels), format_func=sort_labels.get, key="hist_sort")
+            page_size = f6.selectbox("페이지당 행 수", [25, 50, 100, 200], index=1, key="hist_page_size")
+
+        hist_filters = {
+            'date_from': date_range[0] if len(date_range) > 0 else None,
+            'date_to': date_range[1] if len(date_range) > 1 else (date_range[0] if len(date_range) == 1 else None),
+            'materials': hist_mats, 'hs_prefix': hs_prefix, 'filename': file_term,
+        }
+        # 필터/정렬이 바뀌면 첫 페이지로 (커서 스택: 각 페이지의 시작 커서)
+        filter_sig = repr((hist_user, hist_filters, hist_sort, page_size))
+        if st.session_state.get('hist_sig') != filter_sig:
+            st.session_state['hist_sig'] = filter_sig
+            st.session_state['hist_cursors'] = [None]
+        cursors = st.session_state['hist_cursors']
+
+        total = storage.count_history(hist_user, hist_filters)
+        history_df, next_cursor = storage.query_history_page(hist_user, hist_filters, sort=hist_sort, cursor=cursors[-1], limit=page_size)
         if not history_df.empty:
             st.dataframe(history_df[['Date', 'File Name', 'Item Name', 'Material', 'Weight (kg)', 'HS Code']], use_container_width=True)
+            p1, p2, p3 = st.columns([1, 2, 1])
+            if p1.button("◀ 이전", disabled=len(cursors) <= 1, use_container_width=True):
+                cursors.pop(); st.rerun()
+            p2.markdown(f"<div style='text-align: center;'>총 {total:,}건 · {len(cursors)} / {max(1, -(-total // page_size))} 페이지</div>", unsafe_allow_html=True)
+            if p3.button("다음 ▶", disabled=next_cursor is None, use_container_width=True):
+                cursors.append(next_cursor); st.rerun()
         else: st.info("📭 저장된 기록이 없습니다.")
+
+        if total:
+            st.divider()
+            if st.button(f"📦 전체 기록 Excel 내보내기 ({total:,}건, 현재 필터 적용)"):
+                with st.spinner("기록을 엑셀로 내보내는 중..."):
+                    st.session_state['hist_export'] = (filter_sig, report_export.export_history(hist_user, CBAM_DB, hist_filters))
+            export_sig, export_path = st.session_state.get('hist_export', (None, None))
+            if export_sig == filter_sig and export_path and os.path.exists(export_path):
+                with open(export_path, 'rb') as f:
+                    st.download_button("📥 전체 기록 리포트 다운로드 (Excel)", data=f.read(), file_name=f"CBAM_KTC_History_{hist_user.upper()}.xlsx", mime=report_export.XLSX_MIME, type="primary", use_container_width=True)
+
+    if st.session_state.get('is_admin'):
+        with tabs[2]:
+            st.markdown("### 📈 단계별 처리 시간 (p50 / p95 / p99)")
+            a1, a2 = st.columns(2)
+            windows = {'최근 1시간': (3600, '5min'), '최근 24시간': (86400, '1h'), '최근 7일': (7 * 86400, '6h'), '최근 30일': (30 * 86400, '1D')}
+            window = a1.selectbox("기간", list(windows), index=1, key="metrics_window")
+            pct = a2.selectbox("추이 그래프 기준", ['p50', 'p95', 'p99'], index=1, key="metrics_pct")
+            seconds, bucket = windows[window]
+            metrics_df = telemetry.load_metrics(time.time() - seconds)
+            if metrics_df.empty: st.info("📭 기록된 측정값이 없습니다.")
+            else:
+                st.dataframe(telemetry.stage_summary(metrics_df).style.format({
+                    'error_rate': '{:.1%}', 'p50_ms': '{:,.1f}', 'p95_ms': '{:,.1f}', 'p99_ms': '{:,.1f}', 'avg_payload_kb': '{:,.1f}',
+                    'tokens_in': '{:,.0f}', 'tokens_out': '{:,.0f}'}), use_container_width=True)
+                st.line_chart(telemetry.stage_percentiles_over_time(metrics_df, bucket=bucket, quantile=int(pct[1:]) / 100))
+                errors = telemetry.error_summary(metrics_df)
+                if not errors.empty:
+                    st.markdown("#### ❗ 오류 종류")
+                    st.dataframe(errors, hide_index=True, use_container_width=True)
+
+# ------------------------------------------------
+# ⏱️ 시작 시간 기록 (세션의 첫 화면까지; 서버 프로세스의 첫 세션은 .cold)
+# ------------------------------------------------
+@st.cache_resource
+def _startup_state():
+    return {'cold': True}
+
+if 'startup_recorded' not in st.session_state:
+    st.session_state['startup_recorded'] = True
+    telemetry.record('app.startup.cold' if _startup_state().pop('cold', False) else 'app.startup',
+                     (time.perf_counter() - _SCRIPT_START) * 1000)
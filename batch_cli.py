@@ -0,0 +1,275 @@
+# ==========================================
+# 🖨️ 대량 일괄 분석 (명령줄, Streamlit 없이)
+# ==========================================
+# 폴더(하위 폴더 포함) 또는 zip 안의 인보이스 이미지를 analyze_image 로 분석하고,
+# 파일마다 결과 행 + 체크포인트를 한 트랜잭션으로 저장한다. 다시 실행하면 내용(sha256)이
+# 같은 파일 중 이미 끝난 것은 건너뛰고, 실패했던 파일만 다시 분석한다.
+# 끝나면 이번 원본 전체의 KTC 리포트(엑셀) 한 개와 처리량/오류 요약을 출력한다.
+#
+# 사용 예:
+#   GEMINI_API_KEY=... python batch_cli.py /shared/invoices --user ACME --output ACME_nightly.xlsx
+#   python batch_cli.py invoices.zip --user ACME --processes 4 --threads 4
+import argparse
+import hashlib
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import storage
+import telemetry
+from analysis_engine import AnalysisContext, TokenBucket, analyze_files
+from cbam_factors import BUILTIN_FACTORS, FactorStore, FactorTable, load_snapshot
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.pdf')
+REPORT_COLUMNS = ['date', 'filename', 'item_name', 'material', 'weight', 'hs_code', 'tax_krw', 'exchange_rate', 'validation']
+
+
+# ------------------------------------------------
+# 📂 원본 (폴더 / zip)
+# ------------------------------------------------
+def list_sources(source):
+    """[(표시 경로, 읽기 함수)] — 경로 순으로 정렬. 숨김 파일과 지원하지 않는 확장자는 제외."""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            names = sorted(n for n in zf.namelist() if n.lower().endswith(EXTENSIONS) and not os.path.basename(n).startswith('.'))
+
+        def _reader(name):
+            def _read():
+                with zipfile.ZipFile(source) as zf: return zf.read(name)
+            return _read
+        return [(name, _reader(name)) for name in names]
+
+    out = []
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for f in sorted(files):
+            if f.lower().endswith(EXTENSIONS) and not f.startswith('.'):
+                path = os.path.join(root, f)
+                out.append((os.path.relpath(path, source), _file_reader(path)))
+    return out
+
+
+def _file_reader(path):
+    def _read():
+        with open(path, 'rb') as f: return f.read()
+    return _read
+
+
+# ------------------------------------------------
+# ⚙️ 분석 (스레드 풀 / 프로세스 풀 공용)
+# ------------------------------------------------
+_WORKER = {}
+_ERRORS = Counter()
+_ERRORS_LOCK = threading.Lock()
+
+
+def _count_errors(row):
+    if row.get('error'):
+        with _ERRORS_LOCK: _ERRORS[(row['stage'], row['error'])] += 1
+
+
+def _init_worker(config):
+    """프로세스(또는 현재 프로세스)마다 한 번: Gemini 설정, 계수 테이블, 속도 제한, 오류 집계."""
+    if config.get('api_key'):
+        import google.generativeai as genai
+        genai.configure(api_key=config['api_key'])
+    telemetry.RECORDER.db_path = config['db_path']
+    if _count_errors not in telemetry.RECORDER.exporters: telemetry.RECORDER.exporters.append(_count_errors)
+    rate = config['rpm'] / 60.0
+    _WORKER.update({
+        'config': config, 'cbam_db': config['cbam_db'],
+        'limiter': TokenBucket(rate=rate, capacity=max(1.0, rate)),
+    })
+
+
+def _analyze_chunk(jobs):
+    """jobs: [(경로, 바이트)] -> (파일별 결과 행 목록, 이 묶음에서 난 오류 종류 Counter)."""
+    config = _WORKER['config']
+    with _ERRORS_LOCK: _ERRORS.clear()
+    ctx = AnalysisContext(_WORKER['cbam_db'], limiter=_WORKER['limiter'], prep=config.get('prep'),
+                          max_retries=config['max_retries'], batch_size=config['batch_size'])
+    per_file = analyze_files([(data, path) for path, data in jobs], config['username'], ctx, max_workers=config['threads'])
+    with _ERRORS_LOCK: errors = Counter(_ERRORS)
+    telemetry.RECORDER.flush()  # 프로세스 풀 워커가 끝날 때 버퍼가 사라지지 않도록 묶음마다 저장
+    return per_file, errors
+
+
+# ------------------------------------------------
+# 💾 체크포인트
+# ------------------------------------------------
+def finished_hashes(username, db_path):
+    with storage.get_db(db_path).connection() as conn:
+        rows = conn.execute("SELECT sha256 FROM batch_files WHERE username = ? AND status = 'done'", (username,)).fetchall()
+    return {r[0] for r in rows}
+
+
+def save_file_result(username, path, sha, rows, db_path):
+    """결과 행 + 체크포인트를 한 트랜잭션으로. 예전에 실패했던 같은 파일의 행은 지운다. 실패 여부 반환."""
+    failed = any(str(r.get('Validation', '')).startswith('❌') for r in rows)
+    with storage.get_db(db_path).transaction() as conn:
+        conn.execute('''
+            INSERT INTO batch_files (username, sha256, path, status, items, finished_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (username, sha256) DO UPDATE SET path = excluded.path, status = excluded.status,
+                items = excluded.items, finished_at = excluded.finished_at
+        ''', (username, sha, path, 'failed' if failed else 'done', len(rows), time.time()))
+        file_id = conn.execute("SELECT id FROM batch_files WHERE username = ? AND sha256 = ?", (username, sha)).fetchone()[0]
+        conn.execute("DELETE FROM history WHERE batch_file_id = ?", (file_id,))
+        storage.insert_history(conn, [dict(r, batch_file_id=file_id) for r in rows])
+    return failed
+
+
+# ------------------------------------------------
+# 📊 통합 리포트
+# ------------------------------------------------
+def _report_rows(username, hashes, db_path):
+    # 임시 테이블은 커넥션마다 따로라서 다 읽을 때까지 같은 커넥션을 빌려 둔다
+    with storage.get_db(db_path).connection() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS cli_source (sha256 TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM cli_source")
+        conn.executemany("INSERT OR IGNORE INTO cli_source VALUES (?)", [(h,) for h in hashes])
+        conn.commit()
+        cur = conn.execute(f'''
+            SELECT {', '.join('h.' + c for c in REPORT_COLUMNS)} FROM history h
+            JOIN batch_files b ON h.batch_file_id = b.id JOIN cli_source s ON s.sha256 = b.sha256
+            WHERE b.username = ? ORDER BY b.path, h.id
+        ''', (username,))
+        cur.arraysize = 1000
+        while True:
+            chunk = cur.fetchmany()
+            if not chunk: break
+            for row in chunk:
+                d = {storage.HISTORY_COLUMNS[c]: v for c, v in zip(REPORT_COLUMNS, row)}
+                d['Validation'] = d['Validation'] or ''
+                yield d
+
+
+def write_consolidated_report(username, hashes, cbam_db, output, db_path):
+    from report_export import write_report  # xlsxwriter 는 리포트를 만들 때만
+    return write_report(_report_rows(username, hashes, db_path), output, cbam_db)
+
+
+# ------------------------------------------------
+# ▶ 실행
+# ------------------------------------------------
+def load_factors(url):
+    if url:
+        store = FactorStore(url, max_age=0)
+        store.refresh()
+        return store.get()
+    return load_snapshot() or FactorTable(BUILTIN_FACTORS)
+
+
+def run(args):
+    username = args.user.upper().strip()
+    storage.init_db(args.db)
+    cbam_db = load_factors(args.factor_url)
+    sources = list_sources(args.source)
+    done = finished_hashes(username, args.db)
+    print(f"📂 {args.source}: 파일 {len(sources)}개 · 계수 버전 {getattr(cbam_db, 'version', 'n/a')}")
+
+    config = {
+        'api_key': args.api_key, 'db_path': args.db, 'cbam_db': cbam_db, 'username': username,
+        'rpm': args.rpm / max(1, args.processes), 'max_retries': args.max_retries, 'batch_size': args.batch_size,
+        'threads': args.threads, 'prep': {'max_side': args.max_side},
+    }
+
+    stats = Counter()
+    errors = Counter()
+    all_hashes = []
+    started = time.perf_counter()
+
+    def _chunks():
+        """해시를 계산하면서 아직 안 끝난 파일만 chunk 개씩 (바이트는 묶음 단위로만 메모리에 둔다)."""
+        batch = []
+        for path, read in sources:
+            try: data = read()
+            except OSError as e:
+                print(f"  ⚠️ 읽기 실패 {path}: {e}")
+                stats['unreadable'] += 1
+                continue
+            sha = hashlib.sha256(data).hexdigest()
+            all_hashes.append(sha)
+            if sha in done:
+                stats['skipped'] += 1
+                continue
+            batch.append((path, data, sha))
+            if len(batch) >= args.chunk:
+                yield batch
+                batch = []
+        if batch: yield batch
+
+    def _save(batch, per_file, chunk_errors):
+        for (path, _, sha), rows in zip(batch, per_file):
+            failed = save_file_result(username, path, sha, rows, args.db)
+            stats['failed' if failed else 'done'] += 1
+            stats['items'] += len(rows)
+            if failed: print(f"  ❌ {path}")
+        errors.update(chunk_errors)
+        finished = stats['done'] + stats['failed']
+        elapsed = time.perf_counter() - started
+        print(f"  [{finished + stats['skipped']}/{len(sources)}] {finished / elapsed if elapsed else 0:.2f} 파일/초 · 실패 {stats['failed']}")
+
+    if args.processes > 1:
+        ctx = mp.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=args.processes, mp_context=ctx, initializer=_init_worker, initargs=(config,)) as pool:
+            pending = {}
+            for batch in _chunks():
+                pending[pool.submit(_analyze_chunk, [(p, d) for p, d, _ in batch])] = [(p, None, s) for p, _, s in batch]
+                # 메모리에 올라간 묶음 수를 제한 (프로세스 수의 두 배)
+                while len(pending) >= args.processes * 2:
+                    fut = next(as_completed(pending))
+                    _save(pending.pop(fut), *fut.result())
+            for fut in as_completed(list(pending)):
+                _save(pending.pop(fut), *fut.result())
+    else:
+        _init_worker(config)
+        for batch in _chunks():
+            _save(batch, *_analyze_chunk([(p, d) for p, d, _ in batch]))
+
+    elapsed = time.perf_counter() - started
+    telemetry.RECORDER.flush()
+
+    report_rows = 0
+    if args.output:
+        report_rows = write_consolidated_report(username, all_hashes, cbam_db, args.output, args.db)
+
+    processed = stats['done'] + stats['failed']
+    print("\n===== 요약 =====")
+    print(f"전체 {len(sources)} · 분석 {processed} (성공 {stats['done']} / 실패 {stats['failed']}) · 건너뜀 {stats['skipped']} · 읽기 실패 {stats['unreadable']}")
+    print(f"항목 {stats['items']}개 · {elapsed:.1f}초 · {processed / elapsed if elapsed else 0:.2f} 파일/초 · {stats['items'] / elapsed if elapsed else 0:.2f} 항목/초")
+    if errors:
+        print("오류 종류:")
+        for (stage, error), n in errors.most_common(): print(f"  {stage:<32} {error:<24} {n}")
+    if args.output:
+        print(f"📊 리포트: {args.output} ({report_rows}행)" if report_rows else "📊 리포트: 행이 없어 만들지 않음")
+    return 2 if stats['failed'] or stats['unreadable'] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CBAM 인보이스 일괄 분석 (폴더 또는 zip)")
+    parser.add_argument('source', help="이미지 폴더 또는 zip 파일")
+    parser.add_argument('--user', required=True, help="기록을 저장할 회사 아이디")
+    parser.add_argument('--output', help="통합 KTC 리포트 경로 (.xlsx)")
+    parser.add_argument('--db', default=storage.DB_PATH)
+    parser.add_argument('--api-key', default=os.environ.get('GEMINI_API_KEY'))
+    parser.add_argument('--factor-url', default=os.environ.get('CBAM_DATA_URL'), help="없으면 마지막 스냅샷(또는 내장 계수) 사용")
+    parser.add_argument('--processes', type=int, default=1, help="2 이상이면 프로세스 풀")
+    parser.add_argument('--threads', type=int, default=4, help="프로세스당 동시 요청 수")
+    parser.add_argument('--chunk', type=int, default=20, help="체크포인트 단위 파일 수")
+    parser.add_argument('--rpm', type=float, default=60, help="전체 분당 요청 수 (프로세스끼리 나눠 가짐)")
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--max-side', type=int, default=2000)
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.source): parser.error(f"경로가 없습니다: {args.source}")
+    if not args.api_key: parser.error("GEMINI_API_KEY 환경 변수 또는 --api-key 가 필요합니다")
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,446 @@
+# ==========================================
+# ⏱️ 오프라인 성능 벤치마크 (가짜 Gemini 모델 + 합성 데이터)
+# ==========================================
+# 네트워크 / API 키 없이 주요 경로의 처리 시간을 규모별로 잰다.
+#  - CBAM 계수 CSV 파싱 (load_cbam_db 와 같은 fetch_factor_table 경로)
+#  - 재질 매칭 (force_match_material), 세금 계산 / HS 검증 (단건 + 일괄)
+#  - history 저장 / 조회 (save_to_db / load_from_db), KTC 엑셀 생성
+#  - 분석 전체 흐름 (process_analysis 와 같은 analyze_files -> save_to_db) 처리량
+#  - --cold-start: 새 프로세스에서 app.py 로그인 화면이 뜰 때까지 걸린 시간 (네트워크를 기다리지 않아야 함)
+# 결과는 JSON 으로 남기고, --baseline 으로 이전 결과를 주면 기준보다 느려진 항목을 알려준다.
+#
+# 사용 예:
+#   python benchmark.py --scales small,medium --output bench_results.json
+#   python benchmark.py --baseline bench_results.json --output bench_new.json   (느려지면 종료 코드 1)
+# 항목마다 측정 설정(COMPARE_SETTINGS)을 함께 남기고, 설정이 기준과 다른 항목은 비교하지 않는다.
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+import report_export
+import storage
+import tax_engine
+import telemetry
+from analysis_engine import AnalysisContext, analyze_files
+from cbam_factors import FactorTable, fetch_factor_table
+from material_matcher import MaterialMatcher
+
+# 규모별 크기: 계수 카테고리 수 / 품목 행 수 / 인보이스 파일 수
+SCALES = {
+    'small': {'categories': 20, 'items': 500, 'files': 20},
+    'medium': {'categories': 100, 'items': 5000, 'files': 100},
+    'large': {'categories': 500, 'items': 50000, 'files': 400},
+}
+
+# 기준 대비 허용 배율 (이보다 느려지면 회귀). 여기 없으면 DEFAULT_THRESHOLD.
+DEFAULT_THRESHOLD = 1.25
+THRESHOLDS = {
+    'end_to_end': 1.15,  # 가짜 모델 지연이 대부분이라 변동이 작다
+    'cold_start': 1.5,  # 프로세스 생성 / 디스크 캐시 영향으로 변동이 크다
+}
+# 로그인 화면을 그리는 동안 import 되면 안 되는 무거운 모듈 (들어오면 cold_start 결과에 표시)
+HEAVY_MODULES = ('pandas', 'numpy', 'google.generativeai', 'xlsxwriter', 'PIL')
+NOISE_FLOOR_S = 0.002  # 이보다 짧은 측정은 비교하지 않는다 (타이머 잡음)
+MIN_COMPARE_REPEAT = 3  # 기준 비교는 최소 이 횟수의 중앙값으로 (한 번 잰 값은 잡음이 허용 배율보다 크다)
+# 결과에 영향을 주는 실행 설정. 기준과 하나라도 다르면 그 항목은 비교하지 않는다.
+COMPARE_SETTINGS = ('seed', 'repeat', 'latency', 'error_rate', 'max_retries', 'batch_size', 'workers', 'stream', 'telemetry')
+
+_VOCAB = ['hot rolled', 'cold drawn', 'galvanized', 'stainless', 'carbon', 'alloy', 'seamless', 'welded']
+_FORMS = ['pipe', 'tube', 'wire', 'cable', 'beam', 'structure', 'bolt', 'screw', 'nut', 'washer', 'aluminum ingot',
+          'aluminium bar', 'aluminum foil', 'aluminum sheet', 'cement', 'cmnt bag', 'plate', 'rod', 'coil', 'flange']
+_BASE_CATEGORIES = ['Steel (Pipes/Tubes)', 'Steel (Wire)', 'Steel (Structures)', 'Steel (Bolts/Screws)',
+                    'Aluminum (Ingots)', 'Aluminum (Bars/Rods)', 'Aluminum (Foil)', 'Aluminum (Sheets/Plates)',
+                    'Aluminum (Pipes/Tubes)', 'Cement (Clinker)', 'Iron (Pig Iron)', 'Steel (Flat Products)']
+
+
+# ------------------------------------------------
+# 🤖 가짜 Gemini 모델
+# ------------------------------------------------
+class ResourceExhausted(Exception):
+    """google.api_core 의 429 예외와 이름이 같아 analysis_engine 이 일시적 오류로 보고 재시도한다."""
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStream:
+    """stream=True 응답: 텍스트를 chunk_size 글자씩 나눠 지연을 나눠 가지며 돌려준다."""
+
+    def __init__(self, text, latency, chunk_size=64):
+        self._chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or ['']
+        self._delay = latency / len(self._chunks)
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self._delay: time.sleep(self._delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGeminiModel:
+    """generate_content() 만 흉내 낸다. 요청 내용 해시로 항목을 만들어 실행 순서와 무관하게 결정적이다.
+    latency 초만큼 기다린 뒤, error_rate 확률로(같은 요청의 시도 횟수까지 고려해 결정적으로) 429 를 던진다."""
+
+    def __init__(self, categories, latency=0.05, error_rate=0.0, seed=0, max_items=6):
+        self.categories = list(categories)
+        self.latency, self.error_rate, self.seed, self.max_items = latency, error_rate, seed, max_items
+        self.calls = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _digest(self, parts):
+        h = hashlib.sha256(str(self.seed).encode())
+        for p in parts:
+            h.update(p["data"] if isinstance(p, dict) else str(p).encode('utf-8'))
+        return h.hexdigest()
+
+    def _items(self, rng):
+        items = []
+        for _ in range(rng.randint(1, self.max_items)):
+            cat = rng.choice(self.categories)
+            material = cat if rng.random() < 0.7 else cat.split(' ')[0].lower()  # 일부는 AI 가 틀리게 준 재질
+            items.append({"item": f"{rng.choice(_VOCAB)} {rng.choice(_FORMS)}", "material": material,
+                          "weight": f"{rng.uniform(10, 50000):,.1f} kg", "hs_code": f"{rng.choice([7304, 7217, 7308, 7318, 7601, 2523]):04d}00"})
+        return items
+
+    def generate_content(self, parts, stream=False):
+        digest = self._digest(parts)
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts[digest] = self._attempts.get(digest, 0) + 1
+        if self.latency and not stream: time.sleep(self.latency)
+        rng = random.Random(f"{digest}:{attempt}")
+        if rng.random() < self.error_rate: raise ResourceExhausted("fake 429")
+        rng = random.Random(digest)
+
+        prompt = str(parts[0])
+        if "separate invoice files" in prompt:
+            file_ids = [str(p)[len("=== FILE "):-len(" ===")] for p in parts if isinstance(p, str) and p.startswith("=== FILE ")]
+            payload = {"files": {fid: {"items": self._items(rng)} for fid in file_ids}}
+        else: payload = {"items": self._items(rng)}
+        text = f"```json\n{json.dumps(payload)}\n```"
+        return FakeStream(text, self.latency) if stream else FakeResponse(text)
+
+
+# ------------------------------------------------
+# 🧪 합성 데이터
+# ------------------------------------------------
+def make_categories(n):
+    cats = list(_BASE_CATEGORIES[:n])
+    i = 0
+    while len(cats) < n:
+        base = _BASE_CATEGORIES[i % len(_BASE_CATEGORIES)]
+        cats.append(f"{base.split(' ')[0]} Grade {i:03d} ({_FORMS[i % len(_FORMS)].title()})")
+        i += 1
+    return cats
+
+
+def make_cbam_csv(categories, seed=0):
+    """공개 시트와 같은 모양의 CSV 텍스트 (첫 줄은 제목, 둘째 줄이 실제 헤더)."""
+    rng = random.Random(seed)
+    buf = io.StringIO()
+    buf.write("CBAM Default Values,,,,\n")
+    buf.write("Category,HS Code,Default (tCO2/t),Optimized (tCO2/t),Exchange Rate\n")
+    for cat in categories:
+        hs = rng.choice([730400, 721700, 730800, 731800, 760100, 252300])
+        buf.write(f"\"{cat}\",{hs}.0,{rng.uniform(0.5, 3.5):.3f},{rng.uniform(0.3, 2.5):.3f},\"{rng.uniform(1350, 1550):,.1f}\"\n")
+    return buf.getvalue()
+
+
+def make_items(categories, n, seed=0):
+    """AI 가 돌려준 것 같은 (품목명, 재질, 중량, HS) 목록."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        cat = rng.choice(categories)
+        material = cat if rng.random() < 0.6 else rng.choice([cat.lower(), cat.split(' ')[0], 'steel', 'unknown metal'])
+        out.append((f"{rng.choice(_VOCAB)} {rng.choice(_FORMS)} {rng.randint(1, 999)}", material,
+                    round(rng.uniform(10, 50000), 1), f"{rng.choice([7304, 7217, 7308, 7318, 7601, 2523]):04d}00"))
+    return out
+
+
+def make_rows(items, cbam_db, matcher, username='BENCH'):
+    rows = []
+    for i, (name, material, weight, hs) in enumerate(items):
+        mat = matcher.match(name, material)
+        calc = tax_engine.calculate_tax_logic(mat, weight, cbam_db)
+        rows.append({"File Name": f"inv_{i // 5:05d}.jpg", "Date": f"2026-{1 + i % 12:02d}-{1 + i % 28:02d} 10:00",
+                     "Company": username, "Item Name": name, "Material": mat, "Weight (kg)": weight, "HS Code": hs,
+                     "Default Tax (KRW)": calc['bad_tax'], "exchange_rate": calc['exchange_rate'],
+                     "Validation": tax_engine.validate_data(hs, mat, cbam_db)})
+    return rows
+
+
+def make_invoice_images(n, seed=0):
+    """서로 다른 작은 스캔 이미지(JPEG). Pillow 가 없으면 JPEG 헤더만 있는 바이트."""
+    rng = random.Random(seed)
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        return [b'\xff\xd8\xff' + rng.randbytes(2048) for _ in range(n)]
+    images = []
+    for i in range(n):
+        img = Image.new('RGB', (1240, 1754), 'white')
+        draw = ImageDraw.Draw(img)
+        for line in range(40):
+            y = 80 + line * 40
+            draw.rectangle([80, y, 80 + rng.randint(200, 1000), y + 12], fill=(30, 30, 30))
+        draw.text((80, 20), f"INVOICE {i:05d}", fill=(0, 0, 0))
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=90)
+        images.append(buf.getvalue())
+    return images
+
+
+# ------------------------------------------------
+# ⏱️ 측정
+# ------------------------------------------------
+def measure(fn, repeat=3, setup=None):
+    """fn 을 repeat 번 실행해 초 단위 [min, median]. setup() 결과가 있으면 fn 인자로 넘긴다 (측정 제외)."""
+    times = []
+    for _ in range(max(1, repeat)):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        fn(arg) if setup else fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), statistics.median(times)
+
+
+def _record(results, name, scale, n, timing, **extra):
+    best, median = timing
+    results[f"{name}[{scale}]"] = dict({
+        "name": name, "scale": scale, "n": n, "seconds": round(median, 6), "best_seconds": round(best, 6),
+        "per_item_us": round(median / n * 1e6, 3) if n else None,
+    }, **extra)
+    print(f"  {name:<24} n={n:<7} median {median*1000:10.2f} ms   ({median / n * 1e6 if n else 0:9.2f} µs/item)")
+
+
+def run_scale(scale, spec, args, results, workdir):
+    print(f"▶ {scale}: {spec}")
+    categories = make_categories(spec['categories'])
+    csv_text = make_cbam_csv(categories, seed=args.seed)
+    cbam_db = fetch_factor_table(io.StringIO(csv_text))
+    db_keys = list(cbam_db.keys())
+    items = make_items(db_keys, spec['items'], seed=args.seed)
+
+    # 1) 계수 CSV 파싱
+    _record(results, 'load_cbam_db', scale, len(categories),
+            measure(lambda: fetch_factor_table(io.StringIO(csv_text)), args.repeat))
+
+    # 2) 재질 매칭 (매 실행마다 새 매처 = 빈 메모, 색인 생성 포함)
+    def _match_all():
+        m = MaterialMatcher(db_keys)
+        for name, material, _, _ in items: m.match(name, material)
+    _record(results, 'force_match_material', scale, len(items), measure(_match_all, args.repeat))
+
+    matcher = MaterialMatcher(db_keys)
+    rows = make_rows(items, cbam_db, matcher)
+
+    # 3) 세금 계산 + HS 검증 (단건 함수 반복 / DataFrame 일괄)
+    def _tax_scalar():
+        for r in rows:
+            tax_engine.calculate_tax_logic(r['Material'], r['Weight (kg)'], cbam_db)
+            tax_engine.validate_data(r['HS Code'], r['Material'], cbam_db)
+    _record(results, 'calculate_tax_validate', scale, len(rows), measure(_tax_scalar, args.repeat))
+    frame = pd.DataFrame(rows)
+    _record(results, 'calculate_batch', scale, len(rows),
+            measure(lambda: tax_engine.calculate_batch(frame, cbam_db, 'Material', 'Weight (kg)', 'HS Code'), args.repeat))
+
+    # 4) history 저장 / 조회 (매번 새 DB 파일)
+    counter = iter(range(10**9))
+
+    def _fresh_db():
+        path = os.path.join(workdir, f"bench_{scale}_{next(counter)}.db")
+        storage.init_db(path)
+        return path
+    _record(results, 'save_to_db', scale, len(rows),
+            measure(lambda path: storage.save_to_db([dict(r) for r in rows], path=path), args.repeat, setup=_fresh_db))
+    load_path = _fresh_db()
+    storage.save_to_db([dict(r) for r in rows], path=load_path)
+    _record(results, 'load_from_db', scale, len(rows), measure(lambda: storage.load_from_db('BENCH', path=load_path), args.repeat))
+
+    # 5) KTC 엑셀 (행마다 run 번호를 넣어 메모를 피하고 매번 새로 만든다)
+    runs = iter(range(10**9))
+
+    def _excel_rows():
+        run = next(runs)
+        return [dict(r, bench_run=run) for r in rows]
+    _record(results, 'generate_official_excel', scale, len(rows),
+            measure(lambda data: report_export.generate_official_excel(data, cbam_db), args.repeat, setup=_excel_rows))
+
+    # 6) 분석 전체 흐름 (가짜 모델) — 파일/초
+    images = make_invoice_images(spec['files'], seed=args.seed)
+    model = FakeGeminiModel(db_keys, latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+
+    last = {}
+
+    def _end_to_end(path):
+        ctx = AnalysisContext(FactorTable(cbam_db, version=cbam_db.version), model=model,
+                              max_retries=args.max_retries, batch_size=args.batch_size, stream=args.stream)
+        per_file = analyze_files([(img, f"inv_{i:05d}.jpg") for i, img in enumerate(images)], 'BENCH', ctx,
+                                 max_workers=args.workers)
+        all_results = [row for items_ in per_file for row in items_]
+        storage.save_to_db(all_results, path=path)
+        last['failed_files'] = sum(1 for items_ in per_file if any(str(r.get('Validation', '')).startswith('❌') for r in items_))
+        last['rows'] = len(all_results)
+    calls_before = model.calls
+    timing = measure(_end_to_end, args.repeat, setup=_fresh_db)
+    _record(results, 'end_to_end', scale, len(images), timing,
+            files_per_s=round(len(images) / timing[1], 3) if timing[1] else None, **last,
+            model_calls=(model.calls - calls_before) // max(1, args.repeat), latency_s=args.latency, error_rate=args.error_rate,
+            batch_size=args.batch_size, workers=args.workers, stream=args.stream)
+
+
+# 새 인터프리터에서 AppTest 로 app.py 를 한 번 실행한다. 스냅샷이 없는 빈 디렉터리에서 돌리므로 시트 다운로드는
+# 백그라운드(cbam-* 스레드)로 넘어가야 하고, 화면을 그리는 스레드에서 무거운 모듈을 import 하면 기록한다.
+_COLD_START_SCRIPT = r'''
+import json, sys, threading, time
+heavy, watch = set(), set(sys.argv[2].split(","))
+class _Watch:
+    def find_spec(self, name, path, target=None):
+        if name in watch and not threading.current_thread().name.startswith("cbam-"): heavy.add(name)
+        return None
+from streamlit.testing.v1 import AppTest
+sys.meta_path.insert(0, _Watch())
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.secrets["GEMINI_API_KEY"] = "bench"
+t0 = time.perf_counter()
+at.run()
+render = time.perf_counter() - t0
+print(json.dumps({"render_s": render, "exception": [str(e.value) for e in at.exception],
+                  "heavy": sorted(heavy)}))
+'''
+
+
+def run_cold_start(args, results, workdir):
+    """app.py 첫 실행(로그인 화면)까지 걸린 시간. 매번 새 프로세스 + 빈 작업 디렉터리 (스냅샷 / DB 없음)."""
+    print("▶ cold start: app.py 로그인 화면")
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(app_path), os.environ.get('PYTHONPATH')])))
+    runs = []
+    for i in range(max(1, args.repeat)):
+        cwd = os.path.join(workdir, f"cold_{i}")
+        os.makedirs(cwd, exist_ok=True)
+        out = subprocess.run([sys.executable, '-c', _COLD_START_SCRIPT, app_path, ','.join(HEAVY_MODULES)],
+                             cwd=cwd, env=env, capture_output=True, text=True, timeout=300)
+        lines = [l for l in out.stdout.splitlines() if l.startswith('{')]
+        if not lines: raise RuntimeError(f"cold start 측정 실패: {out.stderr[-2000:]}")
+        runs.append(json.loads(lines[-1]))
+    if runs[-1]['exception']: raise RuntimeError(f"app.py 예외: {runs[-1]['exception']}")
+    times = [r['render_s'] for r in runs]
+    heavy = sorted({m for r in runs for m in r['heavy']})
+    _record(results, 'cold_start', 'app', 1, (min(times), statistics.median(times)), heavy_modules=heavy)
+    if heavy: print(f"  ⚠️ 로그인 화면에서 무거운 모듈이 import 됨: {', '.join(heavy)}")
+
+
+# ------------------------------------------------
+# 📈 기준 결과와 비교
+# ------------------------------------------------
+def _settings(result, meta):
+    # 예전 결과 파일에는 항목별 settings 가 없으므로 meta.args 로 대신한다
+    settings = result.get('settings') or meta.get('args') or {}
+    return {k: settings.get(k) for k in COMPARE_SETTINGS}
+
+
+def compare(current, baseline, default_threshold=DEFAULT_THRESHOLD):
+    """([(키, 기준 초, 현재 초, 배율, 허용 배율)] 중 회귀한 것만, 비교한 항목 수).
+    측정 설정이 기준과 다른 항목은 건너뛴다."""
+    regressions, compared = [], 0
+    for key, cur in current['results'].items():
+        base = baseline.get('results', {}).get(key)
+        if not base or not base.get('seconds'): continue
+        base_settings, cur_settings = _settings(base, baseline.get('meta', {})), _settings(cur, current.get('meta', {}))
+        diff = [f"{k}={base_settings[k]}->{cur_settings[k]}" for k in COMPARE_SETTINGS if base_settings[k] != cur_settings[k]]
+        if diff:
+            print(f"  {key:<34} 설정이 달라 비교 안 함 ({', '.join(diff)})")
+            continue
+        compared += 1
+        if max(base['seconds'], cur['seconds']) < NOISE_FLOOR_S: continue
+        ratio = cur['seconds'] / base['seconds']
+        limit = THRESHOLDS.get(cur['name'], default_threshold)
+        print(f"  {key:<34} {base['seconds']*1000:10.2f} ms -> {cur['seconds']*1000:10.2f} ms  x{ratio:5.2f}"
+              f"{'  ❌ 회귀' if ratio > limit else ''}")
+        if ratio > limit: regressions.append((key, base['seconds'], cur['seconds'], ratio, limit))
+    return regressions, compared
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception: return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CBAM Master 오프라인 벤치마크")
+    parser.add_argument('--scales', default='small,medium', help=f"쉼표로 구분 ({', '.join(SCALES)})")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.05, help="가짜 모델 응답 지연(초)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="가짜 모델 429 비율 (0~1)")
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--stream', action='store_true', help="단건 요청을 스트리밍으로 받기")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="비교할 이전 결과 JSON")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="기본 허용 배율")
+    parser.add_argument('--telemetry', action='store_true', help="단계별 계측을 켠 채로 측정 (기본은 꺼서 운영 DB 에 기록하지 않음)")
+    parser.add_argument('--cold-start', action='store_true', help="app.py 첫 화면(로그인)까지 걸린 시간도 잰다 (streamlit 필요)")
+    args = parser.parse_args(argv)
+    telemetry.RECORDER.enabled = args.telemetry
+
+    scales = [s.strip() for s in args.scales.split(',') if s.strip()]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown: parser.error(f"알 수 없는 규모: {', '.join(unknown)}")
+    if args.baseline and args.repeat < MIN_COMPARE_REPEAT:
+        parser.error(f"--baseline 비교에는 --repeat {MIN_COMPARE_REPEAT} 이상이 필요합니다 (중앙값 비교)")
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="cbam_bench_")
+    try:
+        for scale in scales: run_scale(scale, SCALES[scale], args, results, workdir)
+        if args.cold_start: run_cold_start(args, results, workdir)
+    finally: shutil.rmtree(workdir, ignore_errors=True)
+    settings = {k: getattr(args, k) for k in COMPARE_SETTINGS}
+    for result in results.values(): result['settings'] = settings
+
+    report = {
+        "meta": {"commit": _git_commit(), "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 "python": platform.python_version(), "platform": platform.platform(), "pandas": pd.__version__,
+                 "args": vars(args)},
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 {args.output} 저장 ({len(results)}개 항목)")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f: baseline = json.load(f)
+        print(f"📈 기준 비교 ({args.baseline}, commit {baseline.get('meta', {}).get('commit')})")
+        regressions, compared = compare(report, baseline, args.threshold)
+        if not compared:
+            print("⚠️ 기준과 같은 설정으로 잰 항목이 없어 비교하지 못했습니다.")
+            return 2
+        if regressions:
+            print(f"❌ {len(regressions)}개 항목이 허용 배율을 넘었습니다.")
+            return 1
+        print("✅ 회귀 없음")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
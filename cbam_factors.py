@@ -0,0 +1,175 @@
+# ==========================================
+# 📚 CBAM 계수 테이블 (벡터 파싱 + 로컬 스냅샷 + 백그라운드 갱신)
+# ==========================================
+# 시작할 때는 디스크의 최신 스냅샷을 바로 쓰고, 오래됐으면 백그라운드에서
+# 구글 시트를 다시 받아 교체한다 (stale-while-revalidate).
+# 받은 계수 세트마다 내용 해시로 버전을 매겨 cbam_snapshots/<version>.json 에 남긴다.
+import hashlib
+import json
+import os
+import threading
+import time
+
+SNAPSHOT_DIR = 'cbam_snapshots'
+DEFAULT_RATE = 1450.0
+DEFAULT_PRICE = 85.0
+
+BUILTIN_FACTORS = {
+    "Steel (Pipes/Tubes)": {"default": 2.50, "optimized": 1.9, "hs_code": "730400", "price": 85.0, "exchange_rate": 1450},
+    "Steel (Wire)": {"default": 2.20, "optimized": 1.6, "hs_code": "721700", "price": 85.0, "exchange_rate": 1450},
+}
+
+
+class FactorTable(dict):
+    """CBAM_DB 와 똑같이 dict 로 쓰되, 어떤 계수 세트인지(version)와 언제 받은 것인지(fetched_at)를 함께 들고 다닌다."""
+
+    def __init__(self, factors, version=None, fetched_at=None, source='builtin'):
+        super().__init__(factors)
+        self.version = version or factor_version(factors)
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.source = source
+
+    @property
+    def age(self):
+        return max(0.0, time.time() - self.fetched_at)
+
+    def to_json(self):
+        return {"version": self.version, "fetched_at": self.fetched_at, "source": self.source, "factors": dict(self)}
+
+
+def factor_version(factors):
+    payload = json.dumps(factors, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]
+
+
+# ------------------------------------------------
+# 🧾 CSV 파싱 (열은 한 번만 찾고, 값은 열 단위로 변환)
+# ------------------------------------------------
+def _to_float(series):
+    import pandas as pd
+    return pd.to_numeric(series.astype(str).str.replace(',', '', regex=False).str.strip(), errors='coerce')
+
+
+def parse_cbam_frame(df):
+    """공개 시트 DataFrame -> {카테고리: 계수 dict}. BUILTIN_FACTORS 를 먼저 깔고 시트 값으로 덮어쓴다.
+    숫자로 읽을 수 없는 값은 기본값(환율 1450, 계수 0.0)으로 둔다."""
+    import pandas as pd  # 시트를 읽을 때만 필요 (앱 시작 시에는 스냅샷만 읽음)
+    master_db = {k: dict(v) for k, v in BUILTIN_FACTORS.items()}
+    if df.empty: return master_db
+
+    first_cell = str(df.iloc[0, 0]).strip().lower()
+    if 'category' not in df.columns.astype(str).str.lower() and first_cell == 'category':
+        new_header = df.iloc[0]
+        df = df[1:]
+        df.columns = new_header
+
+    cols = {str(c).strip().lower(): c for c in df.columns}
+    rate_col = next((cols[k] for k in cols if 'exch' in k and 'rate' in k), None)
+    hs_col = next((cols[k] for k in cols if 'hs' in k and 'code' in k), None)
+    cat_col = next((cols[k] for k in cols if 'cat' in k), None)
+    if not cat_col: return master_db
+
+    df = df[df[cat_col].notna()]
+    cats = df[cat_col].astype(str).str.strip()
+
+    rates = _to_float(df[rate_col]).fillna(DEFAULT_RATE) if rate_col else pd.Series(DEFAULT_RATE, index=df.index)
+
+    if hs_col:
+        raw_hs = df[hs_col].astype(str).str.strip()
+        raw_hs = raw_hs.where(df[hs_col].notna() & (raw_hs != 'nan') & (raw_hs != ''))
+        hs_codes = raw_hs.str.split('.', regex=False).str[0].fillna('000000')
+    else: hs_codes = pd.Series('000000', index=df.index)
+
+    # 'default' / 'optimized' 가 들어간 열이 여러 개면 뒤쪽 열의 유효한 값이 우선
+    def _last_valid(keyword):
+        out = pd.Series(0.0, index=df.index)
+        for c in df.columns:
+            if keyword in str(c).lower():
+                vals = _to_float(df[c])
+                out = vals.where(vals.notna(), out)
+        return out
+
+    defaults, optimized = _last_valid('default'), _last_valid('optimized')
+
+    for cat, d, o, hs, r in zip(cats.tolist(), defaults.tolist(), optimized.tolist(), hs_codes.tolist(), rates.tolist()):
+        master_db[cat] = {"default": d, "optimized": o, "hs_code": hs, "price": DEFAULT_PRICE, "exchange_rate": r}
+    return master_db
+
+
+# ------------------------------------------------
+# 💾 로컬 스냅샷
+# ------------------------------------------------
+def save_snapshot(table, snapshot_dir=SNAPSHOT_DIR):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    payload = json.dumps(table.to_json(), ensure_ascii=False)
+    for name in (f"{table.version}.json", "latest.json"):
+        tmp = os.path.join(snapshot_dir, name + ".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f: f.write(payload)
+        os.replace(tmp, os.path.join(snapshot_dir, name))
+
+
+def load_snapshot(version='latest', snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, f"{version}.json"), encoding='utf-8') as f: data = json.load(f)
+        return FactorTable(data['factors'], version=data['version'], fetched_at=data['fetched_at'], source='snapshot')
+    except (OSError, ValueError, KeyError): return None
+
+
+def fetch_factor_table(url):
+    import pandas as pd
+    return FactorTable(parse_cbam_frame(pd.read_csv(url)), source=url)
+
+
+class FactorStore:
+    """프로세스당 하나. get() 은 절대 네트워크를 기다리지 않는다 (스냅샷이 전혀 없는 첫 실행만 예외).
+    background=True 면 스냅샷이 없을 때도 바로 돌아오고 첫 다운로드는 백그라운드에서 한다
+    (그동안은 내장 계수). 첫 값이 꼭 필요하면 get(wait=초) 로 기다린다."""
+
+    def __init__(self, url, max_age=600, snapshot_dir=SNAPSHOT_DIR, fetch=fetch_factor_table, background=False):
+        self.url, self.max_age, self.snapshot_dir = url, max_age, snapshot_dir
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_attempt = 0.0
+        self.last_error = None
+        self.ready = threading.Event()
+        self._table = load_snapshot(snapshot_dir=snapshot_dir)
+        if self._table is None and background:
+            self._table = FactorTable(BUILTIN_FACTORS)
+            self.refresh_async()
+            return
+        if self._table is None: self._table = self.refresh() or FactorTable(BUILTIN_FACTORS)
+        self.ready.set()
+
+    def get(self, wait=0):
+        if wait and not self.ready.is_set(): self.ready.wait(wait)
+        table = self._table
+        if table.age > self.max_age and time.time() >= self._next_attempt: self.refresh_async()
+        return table
+
+    def refresh(self):
+        try:
+            new = self._fetch(self.url)
+        except Exception as e:
+            self.last_error = e
+            self._next_attempt = time.time() + min(self.max_age, 60)
+            print(f"CBAM factor refresh failed: {e}")
+            return None
+        try: save_snapshot(new, self.snapshot_dir)
+        except OSError as e: print(f"CBAM snapshot write failed: {e}")
+        self.last_error = None
+        self._table = new
+        return new
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing: return
+            self._refreshing = True
+
+        def _run():
+            try: self.refresh()
+            finally:
+                with self._lock: self._refreshing = False
+                self.ready.set()  # 실패해도 기다리는 쪽은 풀어 준다 (내장/기존 계수 사용)
+
+        threading.Thread(target=_run, name="cbam-factor-refresh", daemon=True).start()
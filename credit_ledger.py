@@ -0,0 +1,102 @@
+# ==========================================
+# 💳 크레딧 원장 (SQLite, 파일 단위 예약 -> 확정 / 환불)
+# ==========================================
+# 분석을 시작할 때 파일 수만큼 잔액에서 먼저 떼어 두고(reserve), 파일마다 성공하면 확정(commit),
+# 실패하면 되돌린다(refund). 예약은 "잔액이 충분할 때만 차감" 하는 UPDATE 한 문장이라
+# 같은 회사의 여러 배치가 동시에 들어와도 잔액 이상으로 팔리지 않고, 분석 자체는 잠금 밖에서 돈다.
+# 잔액의 원천은 사용자 시트의 credits 열: 관리자가 값을 바꾸면 바뀐 만큼만 잔액에 더하고 뺀다.
+import time
+
+import storage
+
+UNLIMITED_CREDITS = 999999  # 시트에 이 값 이상이면 무제한 (VIP)
+RESERVATION_TTL = 3600  # 이보다 오래 확정되지 않은 예약은 (프로세스가 죽은 것으로 보고) 환불
+
+
+def _key(username):
+    return str(username).upper().strip()
+
+
+def sync_accounts(accounts, path=storage.DB_PATH):
+    """accounts: [(username, 시트 credits)]. 시트 값이 바뀐 계정만 차이만큼 잔액을 조정한다.
+    여러 프로세스가 같은 시트 변경을 반영해도 sheet_credits 비교 덕분에 한 번만 적용된다."""
+    now = time.time()
+    rows = {}
+    for username, credits in accounts: rows.setdefault(_key(username), int(credits or 0))
+    if not rows: return
+    with storage.get_db(path).transaction() as conn:
+        conn.executemany('''
+            INSERT INTO credit_accounts (username, balance, sheet_credits, unlimited, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (username) DO UPDATE SET
+                balance = balance + excluded.sheet_credits - sheet_credits,
+                sheet_credits = excluded.sheet_credits, unlimited = excluded.unlimited, updated_at = excluded.updated_at
+            WHERE sheet_credits != excluded.sheet_credits OR unlimited != excluded.unlimited
+        ''', [(u, c, c, int(c >= UNLIMITED_CREDITS), now) for u, c in rows.items()])
+
+
+def account(username, path=storage.DB_PATH):
+    """{'balance', 'unlimited', 'reserved'} (계정이 없으면 None)."""
+    with storage.get_db(path).connection() as conn:
+        row = conn.execute("SELECT balance, unlimited FROM credit_accounts WHERE username = ?", (_key(username),)).fetchone()
+        if row is None: return None
+        reserved = conn.execute("SELECT COUNT(*) FROM credit_reservations WHERE username = ? AND status = 'reserved' AND amount > 0",
+                                (_key(username),)).fetchone()[0]
+    return {'balance': row[0], 'unlimited': bool(row[1]), 'reserved': reserved}
+
+
+def reserve(username, refs, path=storage.DB_PATH):
+    """refs(파일 이름 등) 하나당 1 크레딧을 예약. 예약 ID 목록(refs 와 같은 순서), 잔액이 모자라면 None."""
+    refs = list(refs)
+    if not refs: return []
+    user, now = _key(username), time.time()
+    with storage.get_db(path).transaction() as conn:
+        row = conn.execute('''
+            UPDATE credit_accounts SET balance = balance - CASE WHEN unlimited THEN 0 ELSE ? END
+            WHERE username = ? AND (unlimited OR balance >= ?)
+            RETURNING unlimited
+        ''', (len(refs), user, len(refs))).fetchone()
+        if row is None: return None
+        amount = 0 if row[0] else 1
+        return [conn.execute("INSERT INTO credit_reservations (username, ref, amount, status, created_at) VALUES (?, ?, ?, 'reserved', ?)",
+                             (user, str(ref), amount, now)).lastrowid for ref in refs]
+
+
+def settle_in(conn, ids, ok=True):
+    """열린 트랜잭션 안에서 예약을 확정(ok) 또는 환불. 이미 처리된 예약은 건너뛴다 (중복 호출 안전)."""
+    ids = [int(i) for i in ids if i is not None]
+    if not ids: return 0
+    marks = ', '.join('?' * len(ids))
+    now = time.time()
+    if ok:
+        return conn.execute(f"UPDATE credit_reservations SET status = 'committed', settled_at = ? WHERE status = 'reserved' AND id IN ({marks})",
+                            [now] + ids).rowcount
+    refunded = conn.execute(f"UPDATE credit_reservations SET status = 'refunded', settled_at = ? WHERE status = 'reserved' AND id IN ({marks}) "
+                            "RETURNING username, amount", [now] + ids).fetchall()
+    totals = {}
+    for user, amount in refunded: totals[user] = totals.get(user, 0) + amount
+    conn.executemany("UPDATE credit_accounts SET balance = balance + ? WHERE username = ?",
+                     [(amount, user) for user, amount in totals.items() if amount])
+    return len(refunded)
+
+
+def settle(ids, ok, path=storage.DB_PATH):
+    """ids 와 ok(파일별 성공 여부)를 짝지어 확정 / 환불을 한 트랜잭션으로. (확정 수, 환불 수) 반환."""
+    pairs = list(zip(ids, ok))
+    with storage.get_db(path).transaction() as conn:
+        return (settle_in(conn, [i for i, good in pairs if good], ok=True),
+                settle_in(conn, [i for i, good in pairs if not good], ok=False))
+
+
+def refund(ids, path=storage.DB_PATH):
+    with storage.get_db(path).transaction() as conn:
+        return settle_in(conn, ids, ok=False)
+
+
+def expire_reservations(ttl=RESERVATION_TTL, path=storage.DB_PATH):
+    """오래된 예약 환불. 작업 큐에서 아직 대기 / 처리 중인 파일의 예약은 건드리지 않는다."""
+    with storage.get_db(path).transaction() as conn:
+        stale = [r[0] for r in conn.execute('''
+            SELECT id FROM credit_reservations WHERE status = 'reserved' AND created_at < ?
+            AND id NOT IN (SELECT reservation_id FROM job_files WHERE status IN ('queued', 'running') AND reservation_id IS NOT NULL)
+        ''', (time.time() - ttl,)).fetchall()]
+        return settle_in(conn, stale, ok=False)
@@ -0,0 +1,103 @@
+# ==========================================
+# 🖼️ 이미지 전처리 (모델 호출 전 용량 축소)
+# ==========================================
+# 실제 MIME 판별 -> EXIF 회전 보정 -> 최대 해상도로 축소 -> 흑백 변환 -> JPEG 재압축.
+# 여러 페이지 TIFF/PDF 는 페이지별 이미지로 나눠 한 파일(한 요청)의 여러 part 로 보낸다.
+# Pillow / pypdfium2 가 없으면 원본을 그대로 보낸다 (PDF 는 Gemini 가 직접 읽을 수 있음).
+import io
+
+try:
+    from PIL import Image, ImageOps, ImageSequence
+except ImportError:  # pragma: no cover - Pillow 는 streamlit 의존성이라 보통 설치되어 있음
+    Image = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# PDF 를 페이지별 이미지로 나눌 수 있는지 (requirements.txt 의 pypdfium2 가 없으면 PDF 는 원본 그대로 전송)
+PDF_SPLIT_AVAILABLE = pdfium is not None and Image is not None
+
+DEFAULT_MAX_SIDE = 2000
+DEFAULT_QUALITY = 80
+MAX_PAGES = 20
+PDF_RENDER_SCALE = 200 / 72  # 200 dpi
+
+_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'%PDF', 'application/pdf'),
+    (b'BM', 'image/bmp'),
+]
+
+
+def detect_mime(data, filename=None):
+    """파일 앞부분(매직 바이트)으로 실제 형식을 판별. 모르면 확장자, 그래도 모르면 image/jpeg."""
+    head = bytes(data[:16])
+    for sig, mime in _SIGNATURES:
+        if head.startswith(sig): return mime
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP': return 'image/webp'
+    if head[4:12] in (b'ftypheic', b'ftypheix', b'ftypmif1', b'ftypheif'): return 'image/heic'
+    ext = str(filename or '').rsplit('.', 1)[-1].lower()
+    return {'png': 'image/png', 'pdf': 'application/pdf', 'tif': 'image/tiff', 'tiff': 'image/tiff',
+            'webp': 'image/webp'}.get(ext, 'image/jpeg')
+
+
+def _encode(img, max_side, grayscale, quality):
+    img = ImageOps.exif_transpose(img)
+    if max_side: img.thumbnail((max_side, max_side), Image.LANCZOS)
+    img = img.convert('L') if grayscale else img.convert('RGB')
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def _needs_rotation(img):
+    try: return img.getexif().get(0x0112, 1) not in (None, 1)
+    except Exception: return False
+
+
+def _pdf_pages(data, max_pages):
+    doc = pdfium.PdfDocument(data)
+    try:
+        for i in range(min(len(doc), max_pages)):
+            yield doc[i].render(scale=PDF_RENDER_SCALE).to_pil()
+    finally: doc.close()
+
+
+def prepare_image(data, filename=None, max_side=DEFAULT_MAX_SIDE, grayscale=True, quality=DEFAULT_QUALITY, max_pages=MAX_PAGES):
+    """업로드 파일 -> 모델 요청 part 목록.
+
+    반환 dict: parts([{"mime_type", "data"}]), mime(원본 형식), pages, original_bytes, prepared_bytes.
+    전처리 중 오류가 나면 원본을 실제 MIME 으로 그대로 보낸다.
+    """
+    mime = detect_mime(data, filename)
+    original = [{"mime_type": mime, "data": data}]
+    parts = original
+    try:
+        if mime == 'application/pdf':
+            if PDF_SPLIT_AVAILABLE:
+                parts = [{"mime_type": "image/jpeg", "data": _encode(p, max_side, grayscale, quality)}
+                         for p in _pdf_pages(data, max_pages)] or original
+        elif Image is not None and mime != 'image/heic':
+            img = Image.open(io.BytesIO(data))
+            frames = [f.copy() for _, f in zip(range(max_pages), ImageSequence.Iterator(img))]
+            encoded = [{"mime_type": "image/jpeg", "data": _encode(f, max_side, grayscale, quality)} for f in frames]
+            # 한 장짜리인데 재압축이 오히려 크고 회전 보정도 필요 없으면 원본 유지
+            if len(encoded) == 1 and len(encoded[0]["data"]) >= len(data) and not _needs_rotation(img) \
+                    and mime in ('image/jpeg', 'image/png', 'image/webp'):
+                encoded = original
+            parts = encoded or original
+    except Exception as e:
+        print(f"Image preprocessing skipped ({filename}): {e}")
+        parts = original
+
+    return {
+        "parts": parts, "mime": mime, "pages": len(parts),
+        "original_bytes": len(data), "prepared_bytes": sum(len(p["data"]) for p in parts),
+    }
@@ -0,0 +1,234 @@
+# ==========================================
+# 📮 분석 작업 큐 (SQLite 기반, 별도 워커 프로세스)
+# ==========================================
+# 업로드하면 파일 원본을 job_files 에 넣고 바로 돌아온다. 워커 프로세스가 파일을 하나씩
+# (또는 묶음으로) 가져가 분석하고, 결과를 history 에 즉시 저장한다.
+# 파일 상태: queued -> running -> done / failed. 워커가 죽으면 임대(lease) 시간이 지난
+# running 파일을 다른 워커가 다시 queued 로 돌려 이어서 처리한다. 분석하는 동안에는 타이머 스레드가
+# heartbeat 를 계속 갱신하므로, 오래 걸리는 파일이라도 살아 있는 워커의 파일은 빼앗기지 않는다.
+# 파일마다 크레딧 예약(credit_ledger)을 달아 두면 결과를 저장하는 같은 트랜잭션에서 확정 / 환불한다.
+#
+# 단독 실행: python job_queue.py --workers 4   (GEMINI_API_KEY 환경 변수 필요)
+import argparse
+import multiprocessing as mp
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import credit_ledger
+import storage
+import telemetry
+
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = LEASE_SECONDS / 5  # 임대 갱신 주기 (임대 시간보다 충분히 짧게)
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 1.0
+REQUEUE_SECONDS = 30  # requeue_stale 주기 (쓰기 트랜잭션이라 매 폴링마다 돌리지 않는다)
+
+
+# ------------------------------------------------
+# 📥 작업 등록 / 조회 (Streamlit 쪽)
+# ------------------------------------------------
+def enqueue_job(username, files, reservations=None, path=storage.DB_PATH):
+    """files: [(image_bytes, filename)], reservations: files 와 같은 순서의 크레딧 예약 ID. 작업 ID 반환."""
+    reservations = list(reservations) if reservations is not None else [None] * len(files)
+    job_id = str(uuid.uuid4())
+    with storage.get_db(path).transaction() as conn:
+        conn.execute("INSERT INTO jobs (id, username, created_at, status, total) VALUES (?, ?, ?, 'queued', ?)",
+                     (job_id, str(username).upper().strip(), time.time(), len(files)))
+        conn.executemany("INSERT INTO job_files (job_id, seq, filename, data, reservation_id) VALUES (?, ?, ?, ?, ?)",
+                         [(job_id, seq, name, data, res) for seq, ((data, name), res) in enumerate(zip(files, reservations))])
+    return job_id
+
+
+def job_progress(job_id, path=storage.DB_PATH):
+    with storage.get_db(path).connection() as conn:
+        job = conn.execute("SELECT status, total, done, failed, created_at, finished_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None: return None
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM job_files WHERE job_id = ? GROUP BY status", (job_id,)).fetchall())
+    status, total, done, failed, created_at, finished_at = job
+    return {"job_id": job_id, "status": status, "total": total, "done": done, "failed": failed,
+            "running": counts.get('running', 0), "queued": counts.get('queued', 0),
+            "created_at": created_at, "finished_at": finished_at}
+
+
+def active_jobs(username, path=storage.DB_PATH):
+    with storage.get_db(path).connection() as conn:
+        rows = conn.execute("SELECT id FROM jobs WHERE username = ? AND status IN ('queued', 'running') ORDER BY created_at",
+                            (str(username).upper().strip(),)).fetchall()
+    return [r[0] for r in rows]
+
+
+def job_results(job_id, path=storage.DB_PATH):
+    """업로드 순서(seq) 그대로 결과 행 dict 목록."""
+    with storage.get_db(path).connection() as conn:
+        cur = conn.execute('''
+            SELECT h.* FROM history h JOIN job_files f ON h.job_file_id = f.id
+            WHERE f.job_id = ? ORDER BY f.seq, h.id
+        ''', (job_id,))
+        cols = [storage.HISTORY_COLUMNS.get(d[0], d[0]) for d in cur.description]
+        return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+
+# ------------------------------------------------
+# ⚙️ 워커 쪽
+# ------------------------------------------------
+def requeue_stale(lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS, path=storage.DB_PATH):
+    """임대 시간이 지난 running 파일을 되돌린다 (시도 횟수를 넘기면 failed)."""
+    cutoff = time.time() - lease_seconds
+    with storage.get_db(path).transaction() as conn:
+        conn.execute("UPDATE job_files SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat < ? AND attempts < ?",
+                     (cutoff, max_attempts))
+        stuck = conn.execute("SELECT id, job_id, reservation_id FROM job_files WHERE status = 'running' AND heartbeat < ?", (cutoff,)).fetchall()
+        for file_id, job_id, reservation_id in stuck:
+            conn.execute("UPDATE job_files SET status = 'failed', data = NULL, finished_at = ?, error = 'lease expired' WHERE id = ?",
+                         (time.time(), file_id))
+            _bump_job(conn, job_id, failed=1)
+            credit_ledger.settle_in(conn, [reservation_id], ok=False)
+
+
+def claim_files(worker_id, limit=1, path=storage.DB_PATH):
+    """queued 파일을 최대 limit 개 원자적으로 가져간다. [(file_id, job_id, username, filename, data)]"""
+    now = time.time()
+    with storage.get_db(path).transaction() as conn:
+        rows = conn.execute('''
+            UPDATE job_files SET status = 'running', worker = ?, heartbeat = ?, attempts = attempts + 1
+            WHERE id IN (SELECT id FROM job_files WHERE status = 'queued' ORDER BY id LIMIT ?)
+            RETURNING id, job_id, filename, data
+        ''', (worker_id, now, int(limit))).fetchall()
+        if not rows: return []
+        job_ids = sorted({r[1] for r in rows})
+        conn.execute(f"UPDATE jobs SET status = 'running' WHERE status = 'queued' AND id IN ({', '.join('?' * len(job_ids))})", job_ids)
+        users = dict(conn.execute(f"SELECT id, username FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))})", job_ids).fetchall())
+    return sorted((fid, jid, users.get(jid, ''), name, data) for fid, jid, name, data in rows)
+
+
+def renew_leases(worker_id, file_ids, path=storage.DB_PATH):
+    """이 워커가 처리 중인 파일의 heartbeat 갱신. 갱신된 파일 수 반환 (다른 워커에게 넘어간 파일은 제외)."""
+    file_ids = [int(i) for i in file_ids]
+    if not file_ids: return 0
+    with storage.get_db(path).transaction() as conn:
+        return conn.execute(f"UPDATE job_files SET heartbeat = ? WHERE status = 'running' AND worker = ? AND id IN ({', '.join('?' * len(file_ids))})",
+                            [time.time(), worker_id] + file_ids).rowcount
+
+
+@contextmanager
+def keep_alive(worker_id, file_ids, interval=HEARTBEAT_SECONDS, path=storage.DB_PATH):
+    """with 블록이 도는 동안 interval 마다 renew_leases 를 부르는 타이머 스레드."""
+    stop = threading.Event()
+
+    def _run():
+        while not stop.wait(interval):
+            try: renew_leases(worker_id, file_ids, path=path)
+            except Exception as e: print(f"Lease renewal failed: {e}")
+
+    thread = threading.Thread(target=_run, name="cbam-heartbeat", daemon=True)
+    thread.start()
+    try: yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _bump_job(conn, job_id, done=0, failed=0):
+    conn.execute("UPDATE jobs SET done = done + ?, failed = failed + ? WHERE id = ?", (done, failed, job_id))
+    conn.execute("UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ? AND done + failed >= total AND status != 'done'",
+                 (time.time(), job_id))
+
+
+def complete_file(file_id, job_id, rows, worker_id, path=storage.DB_PATH):
+    """결과 저장 + 파일 상태 갱신 + 크레딧 확정/환불을 한 트랜잭션으로 (중간에 죽어도 반쯤 저장된 상태가 남지 않음).
+    파일이 아직 이 워커(worker_id)의 running 상태일 때만 저장한다. 저장했으면 True."""
+    failed = any(str(r.get('Validation', '')).startswith('❌') for r in rows)
+    with storage.get_db(path).transaction() as conn:
+        # 소유 확인과 상태 변경을 조건부 UPDATE 한 문장으로 (SELECT 후 UPDATE 는 그 사이에 임대를 뺏길 수 있음)
+        cur = conn.execute('''
+            UPDATE job_files SET status = ?, data = NULL, finished_at = ?, error = ?
+            WHERE id = ? AND status = 'running' AND worker = ?
+            RETURNING reservation_id
+        ''', ('failed' if failed else 'done', time.time(), 'analysis failed' if failed else None, file_id, worker_id)).fetchone()
+        if cur is None: return False  # 임대가 끝나 다른 워커가 가져갔거나 이미 처리됨
+        storage.insert_history(conn, [dict(r, job_file_id=file_id) for r in rows])
+        _bump_job(conn, job_id, done=0 if failed else 1, failed=1 if failed else 0)
+        credit_ledger.settle_in(conn, [cur[0]], ok=not failed)
+    return True
+
+
+def worker_main(config):
+    """워커 프로세스 본체. config: api_key, factor_url, factor_max_age, rpm, max_retries, prep, batch_size, db_path."""
+    from analysis_engine import AnalysisContext, TokenBucket, analyze_files
+    from cbam_factors import FactorStore
+    from result_cache import ResultCache
+
+    api_key = config.get('api_key') or os.environ.get('GEMINI_API_KEY')
+    if api_key:
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+
+    path = config.get('db_path', storage.DB_PATH)
+    telemetry.RECORDER.db_path = path
+    batch_size = max(1, int(config.get('batch_size', 1)))
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    factors = FactorStore(config['factor_url'], max_age=config.get('factor_max_age', 600))
+    cache = ResultCache()
+    rate = float(config.get('rpm', 60)) / 60.0
+    limiter = TokenBucket(rate=rate, capacity=max(1.0, rate))
+    storage.init_db(path)
+
+    next_requeue = 0.0
+    while True:
+        if time.time() >= next_requeue:
+            requeue_stale(path=path)
+            next_requeue = time.time() + REQUEUE_SECONDS
+        claimed = claim_files(worker_id, limit=batch_size, path=path)
+        if not claimed:
+            time.sleep(POLL_SECONDS)
+            continue
+        ctx = AnalysisContext(factors.get(), limiter=limiter, cache=cache, prep=config.get('prep'),
+                              max_retries=config.get('max_retries', 3), batch_size=batch_size)
+        by_user = {}
+        for f in claimed: by_user.setdefault(f[2], []).append(f)
+        pending = [f[0] for f in claimed]
+        with keep_alive(worker_id, pending, path=path):
+            for username, files in by_user.items():
+                per_file = analyze_files([(f[4], f[3]) for f in files], username, ctx, max_workers=1)
+                for (file_id, job_id, _, _, _), rows in zip(files, per_file):
+                    complete_file(file_id, job_id, rows, worker_id, path=path)
+
+
+class WorkerPool:
+    """Streamlit 프로세스가 소유하는 워커 프로세스 묶음. ensure_alive() 로 죽은 워커를 다시 띄운다."""
+
+    def __init__(self, size, config):
+        self.size, self.config = size, dict(config)
+        # 각 워커가 자기 몫의 속도 제한을 갖도록 전체 RPM 을 나눈다
+        self.config['rpm'] = float(self.config.get('rpm', 60)) / max(1, size)
+        self._ctx = mp.get_context('spawn')
+        self.processes = []
+        self.ensure_alive()
+
+    def ensure_alive(self):
+        self.processes = [p for p in self.processes if p.is_alive()]
+        while len(self.processes) < self.size:
+            p = self._ctx.Process(target=worker_main, args=(self.config,), name="cbam-worker", daemon=True)
+            p.start()
+            self.processes.append(p)
+        return len(self.processes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CBAM 분석 작업 큐 워커")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--factor-url', default=os.environ.get('CBAM_DATA_URL', ''))
+    parser.add_argument('--rpm', type=float, default=60)
+    parser.add_argument('--batch-size', type=int, default=1)
+    args = parser.parse_args()
+    pool = WorkerPool(args.workers, {'factor_url': args.factor_url, 'rpm': args.rpm, 'batch_size': args.batch_size})
+    try:
+        while True:
+            time.sleep(5)
+            pool.ensure_alive()
+    except KeyboardInterrupt: pass
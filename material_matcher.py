@@ -0,0 +1,181 @@
+# ==========================================
+# 🔎 재질 매칭 인덱스 (키워드 오토마톤 + 문자 역색인)
+# ==========================================
+# 기존 force_match_material 규칙을 사전 컴파일한 버전.
+#  - 품목명 키워드는 Aho-Corasick 오토마톤으로 한 번에 찾는다.
+#  - 규칙별 대상 카테고리("Wire" 가 들어간 첫 카테고리 등)는 DB 버전마다 한 번만 계산한다.
+#  - difflib 폴백은 문자 -> (항목, 개수) 역색인으로 질의와 문자를 공유하는 항목의 quick_ratio 상한을 한 번에 구하고,
+#    상한이 cutoff 이상인 항목만 상한 순서로 SequenceMatcher 로 확인한다. 상한으로만 거르므로 결과는
+#    get_close_matches(n=1, cutoff) 와 같다. 카테고리 / 동의어가 수천 개여도 항목마다 SequenceMatcher 를 돌리지 않는다.
+#  - synonyms({별칭: 카테고리}) 는 같은 색인에 별칭으로 들어가 맞으면 해당 카테고리를 돌려준다.
+from collections import Counter, deque
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+import numpy as np
+
+FUZZY_CUTOFF = 0.4
+
+KEYWORDS = (
+    "pipe", "tube", "alum", "wire", "cable", "structure", "beam",
+    "bolt", "screw", "nut", "washer", "aluminum", "aluminium",
+    "ingot", "bar", "rod", "foil", "plate", "sheet", "cement", "cmnt",
+)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick: 텍스트를 한 번 훑어서 들어 있는 키워드 집합을 돌려준다 (겹치는 키워드 포함)."""
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+        for kw in keywords:
+            node = 0
+            for ch in kw:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({}); self._fail.append(0); self._out.append(set())
+                    self._goto[node][ch] = nxt
+                node = nxt
+            self._out[node].add(kw)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]: f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[nxt] = cand if cand != nxt else 0
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def find(self, text):
+        found, node = set(), 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in text:
+            while node and ch not in goto[node]: node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]: found |= out[node]
+        return found
+
+
+_AUTOMATON = KeywordAutomaton(KEYWORDS)
+
+
+class FuzzyIndex:
+    """difflib.get_close_matches(word, keys, n=1, cutoff) 와 같은 결과를 문자 역색인으로 계산한다.
+
+    quick_ratio(문자 빈도 교집합 기반)는 ratio 의 상한이므로, 상한이 cutoff 이상인 항목만 상한이 높은 순서로
+    실제 ratio 를 계산하다가 남은 항목의 상한이 현재 최고점보다 낮아지면 멈춘다. 동점이면 get_close_matches 처럼
+    문자열이 큰 쪽. synonyms 의 별칭은 별도 항목으로 색인되고, 맞으면 별칭이 가리키는 카테고리를 돌려준다.
+    """
+
+    def __init__(self, keys, cutoff=FUZZY_CUTOFF, synonyms=None):
+        self.keys = list(dict.fromkeys(keys))
+        self.cutoff = cutoff
+        key_set = set(self.keys)
+        # 색인 항목: 카테고리 자신 + (카테고리가 있는) 별칭
+        self._texts = self.keys + [a for a, k in (synonyms or {}).items() if k in key_set and a not in key_set]
+        self._targets = self.keys + [(synonyms or {})[a] for a in self._texts[len(self.keys):]]
+        # 문자 -> (그 문자가 든 항목 번호, 항목 안에서의 개수)
+        postings = {}
+        for r, text in enumerate(self._texts):
+            for ch, n in Counter(text).items(): postings.setdefault(ch, []).append((r, n))
+        self._postings = {ch: (np.array([r for r, _ in rows], dtype=np.int64), np.array([n for _, n in rows], dtype=np.int64))
+                          for ch, rows in postings.items()}
+        self._lens = np.array([len(t) for t in self._texts], dtype=np.float64)
+
+    def bounds(self, word):
+        """(항목 번호, quick_ratio 상한). 문자를 하나도 공유하지 않는 항목은 상한이 0 이라 빠진다."""
+        hit_rows, shared = [], []
+        for ch, n in Counter(word).items():
+            if ch not in self._postings: continue
+            rows, counts = self._postings[ch]
+            hit_rows.append(rows); shared.append(np.minimum(counts, n))
+        if hit_rows:
+            rows, inverse = np.unique(np.concatenate(hit_rows), return_inverse=True)
+            inter = np.bincount(inverse, weights=np.concatenate(shared), minlength=len(rows))
+        else: rows, inter = np.zeros(0, dtype=np.int64), np.zeros(0)
+        if self.cutoff <= 0 or not word:  # 상한 0 인 항목도 통과할 수 있는 경우는 전체를 본다
+            full = np.zeros(len(self._texts))
+            full[rows] = inter
+            rows, inter = np.arange(len(self._texts)), full
+        total = self._lens[rows] + len(word)
+        return rows, np.divide(2.0 * inter, total, out=np.ones_like(total), where=total > 0)
+
+    def best(self, word):
+        cand, bound = self.bounds(word)
+        keep = bound >= self.cutoff
+        cand, bound = cand[keep], bound[keep]
+        if not len(cand): return None
+
+        s = SequenceMatcher()
+        s.set_seq2(word)
+        best_score, best_text, best_row = -1.0, None, None
+        for pos in np.argsort(-bound, kind='stable'):
+            if bound[pos] < best_score: break
+            i = cand[pos]
+            x = self._texts[i]
+            s.set_seq1(x)
+            if s.real_quick_ratio() < self.cutoff: continue
+            score = s.ratio()
+            if score >= self.cutoff and (score, x) > (best_score, best_text or ''):
+                best_score, best_text, best_row = score, x, i
+        return self._targets[best_row] if best_row is not None else None
+
+
+class MaterialMatcher:
+    """CBAM_DB 버전마다 한 번 만들어 두고 match(품목명, AI 재질) 로 호출. 최근 결과는 메모한다.
+    synonyms: {AI 가 쓰는 별칭: 카테고리} — 유사도 폴백에서 카테고리 이름과 함께 비교된다."""
+
+    def __init__(self, db_keys, memo_size=4096, synonyms=None):
+        keys = list(db_keys)
+        self.keys = keys
+        first = lambda pred: next((k for k in keys if pred(k)), None)
+        self._has_pipes = first(lambda k: "Pipes" in k) is not None
+        self._wire = first(lambda k: "Wire" in k)
+        self._structures = first(lambda k: "Structures" in k)
+        self._bolt = first(lambda k: "Bolt" in k or "Screw" in k)
+        self._aluminum = first(lambda k: "Aluminum" in k)
+        self._cement = first(lambda k: "cement" in k.lower())
+        self._fuzzy = FuzzyIndex(keys, synonyms=synonyms)
+        self._memo = lru_cache(maxsize=memo_size)(self._match)
+
+    def match(self, ai_item_name, ai_material):
+        # AI 가 문자열이 아닌 값을 돌려줘도 메모 키로 쓸 수 있게 문자열로 맞춘다
+        if not isinstance(ai_item_name, str): ai_item_name = str(ai_item_name)
+        if not isinstance(ai_material, str): ai_material = str(ai_material)
+        return self._memo(ai_item_name, ai_material)
+
+    def _match(self, ai_item_name, ai_material):
+        hits = _AUTOMATON.find(ai_item_name.lower())
+
+        if hits:
+            if ("pipe" in hits or "tube" in hits) and self._has_pipes:
+                return "Aluminum (Pipes/Tubes)" if "alum" in hits else "Steel (Pipes/Tubes)"
+            if ("wire" in hits or "cable" in hits) and self._wire: return self._wire
+            if ("structure" in hits or "beam" in hits) and self._structures: return self._structures
+            if hits & {"bolt", "screw", "nut", "washer"} and self._bolt: return self._bolt
+            if "aluminum" in hits or "aluminium" in hits:
+                if "ingot" in hits: return "Aluminum (Ingots)"
+                if "bar" in hits or "rod" in hits: return "Aluminum (Bars/Rods)"
+                if "foil" in hits: return "Aluminum (Foil)"
+                if "plate" in hits or "sheet" in hits: return "Aluminum (Sheets/Plates)"
+                if self._aluminum: return self._aluminum
+            if ("cement" in hits or "cmnt" in hits) and self._cement: return self._cement
+
+        match = self._fuzzy.best(ai_material)
+        return match if match is not None else "Other"
+
+
+@lru_cache(maxsize=8)
+def _matcher_for_keys(keys, synonyms):
+    return MaterialMatcher(keys, synonyms=dict(synonyms))
+
+
+def get_matcher(db_keys, synonyms=None):
+    """같은 카테고리 목록(+ 동의어)이면 같은 MaterialMatcher 를 재사용한다."""
+    return _matcher_for_keys(tuple(db_keys), tuple(sorted((synonyms or {}).items())))
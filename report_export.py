@@ -0,0 +1,218 @@
+# ==========================================
+# 📊 KTC 표준 리포트 출력 (스트리밍 / 상수 메모리)
+# ==========================================
+# 행을 리스트로 모으지 않고 이터레이터(SQLite 커서 등)에서 바로 xlsxwriter 의
+# constant_memory 모드로 임시 파일에 쓴다. 같은 내용이면 다시 만들지 않도록
+# 행 내용 해시 -> 파일 경로를 메모해 둔다.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import storage
+import tax_engine
+import telemetry
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+HEADERS = ["No", "Origin", "HS Code", "Item Name", "Net Weight(t)", "Emission Factor", "Est. Tax (EUR)", "Est. Tax (KRW)", "Data Validation"]
+
+_MEMO = OrderedDict()
+_MEMO_LOCK = threading.Lock()
+MEMO_SIZE = 16
+
+
+def _formats(wb):
+    return {
+        'header': wb.add_format({'bold': True, 'fg_color': '#004494', 'font_color': 'white', 'border': 1, 'align': 'center'}),
+        'ktc_head': wb.add_format({'bold': True, 'bg_color': '#D7E4BC', 'border': 1, 'align': 'center'}),
+        'num': wb.add_format({'border': 1, 'num_format': '#,##0.00'}),
+        'eur': wb.add_format({'border': 1, 'num_format': '€#,##0.00'}),
+        'krw': wb.add_format({'border': 1, 'num_format': '₩#,##0'}),
+        'warn': wb.add_format({'border': 1, 'font_color': 'red'}),
+        'ok': wb.add_format({'border': 1, 'align': 'center'}),
+    }
+
+
+def _text(value):
+    return '' if value is None else str(value)
+
+
+def _write_submission_sheet(wb, fmt, rows, cbam_db):
+    ws2 = wb.add_worksheet("KTC_CBAM_Submission")
+    ws2.set_column('A:A', 5)
+    ws2.set_column('B:I', 18)
+    ws2.merge_range('A1:I1', f"CBAM Official Data (Ref: EU Regulation 2026/XXXX) - Integrity Checked (Factor Set: {getattr(cbam_db, 'version', 'n/a')})", fmt['ktc_head'])
+    for c, h in enumerate(HEADERS): ws2.write(1, c, h, fmt['header'])
+
+    n = 0
+    for i, d in enumerate(rows):
+        r = i + 2
+        w_ton = (d.get('Weight (kg)', 0) or 0) / 1000
+        mat = d.get('Material', 'Iron/Steel')
+        factor = cbam_db.get(mat, {}).get('default', 0)
+        rate = d.get('exchange_rate', 1450) or 0
+        tax = d.get('Default Tax (KRW)', 0) or 0
+        val_msg = d.get('Validation', '✅ 검증 완료')
+
+        # 자료형별 write_* 를 직접 호출해 write() 의 형식 판별(정규식) 비용을 건너뛴다
+        ws2.write_number(r, 0, i+1, fmt['ok'])
+        ws2.write_string(r, 1, "KR", fmt['ok'])
+        ws2.write_string(r, 2, _text(d.get('HS Code', '')), fmt['ok'])
+        ws2.write_string(r, 3, _text(d.get('Item Name', '')), fmt['ok'])
+        ws2.write_number(r, 4, w_ton, fmt['num'])
+        ws2.write_number(r, 5, factor, fmt['num'])
+        ws2.write_number(r, 6, (tax/rate) if rate>0 else 0, fmt['eur'])
+        ws2.write_number(r, 7, tax, fmt['krw'])
+        ws2.write_string(r, 8, val_msg, fmt['warn'] if ("🚩" in val_msg or "⚠️" in val_msg) else fmt['ok'])
+        n += 1
+    return n
+
+
+def _write_summary_sheet(wb, fmt, name, key_label, summary_rows):
+    ws = wb.add_worksheet(name)
+    ws.set_column('A:A', 28)
+    ws.set_column('B:D', 18)
+    for c, h in enumerate([key_label, "Items", "Net Weight(t)", "Est. Tax (KRW)"]): ws.write(0, c, h, fmt['header'])
+    for r, (key, count, weight_kg, tax) in enumerate(summary_rows, start=1):
+        ws.write(r, 0, key if key is not None else '', fmt['ok'])
+        ws.write(r, 1, count, fmt['ok'])
+        ws.write(r, 2, (weight_kg or 0) / 1000, fmt['num'])
+        ws.write(r, 3, tax or 0, fmt['krw'])
+
+
+def write_report(rows, path, cbam_db, summaries=()):
+    """rows: 리포트 행 dict 이터레이터. summaries: (시트명, 키 제목, [(키, 건수, 중량kg, 세금)]) 목록.
+    행 수를 반환하며 행이 없으면 파일을 만들지 않고 0."""
+    import xlsxwriter  # 리포트를 실제로 만들 때만 import (앱 시작 시간 단축)
+    with telemetry.span('excel.write') as s:
+        wb = xlsxwriter.Workbook(path, {'constant_memory': True})
+        fmt = _formats(wb)
+        n = _write_submission_sheet(wb, fmt, rows, cbam_db)
+        for name, key_label, summary_rows in summaries:
+            _write_summary_sheet(wb, fmt, name, key_label, summary_rows)
+        wb.close()
+        s.items, s.payload_bytes = n, os.path.getsize(path)
+    if n == 0:
+        os.remove(path)
+    return n
+
+
+# ------------------------------------------------
+# 🧠 내용 해시 메모
+# ------------------------------------------------
+def rows_digest(rows, *extra):
+    h = hashlib.sha256()
+    for e in extra: h.update(str(e).encode('utf-8'))
+    for d in rows: h.update(json.dumps(d, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _memo_get(digest):
+    with _MEMO_LOCK:
+        path = _MEMO.get(digest)
+        if path and os.path.exists(path):
+            _MEMO.move_to_end(digest)
+            return path
+        _MEMO.pop(digest, None)
+    return None
+
+
+def _memo_put(digest, path):
+    with _MEMO_LOCK:
+        _MEMO[digest] = path
+        while len(_MEMO) > MEMO_SIZE:
+            _, old = _MEMO.popitem(last=False)
+            try: os.remove(old)
+            except OSError: pass
+
+
+def _build_memoized(digest, build):
+    path = _memo_get(digest)
+    if path: return path
+    fd, path = tempfile.mkstemp(prefix="cbam_ktc_", suffix=".xlsx")
+    os.close(fd)
+    if not build(path): return None
+    _memo_put(digest, path)
+    return path
+
+
+def _records(data_list):
+    if hasattr(data_list, 'to_dict'): return data_list.to_dict('records')  # DataFrame (pandas 를 import 하지 않고 판별)
+    return data_list or []
+
+
+def build_batch_report(data_list, cbam_db, build=True):
+    """분석 결과(list/DataFrame) 리포트 파일 경로. 같은 행 + 같은 계수 버전이면 기존 파일 재사용.
+    build=False 이면 이미 만들어 둔 파일만 찾고 없으면 None (화면 갱신 때마다 만들지 않도록)."""
+    records = _records(data_list)
+    if not records: return None
+    digest = rows_digest(records, 'batch', getattr(cbam_db, 'version', ''))
+    if not build: return _memo_get(digest)
+    return _build_memoized(digest, lambda path: write_report(iter(records), path, cbam_db))
+
+
+def generate_official_excel(data_list, cbam_db):
+    path = build_batch_report(data_list, cbam_db)
+    if not path: return None
+    with open(path, 'rb') as f: return f.read()
+
+
+# ------------------------------------------------
+# 🗄️ 전체 기록 내보내기 (SQLite 커서 -> 엑셀, 요약 시트 포함)
+# ------------------------------------------------
+HISTORY_EXPORT_COLUMNS = ['id', 'date', 'filename', 'item_name', 'material', 'weight', 'hs_code', 'tax_krw', 'exchange_rate']
+
+
+def _history_chunks(username, filters, db_path):
+    """1000 행씩 (다 읽을 때까지 풀에서 빌린 커넥션 하나를 쓴다)."""
+    where, params = storage.history_where(username, filters)
+    with storage.get_db(db_path).connection() as conn:
+        cur = conn.execute(f"SELECT {', '.join(HISTORY_EXPORT_COLUMNS)} FROM history WHERE {where} ORDER BY id", params)
+        cur.arraysize = 1000
+        while True:
+            chunk = cur.fetchmany()
+            if not chunk: break
+            yield chunk
+
+
+def _history_rows(username, filters, cbam_db, db_path):
+    """커서를 1000 행씩 읽으며 리포트 행 dict 로 변환 (검증 메시지는 현재 계수로 다시 계산)."""
+    verdicts = {}
+    for chunk in _history_chunks(username, filters, db_path):
+        for _id, date, filename, item_name, material, weight, hs_code, tax_krw, rate in chunk:
+            verdict = verdicts.get((hs_code, material))
+            if verdict is None:
+                verdict = verdicts[(hs_code, material)] = tax_engine.validate_data(hs_code, material, cbam_db)
+            yield {
+                'Date': date, 'File Name': filename, 'Item Name': item_name, 'Material': material,
+                'Weight (kg)': weight, 'HS Code': hs_code, 'Default Tax (KRW)': tax_krw, 'exchange_rate': rate,
+                'Validation': verdict,
+            }
+
+
+def _history_summaries(username, filters, db_path):
+    where, params = storage.history_where(username, filters)
+    with storage.get_db(db_path).connection() as conn:
+        by_material = conn.execute(
+            f"SELECT material, COUNT(*), SUM(weight), SUM(tax_krw) FROM history WHERE {where} GROUP BY material ORDER BY SUM(tax_krw) DESC",
+            params).fetchall()
+        by_month = conn.execute(
+            f"SELECT substr(date, 1, 7), COUNT(*), SUM(weight), SUM(tax_krw) FROM history WHERE {where} GROUP BY substr(date, 1, 7) ORDER BY 1",
+            params).fetchall()
+    return [("Summary_By_Material", "Material", by_material), ("Summary_By_Month", "Month", by_month)]
+
+
+def export_history(username, cbam_db, filters=None, db_path=storage.DB_PATH):
+    """회사 전체(또는 필터된) 기록을 리포트 파일로. 먼저 커서를 한 번 훑어 내용 해시를 구하고,
+    같은 내용의 파일이 이미 있으면 그대로 돌려준다. 행이 없으면 None."""
+    h = hashlib.sha256(f"history|{getattr(cbam_db, 'version', '')}".encode('utf-8'))
+    for chunk in _history_chunks(username, filters, db_path):
+        h.update(repr(chunk).encode('utf-8'))
+    digest = h.hexdigest()
+
+    def _build(path):
+        return write_report(_history_rows(username, filters, cbam_db, db_path), path, cbam_db,
+                            summaries=_history_summaries(username, filters, db_path))
+    return _build_memoized(digest, _build)
@@ -0,0 +1,123 @@
+# ==========================================
+# 🗃️ 분석 결과 캐시 (이미지 내용 기반, SQLite)
+# ==========================================
+# 같은 인보이스를 다시 올리면 Gemini 호출 없이 저장된 원본 항목(JSON)을 돌려준다.
+# 재질 보정/세금 계산/검증은 캐시에 넣지 않고 매번 다시 돌리므로 최신 계수가 그대로 반영된다.
+# Streamlit / 작업 큐 워커 / CLI 가 같은 파일을 함께 쓰므로 WAL + busy_timeout 으로 열고,
+# 캐시 오류(잠김 등)는 분석 실패가 아니라 미적중 / 저장 생략으로 처리한다.
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+CACHE_DB_PATH = 'cbam_cache.db'  # cbam_database.db 와 같은 위치
+BUSY_TIMEOUT_MS = 5000
+
+
+def categories_version(cbam_db):
+    """CBAM_DB 카테고리 목록의 버전 (목록이 바뀌면 프롬프트/선택지도 바뀌므로 캐시를 분리)."""
+    return hashlib.sha256("\n".join(cbam_db.keys()).encode('utf-8')).hexdigest()[:16]
+
+
+def make_cache_key(image_bytes, prompt, db_version):
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(image_bytes).digest())
+    h.update(hashlib.sha256(prompt.encode('utf-8')).digest())
+    h.update(str(db_version).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """max_entries 개 / max_age_days 일을 넘으면 오래 안 쓴 항목부터 지운다."""
+
+    def __init__(self, path=CACHE_DB_PATH, max_entries=5000, max_age_days=90, evict_every=50):
+        self.path = path
+        self.max_entries, self.max_age = max_entries, max_age_days * 86400
+        self.evict_every = evict_every
+        self.hits = self.misses = self._puts = self.errors = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        try:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    items_json TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hit_count INTEGER DEFAULT 0
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_last_used ON analysis_cache(last_used)')
+            self._conn.commit()
+        except sqlite3.Error as e: self._failed('open', e)  # 손상 / 잠김: 이후 get / put / stats 도 실패를 기록하고 넘어간다
+
+    def get(self, key):
+        """저장된 항목 (없거나 오래됐거나 캐시 DB 오류면 None = 미적중)."""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    'SELECT items_json, created_at FROM analysis_cache WHERE cache_key = ?', (key,)
+                ).fetchone()
+                if row is None or now - row[1] > self.max_age:
+                    self.misses += 1
+                    return None
+                items = json.loads(row[0])
+            except (sqlite3.Error, ValueError) as e:
+                self._failed('get', e)
+                self.misses += 1
+                return None
+            try:
+                self._conn.execute(
+                    'UPDATE analysis_cache SET last_used = ?, hit_count = hit_count + 1 WHERE cache_key = ?', (now, key)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e: self._failed('touch', e)  # 사용 시각 갱신만 못 했을 뿐 결과는 그대로 쓴다
+            self.hits += 1
+        return items
+
+    def put(self, key, items):
+        """저장 성공 여부. 실패(잠김 등)해도 예외를 던지지 않는다 — 이미 받은 분석 결과는 그대로 쓴다."""
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO analysis_cache (cache_key, items_json, created_at, last_used, hit_count) VALUES (?, ?, ?, ?, 0)',
+                    (key, json.dumps(items, ensure_ascii=False), now, now)
+                )
+                self._puts += 1
+                if self._puts % self.evict_every == 0: self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._failed('put', e)
+                return False
+        return True
+
+    def _failed(self, op, error):
+        self.errors += 1
+        print(f"Result cache {op} skipped: {error}")
+        try: self._conn.rollback()
+        except sqlite3.Error: pass
+
+    def _evict(self, now):
+        self._conn.execute('DELETE FROM analysis_cache WHERE created_at < ?', (now - self.max_age,))
+        self._conn.execute('''
+            DELETE FROM analysis_cache WHERE cache_key IN (
+                SELECT cache_key FROM analysis_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+
+    def stats(self):
+        """entries 는 세지 못하면(잠김 / 손상) None — 사이드바가 매번 부르므로 예외를 던지지 않는다."""
+        with self._lock:
+            try: size = self._conn.execute('SELECT COUNT(*) FROM analysis_cache').fetchone()[0]
+            except sqlite3.Error as e:
+                self._failed('stats', e)
+                size = None
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": size, "errors": self.errors,
+                "hit_rate": (self.hits / total) if total else 0.0}
@@ -0,0 +1,75 @@
+# ==========================================
+# 📝 검토 탭 행 저장소 (키 기반 + 변경분만 재계산)
+# ==========================================
+# 분석 결과 행을 키(history id, 없으면 순번)로 들고 있으면서, 사용자가 바꾼 행만
+# 세금/검증을 다시 계산한다. 총 중량/세금 합계는 바뀐 행의 차이만 더하고 빼며,
+# 수정된 행은 dirty 로 표시해 두었다가 flush() 때 history 테이블에 반영한다.
+import storage
+import tax_engine
+from tax_engine import safe_float
+
+EDITABLE = ('Material', 'HS Code', 'Weight (kg)')
+
+
+def _flags(row):
+    v = str(row.get('Validation', ''))
+    return ('🚩' in v), ('⚠️' in v)
+
+
+class ReviewStore:
+    """세션마다 하나 (분석 실행 단위). 화면은 page() 로 필요한 키만 꺼내 그린다."""
+
+    def __init__(self, rows, cbam_db):
+        self.cbam_db = cbam_db
+        self.rows = {}
+        for seq, row in enumerate(rows or []):
+            row = dict(row)
+            row['Weight (kg)'] = safe_float(row.get('Weight (kg)', 0))
+            key = f"id{row['id']}" if row.get('id') is not None else f"row{seq}"
+            self.rows[key] = row
+        self.keys = list(self.rows)
+        self.dirty = set()
+        self.version = 0
+        self.total_weight = sum(r['Weight (kg)'] for r in self.rows.values())
+        self.total_tax = sum(int(r.get('Default Tax (KRW)') or 0) for r in self.rows.values())
+        flags = [_flags(r) for r in self.rows.values()]
+        self.n_mismatch = sum(f[0] for f in flags)
+        self.n_warning = sum(f[1] for f in flags)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def page(self, number, size):
+        return self.keys[number * size:(number + 1) * size]
+
+    def records(self, keys=None):
+        return [self.rows[k] for k in (self.keys if keys is None else keys)]
+
+    def update(self, key, changes):
+        """changes: {'Material'|'HS Code'|'Weight (kg)': 값}. 입력이 실제로 바뀐 경우만 재계산하고 True."""
+        row = self.rows[key]
+        new = {c: changes.get(c, row.get(c)) for c in EDITABLE}
+        new['Weight (kg)'] = safe_float(new['Weight (kg)'])
+        new['HS Code'] = '' if new['HS Code'] is None else str(new['HS Code'])
+        if all(new[c] == row.get(c) for c in EDITABLE): return False
+
+        calc = tax_engine.calculate_tax_logic(new['Material'], new['Weight (kg)'], self.cbam_db)
+        self.total_weight += new['Weight (kg)'] - row['Weight (kg)']
+        self.total_tax += calc['bad_tax'] - int(row.get('Default Tax (KRW)') or 0)
+        old_flags = _flags(row)
+        row.update(new)
+        row.update({'Default Tax (KRW)': calc['bad_tax'], 'exchange_rate': calc['exchange_rate'],
+                    'Validation': tax_engine.validate_data(new['HS Code'], new['Material'], self.cbam_db)})
+        new_flags = _flags(row)
+        self.n_mismatch += new_flags[0] - old_flags[0]
+        self.n_warning += new_flags[1] - old_flags[1]
+        self.dirty.add(key)
+        self.version += 1
+        return True
+
+    def flush(self, username, path=storage.DB_PATH):
+        """dirty 행을 history 에 반영 (id 를 아는 행만). 반영한 행 수 반환."""
+        updates = [self.rows[k] for k in self.dirty if self.rows[k].get('id') is not None]
+        n = storage.update_history_rows(username, updates, path=path) if updates else 0
+        self.dirty.clear()
+        return n
@@ -0,0 +1,388 @@
+# ==========================================
+# 💾 영속 저장소 (SQLite WAL + 프로세스 공용 커넥션 풀 + 스키마 마이그레이션)
+# ==========================================
+# 매 호출마다 connect/close 하던 것을 프로세스 전체가 함께 쓰는 작은 커넥션 풀(최대 POOL_SIZE 개)로 바꾸고,
+# PRAGMA user_version 으로 스키마 버전을 관리해 기존 cbam_database.db 에도 변경을 적용한다.
+# Streamlit 은 재실행마다 스크립트 스레드를 새로 만들므로 커넥션을 스레드에 묶지 않고
+# connection() / transaction() 블록 동안만 빌려 쓴 뒤 풀에 돌려준다.
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import tax_engine
+import telemetry
+
+DB_PATH = 'cbam_database.db'
+POOL_SIZE = 8
+
+# (버전, SQL) — 새 변경은 항상 맨 뒤에 추가. 이미 적용된 버전은 다시 실행되지 않는다.
+MIGRATIONS = [
+    (1, '''
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            date TEXT,
+            filename TEXT,
+            item_name TEXT,
+            material TEXT,
+            weight REAL,
+            hs_code TEXT,
+            tax_krw INTEGER,
+            exchange_rate REAL
+        )
+    '''),
+    (2, '''
+        CREATE INDEX IF NOT EXISTS idx_history_user_id ON history(username, id);
+        CREATE INDEX IF NOT EXISTS idx_history_user_date ON history(username, date);
+    '''),
+    (3, '''
+        UPDATE history SET date = '' WHERE date IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_history_user_material ON history(username, material);
+        CREATE INDEX IF NOT EXISTS idx_history_user_hs ON history(username, hs_code);
+    '''),
+    (4, '''
+        ALTER TABLE history ADD COLUMN validation TEXT;
+        ALTER TABLE history ADD COLUMN job_file_id INTEGER;
+        CREATE INDEX IF NOT EXISTS idx_history_job_file ON history(job_file_id);
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            username TEXT,
+            created_at REAL,
+            finished_at REAL,
+            status TEXT DEFAULT 'queued',
+            total INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(username, created_at);
+        CREATE TABLE IF NOT EXISTS job_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT,
+            seq INTEGER,
+            filename TEXT,
+            data BLOB,
+            status TEXT DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            worker TEXT,
+            heartbeat REAL,
+            finished_at REAL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_job_files_status ON job_files(status, id);
+        CREATE INDEX IF NOT EXISTS idx_job_files_job ON job_files(job_id, seq);
+    '''),
+    (5, '''
+        CREATE TABLE IF NOT EXISTS metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL,
+            stage TEXT,
+            duration_ms REAL,
+            ok INTEGER,
+            error TEXT,
+            payload_bytes INTEGER,
+            tokens_in INTEGER,
+            tokens_out INTEGER,
+            items INTEGER,
+            username TEXT,
+            detail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics(ts);
+        CREATE INDEX IF NOT EXISTS idx_metrics_stage_ts ON metrics(stage, ts);
+    '''),
+    (6, '''
+        ALTER TABLE history ADD COLUMN batch_file_id INTEGER;
+        CREATE INDEX IF NOT EXISTS idx_history_batch_file ON history(batch_file_id);
+        CREATE TABLE IF NOT EXISTS batch_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            sha256 TEXT,
+            path TEXT,
+            status TEXT,
+            items INTEGER DEFAULT 0,
+            finished_at REAL,
+            UNIQUE (username, sha256)
+        );
+    '''),
+    (7, '''
+        CREATE TABLE IF NOT EXISTS credit_accounts (
+            username TEXT PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 0,
+            sheet_credits INTEGER NOT NULL DEFAULT 0,
+            unlimited INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS credit_reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            ref TEXT,
+            amount INTEGER NOT NULL DEFAULT 1,
+            status TEXT,
+            created_at REAL,
+            settled_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_credit_res_status ON credit_reservations(status, created_at);
+        CREATE INDEX IF NOT EXISTS idx_credit_res_user ON credit_reservations(username, status);
+        ALTER TABLE job_files ADD COLUMN reservation_id INTEGER;
+    '''),
+]
+
+HISTORY_COLUMNS = {
+    'date': 'Date', 'filename': 'File Name', 'item_name': 'Item Name',
+    'material': 'Material', 'weight': 'Weight (kg)', 'hs_code': 'HS Code',
+    'tax_krw': 'Default Tax (KRW)', 'exchange_rate': 'exchange_rate', 'username': 'Company',
+    'validation': 'Validation'
+}
+
+
+class Database:
+    """경로당 하나. 최대 pool_size 개의 WAL 커넥션을 열어 두고 세션 / 스레드가 돌려 쓴다 (읽기는 서로 막지 않음).
+    같은 스레드가 블록을 겹쳐 열면 (예: 조회 제너레이터 도중 저장) 이미 빌린 커넥션을 그대로 준다."""
+
+    def __init__(self, path=DB_PATH, busy_timeout_ms=5000, pool_size=POOL_SIZE):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.pool_size = pool_size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
+        self._held = threading.local()  # 이 스레드가 지금 빌려 쓰는 커넥션과 겹친 깊이 (커넥션 보관용이 아님)
+        self._migrate_lock = threading.RLock()
+        self._migrated = False
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        return conn
+
+    def _checkout(self):
+        try: return self._idle.get_nowait()
+        except queue.Empty: pass
+        with self._pool_lock:
+            can_open = self._opened < self.pool_size
+            if can_open: self._opened += 1
+        if can_open:
+            try: return self._open()
+            except Exception:
+                with self._pool_lock: self._opened -= 1
+                raise
+        try: return self._idle.get(timeout=self.busy_timeout_ms / 1000)
+        except queue.Empty: raise sqlite3.OperationalError(f"connection pool exhausted ({self.pool_size})") from None
+
+    def _checkin(self, conn):
+        try:
+            if conn.in_transaction: conn.rollback()  # 끝나지 않은 트랜잭션을 다음 사용자에게 넘기지 않는다
+        except sqlite3.Error:
+            conn.close()
+            with self._pool_lock: self._opened -= 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """풀에서 커넥션을 빌려 블록 동안 쓴다 (조회용; 쓰기는 transaction())."""
+        held = self._held
+        if getattr(held, 'depth', 0) == 0: held.conn = self._checkout()
+        held.depth = getattr(held, 'depth', 0) + 1
+        conn = held.conn
+        try:
+            if not self._migrated: self.migrate(conn)
+            yield conn
+        finally:
+            held.depth -= 1
+            if held.depth == 0:
+                held.conn = None
+                self._checkin(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            with conn: yield conn
+
+    def migrate(self, conn=None):
+        if conn is None:
+            with self.connection(): return  # 처음 빌릴 때 마이그레이션이 적용된다
+        with self._migrate_lock:
+            if self._migrated: return
+            # 여러 프로세스(워커)가 동시에 시작해도 한 곳만 적용하도록 쓰기 잠금을 잡은 뒤 버전을 다시 읽는다
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                current = conn.execute('PRAGMA user_version').fetchone()[0]
+                for version, sql in MIGRATIONS:
+                    if version <= current: continue
+                    for stmt in sql.split(';'):
+                        if stmt.strip(): conn.execute(stmt)
+                    conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            self._migrated = True
+
+    @property
+    def schema_version(self):
+        with self.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+_DATABASES = {}
+_DATABASES_LOCK = threading.Lock()
+
+
+def get_db(path=DB_PATH):
+    with _DATABASES_LOCK:
+        db = _DATABASES.get(path)
+        if db is None: db = _DATABASES[path] = Database(path)
+    return db
+
+
+# ------------------------------------------------
+# 🗂️ history 테이블
+# ------------------------------------------------
+def init_db(path=DB_PATH):
+    get_db(path).migrate()
+
+
+def insert_history(conn, data_list):
+    """열린 트랜잭션 안에서 결과 행을 한 번에 넣는다 (executemany). 새 행 id 목록 반환."""
+    rows = [(
+        item['Company'], item['Date'], item['File Name'], item['Item Name'],
+        item['Material'], item['Weight (kg)'], item['HS Code'],
+        item['Default Tax (KRW)'], item['exchange_rate'], item.get('Validation'), item.get('job_file_id'),
+        item.get('batch_file_id')
+    ) for item in data_list]
+    if rows:
+        conn.executemany('''
+            INSERT INTO history (username, date, filename, item_name, material, weight, hs_code, tax_krw, exchange_rate, validation, job_file_id, batch_file_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        # 쓰기 잠금을 잡은 한 트랜잭션 안이라 AUTOINCREMENT id 는 연속으로 붙는다
+        last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        return list(range(last - len(rows) + 1, last + 1))
+    return []
+
+
+def save_to_db(data_list, path=DB_PATH):
+    """저장 후 각 행 dict 에 history id 를 'id' 로 기록해 둔다 (검토 탭 수정 반영용)."""
+    if not data_list: return []
+    with telemetry.span('save_to_db', items=len(data_list)):
+        with get_db(path).transaction() as conn: ids = insert_history(conn, data_list)
+    for item, row_id in zip(data_list, ids): item['id'] = row_id
+    return ids
+
+
+def update_history_rows(username, data_list, path=DB_PATH):
+    """검토 탭에서 수정한 행(id 포함)을 history 에 반영. 다른 회사의 행은 건드리지 않는다."""
+    target_user = str(username).upper().strip()
+    rows = [(
+        item['Material'], item['Weight (kg)'], item['HS Code'], item['Default Tax (KRW)'],
+        item['exchange_rate'], item.get('Validation'), int(item['id']), target_user
+    ) for item in data_list]
+    with get_db(path).transaction() as conn:
+        conn.executemany('''
+            UPDATE history SET material = ?, weight = ?, hs_code = ?, tax_krw = ?, exchange_rate = ?, validation = ?
+            WHERE id = ? AND username = ?
+        ''', rows)
+    return len(rows)
+
+
+def load_from_db(username, path=DB_PATH):
+    import pandas as pd  # DataFrame 을 돌려주는 함수만 pandas 를 쓴다 (처음 호출할 때 import)
+    target_user = str(username).upper().strip()
+    with get_db(path).connection() as conn:
+        df = pd.read_sql_query("SELECT * FROM history WHERE username = ? ORDER BY id DESC", conn, params=(target_user,))
+    if not df.empty: df = df.rename(columns=HISTORY_COLUMNS)
+    return df
+
+
+def recalculate_history(username, cbam_db, path=DB_PATH):
+    """현재 CBAM_DB 계수/환율로 해당 회사의 저장된 세금을 일괄 재계산. (변경된 행 수, 건너뛴 행 수) 반환.
+    재질이 현재 계수 표에 없는 행은 세금을 0 으로 덮어쓰지 않고 그대로 둔다 (건너뛴 행)."""
+    import pandas as pd
+    target_user = str(username).upper().strip()
+    with get_db(path).transaction() as conn:
+        df = pd.read_sql_query("SELECT id, material, weight, hs_code, tax_krw, exchange_rate FROM history WHERE username = ?",
+                               conn, params=(target_user,))
+        if df.empty: return 0, 0
+        known = df['material'].isin(list(cbam_db.keys()))
+        df = df[known].reset_index(drop=True)
+        if df.empty: return 0, int((~known).sum())
+        calc = tax_engine.calculate_batch(df, cbam_db, material_col='material', weight_col='weight', hs_col='hs_code')
+        changed = (calc['Default Tax (KRW)'] != df['tax_krw']) | (calc['exchange_rate'] != df['exchange_rate'])
+        updates = calc.loc[changed, ['Default Tax (KRW)', 'exchange_rate', 'id']]
+        conn.executemany("UPDATE history SET tax_krw = ?, exchange_rate = ? WHERE id = ?",
+                         [(int(t), float(r), int(i)) for t, r, i in updates.itertuples(index=False)])
+    return int(changed.sum()), int((~known).sum())
+
+
+# ------------------------------------------------
+# 📄 history 페이지 조회 (키셋 페이지네이션 + 서버 측 필터/정렬)
+# ------------------------------------------------
+# 정렬 키 -> (열, 방향). 모두 (username, 열) 인덱스 + rowid(id) 순서를 그대로 탄다.
+HISTORY_SORTS = {
+    'newest': ('id', 'DESC'), 'oldest': ('id', 'ASC'),
+    'date_desc': ('date', 'DESC'), 'date_asc': ('date', 'ASC'),
+}
+
+
+def history_where(username, filters):
+    """filters: date_from / date_to ('YYYY-MM-DD', 양끝 포함), materials (목록), hs_prefix, filename (부분 일치)."""
+    filters = filters or {}
+    clauses, params = ["username = ?"], [str(username).upper().strip()]
+    if filters.get('date_from'):
+        clauses.append("date >= ?"); params.append(str(filters['date_from']))
+    if filters.get('date_to'):
+        # 'YYYY-MM-DD HH:MM' 문자열이므로 끝 날짜 하루 전체를 포함하도록 다음 문자('~')까지
+        clauses.append("date < ?"); params.append(str(filters['date_to']) + '~')
+    if filters.get('materials'):
+        mats = list(filters['materials'])
+        clauses.append(f"material IN ({', '.join('?' * len(mats))})"); params.extend(mats)
+    hs_prefix = ''.join(filter(str.isdigit, str(filters.get('hs_prefix') or '')))
+    if hs_prefix:
+        clauses.append("hs_code >= ? AND hs_code < ?"); params.extend([hs_prefix, hs_prefix + ':'])
+    if filters.get('filename'):
+        term = str(filters['filename']).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("filename LIKE ? ESCAPE '\\'"); params.append(f"%{term}%")
+    return " AND ".join(clauses), params
+
+
+def count_history(username, filters=None, path=DB_PATH):
+    where, params = history_where(username, filters)
+    with get_db(path).connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM history WHERE {where}", params).fetchone()[0]
+
+
+def query_history_page(username, filters=None, sort='newest', cursor=None, limit=50, path=DB_PATH):
+    """한 페이지만 읽는다. cursor 는 이전 페이지가 돌려준 next_cursor (첫 페이지는 None).
+    반환: (DataFrame, next_cursor) — 다음 페이지가 없으면 next_cursor 는 None."""
+    import pandas as pd
+    col, direction = HISTORY_SORTS.get(sort, HISTORY_SORTS['newest'])
+    where, params = history_where(username, filters)
+    if cursor is not None:
+        op = '<' if direction == 'DESC' else '>'
+        if col == 'id':
+            where += f" AND id {op} ?"; params.append(cursor[-1])
+        else:
+            where += f" AND ({col}, id) {op} (?, ?)"; params.extend(cursor)
+    order = f"id {direction}" if col == 'id' else f"{col} {direction}, id {direction}"
+    rows_sql = f"SELECT * FROM history WHERE {where} ORDER BY {order} LIMIT ?"
+    with get_db(path).connection() as conn:
+        df = pd.read_sql_query(rows_sql, conn, params=params + [int(limit) + 1])
+
+    next_cursor = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        last = df.iloc[-1]
+        next_cursor = (int(last['id']),) if col == 'id' else (last[col], int(last['id']))
+    return df.rename(columns=HISTORY_COLUMNS), next_cursor
+
+
+def history_materials(username, path=DB_PATH):
+    with get_db(path).connection() as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT material FROM history WHERE username = ? AND material IS NOT NULL ORDER BY material",
+            (str(username).upper().strip(),)
+        ).fetchall()
+    return [r[0] for r in rows]
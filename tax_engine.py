@@ -0,0 +1,140 @@
+# ==========================================
+# 🧮 세금 계산 & HS 검증 엔진 (단건 + DataFrame 일괄)
+# ==========================================
+# 단건 함수는 기존 app.py 로직 그대로이고, 일괄(batch) 함수는 같은 결과를
+# pandas/NumPy 벡터 연산으로 계산한다. 계수/환율이 바뀌었을 때 수만 건의
+# 히스토리를 한 번에 재계산하는 용도.
+# numpy / pandas 는 일괄 함수에서만 쓰므로 처음 호출할 때 import 한다 (앱 시작 시간 단축).
+
+DEFAULT_RATE = 1450
+DEFAULT_HS = '000000'
+MISSING_FACTOR = {"default": 0, "optimized": 0, "price": 0, "exchange_rate": DEFAULT_RATE}
+
+MSG_OTHER = "⚠️ 미등록 카테고리 (수동 확인 필요)"
+MSG_OK = "✅ 검증 완료 (정상)"
+
+
+def safe_float(value):
+    try: return float(str(value).replace(',', '').replace('kg', '').replace('KG', '').strip())
+    except: return 0.0
+
+
+def digits_only(value):
+    return ''.join(filter(str.isdigit, str(value)))
+
+
+def hs_mismatch_message(db_hs):
+    return f"🚩 HS코드 불일치 (DB권장: {db_hs})"
+
+
+def calculate_tax_logic(material, weight, cbam_db):
+    db = cbam_db.get(material, MISSING_FACTOR)
+    if weight <= 0: weight = 0.0
+    rate = db.get('exchange_rate', 1450.0)
+
+    bad_tax = int((weight/1000) * db['default'] * db['price'] * rate)
+
+    return {
+        "bad_tax": bad_tax, "material_display": material, "weight": weight,
+        "hs_code": db.get('hs_code', DEFAULT_HS), "exchange_rate": rate
+    }
+
+
+def validate_data(ai_hs, ai_mat, cbam_db):
+    db_hs = cbam_db.get(ai_mat, {}).get('hs_code', DEFAULT_HS)
+    if ai_mat == "Other": return MSG_OTHER
+
+    # 🚨 [핵심 수정 1] AI가 가져온 글자에서 '숫자'만 완벽하게 추출해서 비교
+    clean_ai = digits_only(ai_hs)
+    clean_db = digits_only(db_hs)
+
+    # 앞 4자리 비교 (숫자가 없으면 무조건 에러 방지)
+    if not clean_ai or clean_ai[:4] != clean_db[:4]:
+        return hs_mismatch_message(db_hs)
+
+    return MSG_OK
+
+
+# ------------------------------------------------
+# 📦 일괄 계산 (DataFrame)
+# ------------------------------------------------
+def build_factor_frame(cbam_db):
+    """CBAM_DB(dict) -> 카테고리 인덱스의 열 지향 DataFrame. 여러 번 재계산할 땐 한 번 만들어 재사용."""
+    import numpy as np
+    import pandas as pd
+    cats = list(cbam_db.keys())
+    rows = [cbam_db[c] for c in cats]
+    hs = [r.get('hs_code', DEFAULT_HS) for r in rows]
+    hs_digits = [digits_only(h) for h in hs]
+    return pd.DataFrame({
+        "default": np.array([r['default'] for r in rows], dtype=float),
+        "price": np.array([r['price'] for r in rows], dtype=float),
+        "exchange_rate": np.array([r.get('exchange_rate', 1450.0) for r in rows], dtype=float),
+        "hs_code": np.array(hs, dtype=object),
+        "hs4": np.array([d[:4] for d in hs_digits], dtype=object),
+        "mismatch_msg": np.array([hs_mismatch_message(h) for h in hs], dtype=object),
+    }, index=pd.Index(cats, name="category"))
+
+
+def _map_unique(series, fn):
+    """값 종류가 적은 열(HS 코드 등)은 고유값에만 fn 을 적용한 뒤 펼친다. str() 의미를 그대로 유지."""
+    import numpy as np
+    import pandas as pd
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    mapped = np.array([fn(u) for u in uniques], dtype=object)
+    return mapped[codes] if len(codes) else np.array([], dtype=object)
+
+
+def calculate_batch(df, cbam_db, material_col='Material', weight_col='Weight (kg)', hs_col='HS Code',
+                    fill_hs_defaults=False):
+    """df 의 모든 행에 calculate_tax_logic + validate_data 를 적용한 결과를 새 DataFrame 으로 반환.
+
+    추가/갱신되는 열: 'Default Tax (KRW)', 'exchange_rate', 'DB HS Code', 'Validation'.
+    fill_hs_defaults=True 이면 analyze_image 와 같이 HS 코드를 숫자만 남기고,
+    비었거나 '000000' 이면 DB 기본 HS 코드로 채운 뒤 검증한다.
+    cbam_db 에는 dict 또는 build_factor_frame() 결과를 넘길 수 있다.
+    """
+    import numpy as np
+    import pandas as pd
+    frame = cbam_db if isinstance(cbam_db, pd.DataFrame) else build_factor_frame(cbam_db)
+    out = df.copy()
+    if out.empty:
+        for col in ('Default Tax (KRW)', 'exchange_rate', 'DB HS Code', 'Validation'): out[col] = []
+        return out
+
+    materials = out[material_col]
+    pos = frame.index.get_indexer(materials)
+    known = pos >= 0
+    take = np.where(known, pos, 0)
+
+    def _col(name, missing):
+        vals = frame[name].to_numpy()[take]
+        return np.where(known, vals, missing)
+
+    # 💰 세금: int((w/1000) * default * price * rate) — 같은 연산 순서로 계산해 단건과 비트 단위로 일치
+    w = pd.to_numeric(out[weight_col], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    w = np.where(w <= 0, 0.0, w)
+    rate = _col("exchange_rate", float(DEFAULT_RATE)).astype(float)
+    default = _col("default", 0.0).astype(float)
+    price = _col("price", 0.0).astype(float)
+    out['Default Tax (KRW)'] = np.trunc((w / 1000) * default * price * rate).astype(np.int64)
+    out['exchange_rate'] = rate
+
+    db_hs = _col("hs_code", DEFAULT_HS)
+    out['DB HS Code'] = db_hs
+
+    # 🔢 HS 코드: 숫자만 추출 (+ 필요 시 DB 기본값 채우기)
+    if fill_hs_defaults:
+        ai_digits = _map_unique(out[hs_col], digits_only)
+        use_db = (ai_digits == '') | (ai_digits == DEFAULT_HS)
+        out[hs_col] = np.where(use_db, db_hs, ai_digits)
+    hs_values = out[hs_col]
+
+    # ✅ 검증: 앞 4자리 비교
+    ai4 = _map_unique(hs_values, lambda v: digits_only(v)[:4])
+    has_digits = _map_unique(hs_values, lambda v: bool(digits_only(v))).astype(bool)
+    db4 = _col("hs4", DEFAULT_HS[:4])
+    ok = has_digits & (ai4 == db4)
+    msg = np.where(ok, MSG_OK, _col("mismatch_msg", hs_mismatch_message(DEFAULT_HS)))
+    out['Validation'] = np.where((materials == "Other").to_numpy(), MSG_OTHER, msg)
+    return out
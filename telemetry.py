@@ -0,0 +1,201 @@
+# ==========================================
+# 📈 단계별 소요 시간 계측 (SQLite metrics 테이블 + 선택적 OpenTelemetry)
+# ==========================================
+# with span("analyze_image.model_call", payload_bytes=...) as s: ... 처럼 감싸면
+# 소요 시간 / 크기 / 토큰 수 / 예외 종류를 기록한다. 기록은 메모리 버퍼에 쌓였다가
+# 백그라운드 스레드가 모아서 한 트랜잭션으로 저장하므로 분석 경로에서는 DB 를 기다리지 않는다.
+# OpenTelemetry 가 설치되어 있고 TELEMETRY_OTEL=1 (또는 enable_otel()) 이면 같은 구간을 span 으로도 내보낸다.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+FLUSH_INTERVAL = 2.0
+FLUSH_BATCH = 200
+MAX_BUFFER = 20000  # 저장이 계속 실패해도 메모리가 끝없이 늘지 않도록
+RETENTION_DAYS = 30
+
+METRIC_COLUMNS = ('ts', 'stage', 'duration_ms', 'ok', 'error', 'payload_bytes', 'tokens_in', 'tokens_out', 'items', 'username', 'detail')
+
+
+class Span:
+    """span() 안에서 결과를 채워 넣는 용도 (s.items = ..., s.tokens(response) 등).
+    예외를 안에서 잡아 처리했지만 실패로 남기고 싶으면 s.error 에 예외 이름을 넣는다."""
+    __slots__ = ('stage', 'payload_bytes', 'tokens_in', 'tokens_out', 'items', 'username', 'detail', 'error')
+
+    def __init__(self, stage, payload_bytes=None, items=None, username=None, **detail):
+        self.stage = stage
+        self.payload_bytes, self.items, self.username = payload_bytes, items, username
+        self.tokens_in = self.tokens_out = None
+        self.detail = detail
+        self.error = None
+
+    def tokens(self, response):
+        """Gemini 응답의 usage_metadata 에서 입력/출력 토큰 수를 읽는다 (없으면 그대로)."""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None: return
+        self.tokens_in = getattr(usage, 'prompt_token_count', None)
+        self.tokens_out = getattr(usage, 'candidates_token_count', None)
+
+
+class MetricsRecorder:
+    """프로세스당 하나. record() 는 버퍼에 넣기만 하고, 저장은 백그라운드 스레드가 맡는다."""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self.enabled = True
+        self.exporters = []
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_prune = 0.0
+
+    def record(self, row):
+        if not self.enabled: return
+        for exporter in self.exporters:
+            try: exporter(row)
+            except Exception as e: print(f"Telemetry exporter error: {e}")
+        with self._lock:
+            if len(self._buffer) >= MAX_BUFFER: self._buffer.pop(0)
+            self._buffer.append(row)
+            n = len(self._buffer)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="cbam-metrics", daemon=True)
+                self._thread.start()
+        if n >= FLUSH_BATCH: self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            try: self.flush()
+            except Exception as e: print(f"Telemetry flush error: {e}")
+
+    def flush(self):
+        """버퍼를 metrics 테이블에 저장. 열린 트랜잭션 안(같은 스레드)에서는 부르지 말 것."""
+        import storage  # storage 가 이 모듈을 import 하므로 순환을 피해 늦게 가져온다
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows: return 0
+        path = self.db_path or storage.DB_PATH
+        try:
+            with storage.get_db(path).transaction() as conn:
+                conn.executemany(f"INSERT INTO metrics ({', '.join(METRIC_COLUMNS)}) VALUES ({', '.join('?' * len(METRIC_COLUMNS))})",
+                                 [tuple(r.get(c) for c in METRIC_COLUMNS) for r in rows])
+                if time.time() - self._last_prune > 3600:
+                    conn.execute("DELETE FROM metrics WHERE ts < ?", (time.time() - RETENTION_DAYS * 86400,))
+                    self._last_prune = time.time()
+        except Exception:
+            with self._lock: self._buffer[:0] = rows[-MAX_BUFFER:]  # 다음 주기에 다시 시도
+            raise
+        return len(rows)
+
+
+RECORDER = MetricsRecorder()
+
+
+@contextmanager
+def span(stage, **attrs):
+    """stage 구간을 계측한다. 예외는 그대로 다시 던지고, 예외 클래스 이름을 error 로 남긴다."""
+    s = Span(stage, **attrs)
+    start_wall, start = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        error = error or s.error
+        RECORDER.record({
+            'ts': start_wall, 'stage': stage, 'duration_ms': (time.perf_counter() - start) * 1000,
+            'ok': 0 if error else 1, 'error': error, 'payload_bytes': s.payload_bytes,
+            'tokens_in': s.tokens_in, 'tokens_out': s.tokens_out, 'items': s.items, 'username': s.username,
+            'detail': json.dumps(s.detail, ensure_ascii=False, default=str) if s.detail else None,
+        })
+
+
+def record(stage, duration_ms, **attrs):
+    """구간으로 감쌀 수 없는 값(첫 항목까지 걸린 시간 등)을 한 건 남긴다."""
+    row = {'ts': time.time() - duration_ms / 1000, 'stage': stage, 'duration_ms': duration_ms, 'ok': 1, 'error': None}
+    row.update({k: attrs.get(k) for k in ('payload_bytes', 'tokens_in', 'tokens_out', 'items', 'username')})
+    RECORDER.record(row)
+
+
+# ------------------------------------------------
+# 🔭 OpenTelemetry (설치되어 있을 때만)
+# ------------------------------------------------
+class OTelExporter:
+    """기록 한 건 -> 같은 시작/끝 시각의 OpenTelemetry span. TracerProvider / OTLP 내보내기 설정은
+    배포 환경(opentelemetry-instrument, OTEL_* 환경 변수 등)을 그대로 따른다."""
+
+    def __init__(self, service_name='cbam-master'):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer(service_name)
+
+    def __call__(self, row):
+        start_ns = int(row['ts'] * 1e9)
+        otel_span = self._tracer.start_span(row['stage'], start_time=start_ns)
+        for key in ('payload_bytes', 'tokens_in', 'tokens_out', 'items', 'username'):
+            if row.get(key) is not None: otel_span.set_attribute(f"cbam.{key}", row[key])
+        if row.get('error'):
+            otel_span.set_attribute('error.type', row['error'])
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+        otel_span.end(end_time=start_ns + int(row['duration_ms'] * 1e6))
+
+
+def enable_otel(service_name='cbam-master'):
+    """OpenTelemetry 가 없으면 False."""
+    if any(isinstance(e, OTelExporter) for e in RECORDER.exporters): return True
+    try: RECORDER.exporters.append(OTelExporter(service_name))
+    except ImportError: return False
+    return True
+
+
+if os.environ.get('TELEMETRY_OTEL', '').lower() in ('1', 'true', 'yes'): enable_otel()
+
+
+# ------------------------------------------------
+# 📊 조회 (관리자 탭)
+# ------------------------------------------------
+# 조회 함수만 pandas 를 쓰므로 계측(span) 쪽은 pandas 없이 import 된다
+def load_metrics(since_ts, path=None):
+    import pandas as pd
+    import storage
+    with storage.get_db(path or storage.DB_PATH).connection() as conn:
+        return pd.read_sql_query("SELECT ts, stage, duration_ms, ok, error, payload_bytes, tokens_in, tokens_out, items FROM metrics WHERE ts >= ?",
+                                 conn, params=(float(since_ts),))
+
+
+def stage_summary(df):
+    """단계별 건수 / 오류율 / p50·p95·p99 (ms) / 평균 크기·토큰."""
+    import pandas as pd
+    if df.empty: return pd.DataFrame()
+    g = df.groupby('stage')
+    out = g['duration_ms'].quantile([0.5, 0.95, 0.99]).unstack()
+    out.columns = ['p50_ms', 'p95_ms', 'p99_ms']
+    out.insert(0, 'count', g.size())
+    out.insert(1, 'error_rate', 1 - g['ok'].mean())
+    out['avg_payload_kb'] = g['payload_bytes'].mean() / 1024
+    out['tokens_in'] = g['tokens_in'].sum()
+    out['tokens_out'] = g['tokens_out'].sum()
+    return out.sort_values('p95_ms', ascending=False)
+
+
+def stage_percentiles_over_time(df, bucket='1h', quantile=0.95):
+    """(시간 구간 x 단계) 표. 값은 구간별 quantile 지연(ms)."""
+    import pandas as pd
+    if df.empty: return pd.DataFrame()
+    t = pd.to_datetime(df['ts'], unit='s').dt.floor(bucket)
+    return df.assign(t=t).groupby(['t', 'stage'])['duration_ms'].quantile(quantile).unstack('stage')
+
+
+def error_summary(df):
+    import pandas as pd
+    if df.empty: return pd.DataFrame()
+    errs = df[df['ok'] == 0]
+    if errs.empty: return pd.DataFrame()
+    return errs.groupby(['stage', 'error']).size().rename('count').reset_index().sort_values('count', ascending=False)
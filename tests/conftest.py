@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """테스트마다 새 SQLite 파일 (마이그레이션까지 끝난 상태)."""
+    path = str(tmp_path / "cbam.db")
+    storage.init_db(path)
+    return path
@@ -0,0 +1,30 @@
+from benchmark import COMPARE_SETTINGS, compare
+
+SETTINGS = {'seed': 0, 'repeat': 3, 'latency': 0.05, 'error_rate': 0.0, 'max_retries': 3, 'batch_size': 1,
+            'workers': 4, 'stream': False, 'telemetry': False}
+
+
+def _report(seconds, **settings):
+    settings = dict(SETTINGS, **settings)
+    results = {f"{name}[small]": {"name": name, "seconds": s, "settings": settings} for name, s in seconds.items()}
+    return {"meta": {"args": settings}, "results": results}
+
+
+def test_compare_flags_regression_with_same_settings():
+    regressions, compared = compare(_report({'save_to_db': 0.2, 'end_to_end': 1.0}),
+                                    _report({'save_to_db': 0.1, 'end_to_end': 1.0}))
+    assert compared == 2
+    assert [r[0] for r in regressions] == ['save_to_db[small]']
+
+
+def test_compare_skips_results_measured_with_other_settings():
+    regressions, compared = compare(_report({'end_to_end': 3.0}, stream=True, batch_size=3, error_rate=0.2),
+                                    _report({'end_to_end': 1.0}))
+    assert (regressions, compared) == ([], 0)
+
+
+def test_compare_falls_back_to_baseline_meta_args():
+    baseline = _report({'end_to_end': 1.0}, workers=8)
+    for result in baseline['results'].values(): del result['settings']  # 항목별 settings 가 없던 예전 결과 파일
+    assert compare(_report({'end_to_end': 3.0}), baseline) == ([], 0)
+    assert set(SETTINGS) == set(COMPARE_SETTINGS)
@@ -0,0 +1,99 @@
+import multiprocessing as mp
+import threading
+
+import credit_ledger
+import job_queue
+import storage
+
+
+def _balance(user, path):
+    return credit_ledger.account(user, path=path)['balance']
+
+
+def _statuses(ids, path):
+    with storage.get_db(path).connection() as conn:
+        return [conn.execute("SELECT status FROM credit_reservations WHERE id = ?", (i,)).fetchone()[0] for i in ids]
+
+
+def _reserve_in_process(args):
+    path, refs = args
+    return credit_ledger.reserve('acme', refs, path=path) is not None
+
+
+def test_concurrent_reserve_does_not_oversell(db_path):
+    credit_ledger.sync_accounts([('acme', 10)], path=db_path)
+    barrier, results = threading.Barrier(24), []
+
+    def _run(n):
+        barrier.wait()
+        results.append(credit_ledger.reserve('acme', [f"t{n}.jpg"], path=db_path))
+
+    threads = [threading.Thread(target=_run, args=(n,)) for n in range(24)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    granted = [r for r in results if r is not None]
+    assert len(granted) == 10
+    assert _balance('acme', db_path) == 0
+    assert credit_ledger.account('acme', path=db_path)['reserved'] == 10
+
+
+def test_concurrent_reserve_across_processes(db_path):
+    credit_ledger.sync_accounts([('acme', 10)], path=db_path)
+    with mp.get_context('spawn').Pool(4) as pool:
+        granted = pool.map(_reserve_in_process, [(db_path, ['a.jpg', 'b.jpg', 'c.jpg'])] * 8)
+    assert sum(granted) == 3  # 3장씩 3번 = 9, 네 번째부터는 잔액 부족
+    assert _balance('acme', db_path) == 1
+
+
+def test_reserve_refuses_unknown_account_and_allows_unlimited(db_path):
+    assert credit_ledger.reserve('nobody', ['a.jpg'], path=db_path) is None
+    credit_ledger.sync_accounts([('vip', credit_ledger.UNLIMITED_CREDITS)], path=db_path)
+    assert len(credit_ledger.reserve('vip', ['a.jpg'] * 5, path=db_path)) == 5
+    assert _balance('vip', db_path) == credit_ledger.UNLIMITED_CREDITS
+
+
+def test_settle_is_idempotent(db_path):
+    credit_ledger.sync_accounts([('acme', 10)], path=db_path)
+    ids = credit_ledger.reserve('acme', ['a.jpg', 'b.jpg', 'c.jpg'], path=db_path)
+    assert _balance('acme', db_path) == 7
+
+    assert credit_ledger.settle(ids, [True, False, False], path=db_path) == (1, 2)
+    assert _balance('acme', db_path) == 9
+    # 같은 결과를 다시 보내거나 반대로 보내도 이미 처리된 예약은 바뀌지 않는다
+    assert credit_ledger.settle(ids, [True, False, False], path=db_path) == (0, 0)
+    assert credit_ledger.settle(ids, [False, True, True], path=db_path) == (0, 0)
+    assert credit_ledger.refund(ids, path=db_path) == 0
+    assert _balance('acme', db_path) == 9
+    assert _statuses(ids, db_path) == ['committed', 'refunded', 'refunded']
+
+
+def test_sync_accounts_applies_sheet_delta_once(db_path):
+    credit_ledger.sync_accounts([('acme', 10)], path=db_path)
+    credit_ledger.reserve('acme', ['a.jpg', 'b.jpg'], path=db_path)
+    assert _balance('acme', db_path) == 8
+
+    # 같은 시트 값을 여러 번(여러 프로세스가) 반영해도 잔액은 그대로
+    for _ in range(3): credit_ledger.sync_accounts([('acme', 10)], path=db_path)
+    assert _balance('acme', db_path) == 8
+
+    # 관리자가 10 -> 15 로 올리면 차이(+5)만 한 번 더해진다
+    for _ in range(3): credit_ledger.sync_accounts([(' Acme ', 15)], path=db_path)
+    assert _balance('acme', db_path) == 13
+
+    credit_ledger.sync_accounts([('acme', 12)], path=db_path)
+    assert _balance('acme', db_path) == 10
+
+
+def test_expire_reservations_skips_queued_and_running_files(db_path):
+    credit_ledger.sync_accounts([('acme', 10)], path=db_path)
+    queued, running, orphan = credit_ledger.reserve('acme', ['q.jpg', 'r.jpg', 'o.jpg'], path=db_path)
+    job_queue.enqueue_job('acme', [(b'r', 'r.jpg'), (b'q', 'q.jpg')], reservations=[running, queued], path=db_path)
+    assert len(job_queue.claim_files('w1', limit=1, path=db_path)) == 1  # r.jpg -> running
+    with storage.get_db(db_path).transaction() as conn:
+        conn.execute("UPDATE credit_reservations SET created_at = 0")
+
+    assert credit_ledger.expire_reservations(ttl=60, path=db_path) == 1
+    assert _statuses([queued, running, orphan], db_path) == ['reserved', 'reserved', 'refunded']
+    assert _balance('acme', db_path) == 8
+    assert credit_ledger.expire_reservations(ttl=60, path=db_path) == 0
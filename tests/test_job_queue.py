@@ -0,0 +1,46 @@
+import time
+
+import job_queue
+import storage
+from analysis_engine import failed_result
+
+
+def _file_status(file_id, path):
+    with storage.get_db(path).connection() as conn:
+        return conn.execute("SELECT status, worker FROM job_files WHERE id = ?", (file_id,)).fetchone()
+
+
+def _expire_heartbeats(path):
+    with storage.get_db(path).transaction() as conn:
+        conn.execute("UPDATE job_files SET heartbeat = 0")
+
+
+def test_keep_alive_renews_lease_while_processing(db_path):
+    job_queue.enqueue_job('acme', [(b'a', 'a.jpg')], path=db_path)
+    (file_id, *_), = job_queue.claim_files('w1', path=db_path)
+    with job_queue.keep_alive('w1', [file_id], interval=0.02, path=db_path):
+        _expire_heartbeats(db_path)
+        time.sleep(0.2)
+        job_queue.requeue_stale(lease_seconds=5, path=db_path)
+        assert _file_status(file_id, db_path) == ('running', 'w1')
+
+    _expire_heartbeats(db_path)  # 블록을 나오면 갱신이 멈춘다
+    time.sleep(0.1)
+    job_queue.requeue_stale(lease_seconds=5, path=db_path)
+    assert _file_status(file_id, db_path) == ('queued', None)
+
+
+def test_complete_file_requires_owning_worker(db_path):
+    job_id = job_queue.enqueue_job('acme', [(b'a', 'a.jpg')], path=db_path)
+    (file_id, *_), = job_queue.claim_files('w1', path=db_path)
+    _expire_heartbeats(db_path)
+    job_queue.requeue_stale(lease_seconds=5, path=db_path)
+    assert job_queue.claim_files('w2', path=db_path)[0][0] == file_id
+
+    rows = failed_result('a.jpg', 'acme')
+    assert job_queue.complete_file(file_id, job_id, rows, 'w1', path=db_path) is False  # 임대를 잃은 워커
+    assert job_queue.renew_leases('w1', [file_id], path=db_path) == 0
+    assert job_queue.complete_file(file_id, job_id, rows, 'w2', path=db_path) is True
+    assert job_queue.complete_file(file_id, job_id, rows, 'w2', path=db_path) is False
+    assert job_queue.job_progress(job_id, path=db_path)['failed'] == 1
+    assert len(job_queue.job_results(job_id, path=db_path)) == 1
@@ -0,0 +1,36 @@
+import difflib
+import random
+
+from material_matcher import FUZZY_CUTOFF, FuzzyIndex, MaterialMatcher
+
+CATALOG = [
+    "Steel (Pipes/Tubes)", "Aluminum (Pipes/Tubes)", "Steel (Wire)", "Steel (Structures)", "Steel (Bolts/Screws)",
+    "Aluminum (Ingots)", "Aluminum (Bars/Rods)", "Aluminum (Foil)", "Aluminum (Sheets/Plates)", "Cement (Clinker)",
+    "Iron Ore (Pellets)", "Fertilizers (Ammonia)", "Electricity", "Pig Iron", "Hydrogen",
+]
+
+
+def _difflib(word, keys=CATALOG):
+    match = difflib.get_close_matches(word, keys, n=1, cutoff=FUZZY_CUTOFF)
+    return match[0] if match else None
+
+
+def test_fuzzy_index_agrees_with_get_close_matches():
+    rng = random.Random(0)
+    alphabet = 'abcdefghijklmnopqrstuvwxyzAEHIS ()/-'
+    words = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))) for _ in range(3000)]
+    words += [k.lower() for k in CATALOG] + [k[:n] for k in CATALOG for n in (1, 2, 4, 8)] + ['He', 'steel', 'alu', '']
+    index = FuzzyIndex(CATALOG)
+    assert [index.best(w) for w in words] == [_difflib(w) for w in words]
+
+
+def test_match_without_shared_bigram():
+    # 'He' 와 'Hydrogen' 은 bigram 을 공유하지 않지만 difflib 기준 0.4 를 넘는다
+    assert _difflib('He') == 'Hydrogen'
+    assert MaterialMatcher(CATALOG).match('x', 'He') == 'Hydrogen'
+
+
+def test_synonyms_resolve_to_category():
+    matcher = MaterialMatcher(CATALOG, synonyms={'Portland cement clinker': 'Cement (Clinker)', 'Ghost': 'Missing'})
+    assert matcher.match('powder', 'portland cement clinkr') == 'Cement (Clinker)'
+    assert matcher.match('x', 'Ghost') != 'Missing'
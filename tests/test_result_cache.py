@@ -0,0 +1,27 @@
+from result_cache import ResultCache
+
+
+def test_put_get_and_stats(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "cache.db"))
+    assert cache.get("k") is None
+    assert cache.put("k", [{"item": "bolt"}]) is True
+    assert cache.get("k") == [{"item": "bolt"}]
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1, "errors": 0, "hit_rate": 0.5}
+
+
+def test_stats_survives_broken_connection(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "cache.db"))
+    cache.put("k", [{"item": "bolt"}])
+    cache._conn.close()  # 잠김 / 손상처럼 쿼리가 sqlite3.Error 를 던지는 상태
+    stats = cache.stats()
+    assert stats["entries"] is None and stats["errors"] == 1
+    assert cache.get("k") is None
+
+
+def test_corrupt_cache_file_degrades_to_misses(tmp_path):
+    path = tmp_path / "cache.db"
+    path.write_bytes(b"not a sqlite database" * 100)
+    cache = ResultCache(path=str(path))
+    assert cache.get("k") is None
+    assert cache.put("k", []) is False
+    assert cache.stats()["entries"] is None
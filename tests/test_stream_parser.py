@@ -0,0 +1,76 @@
+import io
+import json
+
+import pytest
+
+from analysis_engine import AnalysisContext, ItemStreamParser, analyze_image, extract_json
+from benchmark import FakeResponse, make_categories, make_cbam_csv, make_invoice_images
+from cbam_factors import fetch_factor_table
+from result_cache import ResultCache
+
+ITEMS = [
+    {"item": "Steel Pipe {SCH40}", "material": "Iron or steel products", "weight": "1,200.5 kg", "hs_code": "730400"},
+    {"item": "Bolt \"M12\" [zinc]", "material": "Iron or steel products", "weight": "35 kg", "hs_code": "731800"},
+    {"item": "알루미늄 판재 \\ 6061", "material": "Aluminium", "weight": "820 kg", "hs_code": "760100"},
+]
+RESPONSE = "Here is the result:\n```json\n" + json.dumps({"items": ITEMS}, ensure_ascii=False, indent=2) + "\n```\nDone."
+
+
+def _feed(text, size):
+    parser, items = ItemStreamParser(), []
+    for i in range(0, len(text), size): items.extend(parser.feed(text[i:i + size]))
+    return items
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16, 64, len(RESPONSE)])
+def test_chunked_feed_matches_full_parse(size):
+    assert _feed(RESPONSE, size) == extract_json(RESPONSE)['items'] == ITEMS
+
+
+def test_items_are_yielded_as_soon_as_they_close():
+    parser = ItemStreamParser()
+    first = RESPONSE.index('}', RESPONSE.index('"730400"')) + 1
+    assert parser.feed(RESPONSE[:first - 1]) == []
+    assert parser.feed(RESPONSE[first - 1:first]) == [ITEMS[0]]
+
+
+def test_truncated_tail_keeps_closed_items():
+    cut = RESPONSE[:RESPONSE.index('"760100"')]
+    assert _feed(cut, 5) == ITEMS[:2]
+    with pytest.raises(ValueError): extract_json(cut)
+
+
+def test_broken_object_is_skipped_and_tail_ignored():
+    text = '{"items": [{"item": "a", "weight": 1}, {"item": oops}, {"item": "b"}]}\n```\n{"items": [{"item": "c"}]}'
+    assert _feed(text, 4) == [{"item": "a", "weight": 1}, {"item": "b"}]
+
+CBAM_DB = fetch_factor_table(io.StringIO(make_cbam_csv(make_categories(20))))
+
+
+class _Model:
+    def __init__(self, text):
+        self.text = text
+
+    def generate_content(self, parts, stream=False):
+        return iter([FakeResponse(self.text[i:i + 16]) for i in range(0, len(self.text), 16)])
+
+
+def _analyze(text, tmp_path):
+    cache = ResultCache(path=str(tmp_path / "cache.db"))
+    ctx = AnalysisContext(CBAM_DB, model=_Model(text), cache=cache, stream=True)
+    emitted = []
+    ctx.on_item = lambda filename, idx, row: emitted.append(row)
+    return analyze_image(make_invoice_images(1)[0], "a.jpg", "acme", ctx), emitted, cache
+
+
+def test_truncated_stream_fails_the_whole_file(tmp_path):
+    rows, emitted, cache = _analyze(RESPONSE[:RESPONSE.index('"760100"')], tmp_path)
+    assert len(emitted) > 1  # 받은 항목은 화면에 먼저 보였지만
+    assert [r["Validation"] for r in rows] == ["❌ 분석 실패 (에러)"]  # 결과는 실패 한 행 (저장 / 과금 안 됨)
+    assert cache.stats()["entries"] == 0
+
+
+def test_complete_stream_is_cached(tmp_path):
+    rows, _, cache = _analyze(RESPONSE, tmp_path)
+    assert [r["Item Name"] for r in rows] == [i["item"] for i in ITEMS]
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,124 @@
+# ==========================================
+# 👤 사용자 목록 (구글 시트 CSV -> 메모리 색인, 백그라운드 갱신)
+# ==========================================
+# 로그인 화면은 목록을 기다리지 않고 바로 그린다. 목록은 서버가 뜨자마자 백그라운드에서 받아 두고,
+# max_age 가 지나면 기존 목록을 그대로 쓰면서 뒤에서 새로 받는다 (기존 st.cache_data(ttl=60) 과 같은 주기).
+# 갱신은 조건부 요청(ETag)으로 받아 바뀌지 않았으면 파싱을 건너뛰고, 바뀐 사용자 항목만 색인에서 교체한다.
+# 색인은 아이디 -> 사용자 dict 이며 비밀번호는 프로세스별 솔트를 붙인 해시로만 들고 있는다.
+# 비밀번호가 들어 있는 표라서 계수 표(cbam_factors)처럼 디스크 스냅샷은 남기지 않는다.
+import csv
+import hashlib
+import hmac
+import io
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+_SALT = os.urandom(16)
+
+
+def _hash_password(password):
+    return hashlib.sha256(_SALT + str(password).encode('utf-8')).digest()
+
+
+def fetch_user_csv(url, etag=None, timeout=15):
+    """(CSV 텍스트, ETag). 서버가 변경 없음(304)이라고 답하면 텍스트는 None."""
+    req = urllib.request.Request(url, headers={'If-None-Match': etag} if etag else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.read().decode('utf-8-sig'), resp.headers.get('ETag')
+    except urllib.error.HTTPError as e:
+        if e.code == 304: return None, etag
+        raise
+
+
+def _to_int(value):
+    try: return int(float(value))
+    except (TypeError, ValueError): return 0
+
+
+def parse_user_csv(text):
+    """CSV -> {아이디: (사용자 dict, ...)}. 열 이름은 소문자로, 값은 앞뒤 공백을 정리한다."""
+    reader = csv.DictReader(io.StringIO(text))
+    users = {}
+    for raw in reader:
+        row = {str(k).strip().lower(): str(v if v is not None else '').strip() for k, v in raw.items() if k is not None}
+        if 'username' not in row: continue
+        row['active'] = row.get('active', '').lower()
+        row['credits'] = _to_int(row.get('credits'))
+        row['password'] = _hash_password(row.get('password', ''))
+        users.setdefault(row['username'], []).append(row)
+    return {name: tuple(rows) for name, rows in users.items()}
+
+
+class UserDirectory:
+    """프로세스당 하나. get() / authenticate() 는 네트워크를 기다리지 않는다 (wait 를 준 경우 첫 다운로드만 기다림).
+    on_change(바뀐 사용자 dict 목록) 는 새로 받은 목록에서 추가 / 변경된 사용자가 있을 때 백그라운드 스레드에서 불린다."""
+
+    def __init__(self, url, max_age=60, fetch=fetch_user_csv, on_change=None):
+        self.url, self.max_age = url, max_age
+        self._fetch = fetch
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_attempt = 0.0
+        self._index = None
+        self._etag = None
+        self._digest = None
+        self.loaded_at = 0.0
+        self.last_error = None
+        self.ready = threading.Event()
+        self.refresh_async()
+
+    def get(self, wait=0):
+        """{아이디: (사용자 dict, ...)}. 아직 한 번도 받지 못했으면 None."""
+        if wait and not self.ready.is_set(): self.ready.wait(wait)
+        if time.time() - self.loaded_at > self.max_age and time.time() >= self._next_attempt: self.refresh_async()
+        return self._index
+
+    def authenticate(self, username, password):
+        """활성(active == 'o') 사용자 중 비밀번호가 맞는 항목 (없으면 None)."""
+        digest = _hash_password(password)
+        for user in (self._index or {}).get(username, ()):
+            if user['active'] == 'o' and hmac.compare_digest(user['password'], digest): return user
+        return None
+
+    def refresh(self):
+        try:
+            text, etag = self._fetch(self.url, self._etag)
+        except Exception as e:
+            self.last_error = e
+            self._next_attempt = time.time() + min(self.max_age, 10)
+            print(f"User list refresh failed: {e}")
+            return None
+        self.last_error = None
+        digest = hashlib.sha256(text.encode('utf-8')).digest() if text is not None else self._digest
+        if digest == self._digest and self._index is not None:  # 변경 없음
+            self._etag, self.loaded_at = etag, time.time()
+            return []
+        new = parse_user_csv(text)
+        old = self._index or {}
+        changed = [name for name, rows in new.items() if old.get(name) != rows]
+        # 바뀐 항목만 교체한 새 dict 로 한 번에 바꿔 끼운다 (읽는 쪽은 잠금 없이 항상 온전한 색인을 본다)
+        index = {name: old[name] for name in new if name in old and name not in changed}
+        index.update((name, new[name]) for name in changed)
+        self._index, self._etag, self._digest, self.loaded_at = index, etag, digest, time.time()
+        if changed and self.on_change:
+            try: self.on_change([user for name in changed for user in index[name]])
+            except Exception as e: print(f"User list on_change failed: {e}")
+        return changed
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing: return
+            self._refreshing = True
+
+        def _run():
+            try: self.refresh()
+            finally:
+                with self._lock: self._refreshing = False
+                self.ready.set()  # 실패해도 기다리는 쪽은 풀어 준다
+
+        threading.Thread(target=_run, name="cbam-user-refresh", daemon=True).start()